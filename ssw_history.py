@@ -113,20 +113,18 @@ def changes(before, after, date):
         retval.append((date.date(), '%s appeared in sector %d' % (diff[0], diff[1])))
     return retval
 
-def _changes_from_dates(dates, expected):
+def _changes_from_epochs(field):
     '''
     Code shared between planet_changes() and npc_store_changes().
-    Calls expected() passing each of the datetimes in the dates list.
-    Calls changes() to compare successive return values.
+    Goes through the game rule epochs, calling changes() to compare
+    the specified field of the GameRules from one epoch to the next.
     '''
-    # Get the list of items for each date (add 1s to be sure we get the 'after' list)
-    items = []
-    for date in dates:
-        items.append(expected(date + datetime.timedelta(seconds=1)))
-    # Now find the differences between each pair
     retval = []
-    for i in range(1,len(dates)):
-        retval += changes(items[i - 1], items[i], dates[i])
+    before = ssw_sector_map.game_rules(cycle_1_start)
+    for start, rules in ssw_sector_map.game_rule_epochs():
+        if (start > cycle_1_start) and (getattr(rules, field) != getattr(before, field)):
+            retval += changes(getattr(before, field), getattr(rules, field), start)
+            before = rules
     retval.sort()
     return retval
 
@@ -135,35 +133,14 @@ def planet_changes():
     When planets moved and appeared
     Returns a list of (date, event string) tuples
     '''
-    key_dates = [cycle_1_start,
-                 ssw_sector_map.flambe_added_datetime,
-                 ssw_sector_map.planets_moved_datetime,
-                 ssw_sector_map.planets_moved_datetime,
-                 ssw_sector_map.planets_moved_datetime,
-                 ssw_sector_map.planets_moved_datetime,
-                 ssw_sector_map.planets_moved_datetime,
-                 ssw_sector_map.reboot_datetime,
-                 ssw_sector_map.hedrok_removed_datetime,
-                 ssw_sector_map.hedrok_restored_datetime,
-                 ssw_sector_map.deep_six_removed_datetime,
-                 ssw_sector_map.phallorus_removed_datetime,
-                 ssw_sector_map.eroticon_69_removed_datetime,
-                 ssw_sector_map.cycle_start[21],
-                ]
-    return _changes_from_dates(key_dates, ssw_sector_map.expected_planets)
+    return _changes_from_epochs('planets')
 
 def npc_store_changes():
     '''
     When NPC stores moved and appeared
     Returns a list of (date, event string) tuples
     '''
-    # Dates of interest
-    key_dates = [cycle_1_start,
-                 ssw_sector_map.leroy_tongs_datetime,
-                 ssw_sector_map.planets_moved_datetime,
-                 ssw_sector_map.clingons_datetime,
-                 ssw_sector_map.gobbles_datetime]
-    return _changes_from_dates(key_dates, ssw_sector_map.expected_npc_stores)
+    return _changes_from_epochs('npc_stores')
 
 def mars():
     '''
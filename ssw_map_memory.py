@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+'''
+Script to measure how much memory each parsed sector map takes,
+when lots of them are kept, with and without low_memory.
+'''
+
+# Copyright 2016 Squiffle
+
+# Measured with two maps from different cycles, each parsed 3 times,
+# each map after the first takes about:
+#                                  normal    low_memory
+#  all fields                      4.3MB     70KB
+#  ssw_track_movement's fields     3.7MB     25KB
+# except that with low_memory and all fields, the first map from another cycle
+# takes about 400KB, mostly for adding that cycle's links to the MapValues.
+
+from __future__ import absolute_import
+from __future__ import print_function
+import sys, getopt, gc, unittest
+try:
+    import tracemalloc
+except ImportError:
+    # Not available in Python 2
+    tracemalloc = None
+import ssw_sector_map2 as ssw_sector_map
+
+version = 1.00
+
+def memory_per_map(pages, fields=None, low_memory=False):
+    '''
+    Parses each of the pages in turn, keeping all the maps, and
+    returns a list of the number of bytes each map added.
+    With low_memory, the maps share one MapValues, as they would in a script.
+    '''
+    values = ssw_sector_map.MapValues()
+    maps = []
+    sizes = []
+    tracemalloc.start()
+    try:
+        for page in pages:
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            maps.append(ssw_sector_map.SectorMapParser(page,
+                                                       fields,
+                                                       low_memory=low_memory,
+                                                       values=values))
+            gc.collect()
+            sizes.append(tracemalloc.get_traced_memory()[0] - before)
+    finally:
+        tracemalloc.stop()
+    return sizes
+
+def usage(progname):
+    '''
+    Prints usage information
+    '''
+    print("Usage: %s [-f fields|script] [-r repeats] map_filenames" % progname)
+    print()
+    print(" Measure the memory each parsed map takes, with and without low_memory")
+    print(" Each map is parsed repeats times (default 3)")
+    print()
+    print("  -f|--fields fields|script - fields to parse - either a comma-separated list")
+    print("                              or the name of a script, for the fields it uses")
+    print("  -r|--repeats repeats - parse each map this many times")
+    print("  -h|--help - print usage and exit")
+    print()
+    print(" Version %.2f. Brought to you by Squiffle" % version)
+
+def main(*arguments):
+    '''
+    Do whatever the user wants !
+    '''
+    fields = None
+    repeats = 3
+
+    # Parse command-line options
+    try:
+        opts, args = getopt.getopt(arguments, "hf:r:", ["help", "fields=", "repeats="])
+    except getopt.GetoptError:
+        usage(sys.argv[0])
+        sys.exit(2)
+
+    if len(args) == 0:
+        usage(sys.argv[0])
+        sys.exit(2)
+
+    for opt,arg in opts:
+        if (opt == '-h') or (opt == '--help'):
+            usage(sys.argv[0])
+            sys.exit(0)
+        elif (opt == '-f') or (opt == '--fields'):
+            if arg in ssw_sector_map.script_fields:
+                fields = ssw_sector_map.script_fields[arg]
+            else:
+                fields = arg.split(',')
+        elif (opt == '-r') or (opt == '--repeats'):
+            try:
+                repeats = int(arg)
+            except ValueError:
+                usage(sys.argv[0])
+                sys.exit(2)
+
+    if tracemalloc == None:
+        print("Needs tracemalloc, which was added in Python 3.4")
+        sys.exit(2)
+
+    pages = []
+    for filename in args:
+        with ssw_sector_map.open_map_file(filename) as f:
+            pages.append(f.read())
+    pages *= repeats
+    for low_memory in [False, True]:
+        sizes = memory_per_map(pages, fields, low_memory)
+        print("low_memory=%s" % low_memory)
+        for filename, size in zip(args * repeats, sizes):
+            print("  %s - %dKB" % (filename, size // 1024))
+        if len(sizes) > 1:
+            # The first map includes one-off costs, like the MapValues starting out
+            print("  Mean after the first map - %dKB" % (sum(sizes[1:]) // (1024 * (len(sizes) - 1))))
+
+class MemoryPerMap(unittest.TestCase):
+    @unittest.skipIf(tracemalloc == None, "needs tracemalloc")
+    def testLowMemory(self):
+        '''low_memory should keep the memory per map a small fraction of normal'''
+        page = ssw_sector_map.sample_map_page(len(ssw_sector_map.all_sectors))
+        normal = memory_per_map([page] * 3)
+        low = memory_per_map([page] * 3, low_memory=True)
+        self.assertLess(max(low[1:]) * 10, min(normal[1:]))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
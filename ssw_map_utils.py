@@ -10,7 +10,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 import ssw_sector_map2 as ssw_sector_map
 import ssw_utils
-import operator, datetime, unittest
+import operator, datetime, unittest, heapq
 import six
 
 version = 1.00
@@ -70,23 +70,77 @@ def best_routes(in_map,
     WARNING: from_sector comes after to_sectors. Take care when calling.
     '''
     result = []
-    for sector in to_sectors:
-        result.append(best_route_to_sector(in_map,
-                                           sector,
-                                           from_sector,
-                                           society,
-                                           unexplored_sector_society))
+    routes = in_map.shortest_routes_many([(from_sector, sector) for sector in to_sectors],
+                                         society,
+                                         unexplored_sector_society)
+    for sector, (dist, route, drones, poss) in zip(to_sectors, routes):
+        result.append((dist, route, drones, from_sector, sector, poss))
     if sort:
         result.sort(key=operator.itemgetter(0))
     return result
 
+def ranked_routes(in_map,
+                  pairs,
+                  society=None,
+                  unexplored_sector_society=None):
+    '''
+    Generator of best_route_to_sector() results for a list of (from, to) sector pairs,
+    in the order that sorting them all by distance would give.
+    Routes are only found when they might be next, using in_map.route_lower_bound(),
+    so stop iterating once you have enough. All the pairs with the lowest bound
+    are routed together, with in_map.shortest_routes_many().
+    A from sector of None means "from anywhere", as for best_route_to_sector().
+    '''
+    candidates = []
+    for i, (src, dest) in enumerate(pairs):
+        if src == None:
+            bound = in_map.route_lower_bound(dest, dest, society, unexplored_sector_society)
+        else:
+            bound = in_map.route_lower_bound(src, dest, society, unexplored_sector_society)
+        candidates.append((bound, i, src, dest))
+    heapq.heapify(candidates)
+    found = []
+    while len(candidates) > 0:
+        batch = [heapq.heappop(candidates)]
+        while (len(candidates) > 0) and (candidates[0][0] == batch[0][0]):
+            batch.append(heapq.heappop(candidates))
+        routes = in_map.shortest_routes_many([(src, dest) for (bound, i, src, dest) in batch],
+                                             society,
+                                             unexplored_sector_society)
+        for (bound, i, src, dest), (dist, route, drones, poss) in zip(batch, routes):
+            heapq.heappush(found, (dist, i, (dist, route, drones, src, dest, poss)))
+        # Anything that none of the remaining candidates can beat is next
+        while (len(found) > 0) and ((len(candidates) == 0) or (found[0][:2] < candidates[0][:2])):
+            yield heapq.heappop(found)[2]
+
+def asymmetric_warp_costs(maps):
+    '''
+    Looks at the IR warp fuel costs in a list of maps.
+    Returns a list of (start, end, fuel costs, reverse fuel costs) tuples
+    for each pair of sectors where the warp has been seen in both directions
+    and the sets of fuel costs differ.
+    '''
+    costs = {}
+    for m in maps:
+        for start, d in six.iteritems(m.warp_costs):
+            for end, fuel in six.iteritems(d):
+                costs.setdefault((start, end), set()).add(fuel)
+    retval = []
+    for (start, end), fuels in sorted(six.iteritems(costs)):
+        if (start < end) and ((end, start) in costs):
+            if fuels != costs[(end, start)]:
+                retval.append((start, end, sorted(fuels), sorted(costs[(end, start)])))
+    return retval
+
 def asteroid_clusters(in_map):
     '''
     Returns a list of sets of asteroids (ore, sector tuples) that are all adjacent to one another.
     '''
     retval = []
+    can_move_diagonally = in_map.can_move_diagonally()
     for ore, sector in in_map.asteroids:
-        neighbours = [temp for temp in in_map.asteroids if temp[1] in ssw_sector_map.adjacent_sectors(sector, in_map.can_move_diagonally())]
+        adjacent = ssw_sector_map.adjacent_sectors(sector, can_move_diagonally)
+        neighbours = [temp for temp in in_map.asteroids if temp[1] in adjacent]
         test_set = set(neighbours + [(ore, sector)])
         # TODO This "new_retval" approach works,
         # but I'm sure there's a better way using mappings
@@ -107,10 +161,11 @@ def asteroids_by_planets(in_map):
     Returns a list of asteroids (ore, sector tuples) that are adjacent to planets.
     '''
     retval = []
+    can_move_diagonally = in_map.can_move_diagonally()
+    planet_sectors = set([loc for name, loc in in_map.planets])
     for ore, sector in in_map.asteroids:
-        for adj in ssw_sector_map.adjacent_sectors(sector,
-                                                   in_map.can_move_diagonally()):
-            if adj in [loc for name, loc in in_map.planets]:
+        for adj in ssw_sector_map.adjacent_sectors(sector, can_move_diagonally):
+            if adj in planet_sectors:
                 retval.append((ore, sector))
                 # We only want to add it once, even if it's adjacent to multiple planets
                 break
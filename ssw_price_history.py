@@ -0,0 +1,488 @@
+#!/usr/bin/python
+
+'''
+Columnar store of the prices trading ports bought and sold ores at, across many maps
+'''
+
+# Copyright 2008, 2015-2016 Squiffle
+
+from __future__ import absolute_import
+from __future__ import print_function
+import datetime, unittest, array, mmap, os, collections, tempfile, shutil, bisect
+import six
+
+version = 1.00
+
+'''
+The columns of a PriceHistory, each stored in its own array (and file),
+with the array typecode for each
+'''
+_columns = [('sector', 'H'),
+            ('ore', 'B'),
+            ('buying', 'B'),
+            ('price', 'I')]
+
+'''
+Number of possible ore codes, so buying * _ore_limit + ore orders the rows of a map
+'''
+_ore_limit = 256
+
+_datetime_format = '%Y-%m-%d %H:%M:%S'
+
+class PriceStats(collections.namedtuple('PriceStats',
+                                        ['low', 'high', 'mean', 'median', 'mode'])):
+    '''
+    Summary of a list of prices, as returned by price_stats()
+    '''
+    __slots__ = ()
+
+def price_stats(prices):
+    '''
+    Returns a PriceStats for the (non-empty) list of prices.
+    Where there's more than one mode, the highest price is returned.
+    '''
+    ordered = sorted(prices)
+    counts = collections.Counter(ordered)
+    return PriceStats(ordered[0],
+                      ordered[-1],
+                      sum(ordered) / float(len(ordered)),
+                      ordered[len(ordered) // 2],
+                      max((count, price) for price, count in six.iteritems(counts))[1])
+
+def _empty_columns():
+    '''
+    Internal - Returns a dict of empty arrays, one per column.
+    '''
+    return dict([(name, array.array(typecode)) for name, typecode in _columns])
+
+'''
+Renames a file over another, replacing it atomically
+(os.rename() does that on POSIX, for Python 2, which has no os.replace())
+'''
+_replace = getattr(os, 'replace', os.rename)
+
+def _write_lines(filename, lines):
+    '''
+    Internal - Replaces the file with one containing the lines.
+    They're written to a temporary file that's then renamed, so that
+    an interrupted write leaves the old file as it was.
+    '''
+    (fd, temp_name) = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for line in lines:
+                print(line, file=f)
+        _replace(temp_name, filename)
+    except:
+        os.remove(temp_name)
+        raise
+
+def _map_column(filename, typecode, rows):
+    '''
+    Internal - Returns (mmap, view of the first rows values) for the column file.
+    Falls back to reading the file where memoryviews can't be cast (Python 2).
+    '''
+    if rows == 0:
+        return (None, array.array(typecode))
+    column = array.array(typecode)
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return (buf, memoryview(buf)[:rows * column.itemsize].cast(typecode))
+    except AttributeError:
+        column.fromstring(buf[:rows * column.itemsize])
+        buf.close()
+        return (None, column)
+
+class _RowKeys():
+    '''
+    Internal - Sequence of the buying * _ore_limit + ore for the rows in columns,
+    for bisect to search.
+    '''
+    def __init__(self, columns):
+        self.ores = columns['ore']
+        self.buyings = columns['buying']
+
+    def __len__(self):
+        return len(self.ores)
+
+    def __getitem__(self, i):
+        return self.buyings[i] * _ore_limit + self.ores[i]
+
+class PriceHistory():
+    '''
+    Append-only store of every (map datetime, sector, ore, buying, price)
+    from the maps added to it, with each field in its own column.
+    Ores are stored as indices into self.ores, and buying is 1 for prices
+    a port buys at and 0 for prices it sells at.
+    Rows are kept together by map, and sorted by buying then ore within each map,
+    so finding the prices for an ore in a map only reads the rows for it.
+    If dirname is given, rows already saved there are memory-mapped rather than read,
+    and save() appends any new rows to the files there.
+    '''
+    def __init__(self, dirname=None):
+        self.dirname = dirname
+        self.ores = []
+        self.ore_codes = {}
+        # Datetime of each map, in the order they were added, and the index of each
+        self.datetimes = []
+        self.map_indices = {}
+        # Index of the first row of each map, plus the total number of rows
+        self.starts = [0]
+        # Columns of the rows already in the files in dirname, and their mmaps
+        self.saved_maps = 0
+        self.saved = _empty_columns()
+        self.buffers = []
+        # Columns of the rows added since then
+        self.columns = _empty_columns()
+        if dirname and os.path.exists(self._filename('maps')):
+            self._load()
+
+    def _filename(self, name):
+        '''
+        Internal - Returns the name of one of the files in self.dirname.
+        '''
+        return os.path.join(self.dirname, name + '.txt')
+
+    def _load(self):
+        '''
+        Internal - Reads the maps and ores, and maps the columns, in self.dirname.
+        '''
+        with open(self._filename('ores')) as f:
+            self.ores = [line.rstrip('\n') for line in f]
+        self.ore_codes = dict([(ore, i) for i, ore in enumerate(self.ores)])
+        self.datetimes = []
+        self.map_indices = {}
+        self.starts = [0]
+        with open(self._filename('maps')) as f:
+            for line in f:
+                (date, time, rows) = line.split()
+                dt = datetime.datetime.strptime(date + ' ' + time, _datetime_format)
+                self.map_indices[dt] = len(self.datetimes)
+                self.datetimes.append(dt)
+                self.starts.append(self.starts[-1] + int(rows))
+        self.saved_maps = len(self.datetimes)
+        for name, typecode in _columns:
+            (buf, self.saved[name]) = _map_column(os.path.join(self.dirname, name + '.bin'),
+                                                  typecode,
+                                                  self.starts[-1])
+            if buf != None:
+                self.buffers.append(buf)
+        self.columns = _empty_columns()
+
+    def close(self):
+        '''
+        Unmaps any memory-mapped columns.
+        '''
+        for name in self.saved:
+            if isinstance(self.saved[name], memoryview):
+                self.saved[name].release()
+        for buf in self.buffers:
+            buf.close()
+        self.buffers = []
+        self.saved = _empty_columns()
+
+    def save(self):
+        '''
+        Appends any maps added since the last save() to the files in self.dirname.
+        '''
+        if self.dirname == None:
+            raise ValueError("PriceHistory has no directory to save to")
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        # The mapped columns are read again once the files have been written
+        saved_rows = self.starts[self.saved_maps]
+        self.close()
+        for name, typecode in _columns:
+            filename = os.path.join(self.dirname, name + '.bin')
+            with open(filename, 'r+b' if os.path.exists(filename) else 'wb') as f:
+                # Drop any rows beyond the saved maps, left by a save() that didn't finish
+                f.truncate(saved_rows * self.columns[name].itemsize)
+                f.seek(0, os.SEEK_END)
+                self.columns[name].tofile(f)
+        # Ores are only ever added, so new ones saved without the maps that use them do no harm
+        _write_lines(self._filename('ores'), self.ores)
+        # Written last, so that the maps (and rows) added are only saved once it's done
+        _write_lines(self._filename('maps'),
+                     ['%s %d' % (dt.strftime(_datetime_format), self.starts[i + 1] - self.starts[i])
+                      for i, dt in enumerate(self.datetimes)])
+        self._load()
+
+    def __len__(self):
+        '''
+        Returns the number of rows.
+        '''
+        return self.starts[-1]
+
+    def _ore_code(self, ore):
+        '''
+        Internal - Returns the index of ore in self.ores, adding it if necessary.
+        '''
+        if ore not in self.ore_codes:
+            self.ore_codes[ore] = len(self.ores)
+            self.ores.append(ore)
+        return self.ore_codes[ore]
+
+    def add_map(self, p):
+        '''
+        Adds the ore prices from the parsed map p.
+        Returns False, adding nothing, if there's already a map for the same time.
+        '''
+        if p.datetime in self.map_indices:
+            return False
+        for buying, ores in [(0, p.ores_sold), (1, p.ores_bought)]:
+            for code, ore in sorted([(self._ore_code(ore), ore) for ore in sorted(ores.keys())]):
+                for price, sector in ores[ore]:
+                    self.columns['sector'].append(sector)
+                    self.columns['ore'].append(code)
+                    self.columns['buying'].append(buying)
+                    self.columns['price'].append(price)
+        self.map_indices[p.datetime] = len(self.datetimes)
+        self.datetimes.append(p.datetime)
+        self.starts.append(self.starts[self.saved_maps] + len(self.columns['sector']))
+        return True
+
+    def _map_rows(self, i, code, buying):
+        '''
+        Internal - Returns (sectors, prices) columns for the rows of map i
+        with ore code that ports are buying (or selling).
+        '''
+        if i < self.saved_maps:
+            (columns, offset) = (self.saved, 0)
+        else:
+            (columns, offset) = (self.columns, self.starts[self.saved_maps])
+        keys = _RowKeys(columns)
+        key = buying * _ore_limit + code
+        start = bisect.bisect_left(keys, key, self.starts[i] - offset, self.starts[i + 1] - offset)
+        end = bisect.bisect_right(keys, key, start, self.starts[i + 1] - offset)
+        return (columns['sector'][start:end], columns['price'][start:end])
+
+    def _maps_between(self, start, end):
+        '''
+        Internal - Returns the indices of maps for times from start up to (not including) end.
+        None for either means no limit.
+        '''
+        return [i for i, dt in enumerate(self.datetimes)
+                if ((start == None) or (dt >= start)) and ((end == None) or (dt < end))]
+
+    def _rows(self, ore, buying, maps):
+        '''
+        Internal - Generates (map index, sectors, prices) for ore in each of the maps.
+        '''
+        code = self.ore_codes.get(ore)
+        if code == None:
+            return
+        for i in maps:
+            (sectors, prices) = self._map_rows(i, code, int(buying))
+            yield (i, sectors, prices)
+
+    def prices(self, ore, buying, start=None, end=None):
+        '''
+        Returns a list of the prices ports bought (or sold) ore at
+        in maps from start up to (not including) end.
+        '''
+        retval = []
+        for i, sectors, prices in self._rows(ore, buying, self._maps_between(start, end)):
+            retval.extend(prices)
+        return retval
+
+    def price_range(self, ore, buying, start=None, end=None):
+        '''
+        Returns (lowest, highest) of prices(), or None if there weren't any.
+        '''
+        prices = self.prices(ore, buying, start, end)
+        if not prices:
+            return None
+        return (min(prices), max(prices))
+
+    def daily_stats(self, ore, buying):
+        '''
+        Returns a list of (date, PriceStats) for the prices ports bought (or sold) ore at,
+        one for each day with any such prices, in date order.
+        '''
+        by_day = {}
+        for i, sectors, prices in self._rows(ore, buying, range(len(self.datetimes))):
+            if len(prices) > 0:
+                by_day.setdefault(self.datetimes[i].date(), []).extend(prices)
+        return [(day, price_stats(by_day[day])) for day in sorted(by_day.keys())]
+
+    def port_sectors(self, ore, buying, dt):
+        '''
+        Returns the set of sectors with ports buying (or selling) ore in the map for dt.
+        '''
+        retval = set()
+        for i, sectors, prices in self._rows(ore, buying, [self.map_indices[dt]]):
+            retval.update(sectors)
+        return retval
+
+    def map_prices(self, ore, buying, dt):
+        '''
+        Returns the list of prices ports bought (or sold) ore at in the map for dt.
+        '''
+        retval = []
+        for i, sectors, prices in self._rows(ore, buying, [self.map_indices[dt]]):
+            retval.extend(prices)
+        return retval
+
+    def port_changes(self, ore, buying, from_dt, to_dt):
+        '''
+        Returns a tuple of (sectors of ports that started, sectors of ports that stopped)
+        buying (or selling) ore between the maps for from_dt and to_dt.
+        '''
+        before = self.port_sectors(ore, buying, from_dt)
+        after = self.port_sectors(ore, buying, to_dt)
+        return (after - before, before - after)
+
+class FakeMap():
+    '''
+    Just what PriceHistory.add_map() needs from a parsed map
+    '''
+    def __init__(self, dt, ores_bought, ores_sold):
+        self.datetime = dt
+        self.ores_bought = ores_bought
+        self.ores_sold = ores_sold
+
+class PriceStatsKnownValues(unittest.TestCase):
+    def testStats(self):
+        '''price_stats() should match a simple calculation'''
+        self.assertEqual(price_stats([5, 1, 3, 3, 8]), (1, 8, 4.0, 3, 3))
+
+    def testModeTie(self):
+        '''price_stats() should pick the highest of several modes'''
+        self.assertEqual(price_stats([2, 2, 7, 7, 1]).mode, 7)
+
+class PriceHistoryQueries(unittest.TestCase):
+    day1 = datetime.datetime(2016, 1, 1, 6, 0)
+    day1_later = datetime.datetime(2016, 1, 1, 18, 0)
+    day2 = datetime.datetime(2016, 1, 2, 6, 0)
+
+    def maps(self):
+        return [FakeMap(self.day1,
+                        {'Oil': [(10, 5), (12, 6)]},
+                        {'Oil': [(20, 7)], 'Gold': [(100, 5)]}),
+                FakeMap(self.day1_later,
+                        {'Oil': [(14, 6), (11, 8)]},
+                        {}),
+                FakeMap(self.day2,
+                        {'Oil': [(9, 8)], 'Gold': [(90, 6)]},
+                        {'Gold': [(110, 5), (120, 9)]})]
+
+    def check(self, history):
+        self.assertEqual(len(history), 10)
+        self.assertEqual(history.prices('Oil', True), [10, 12, 14, 11, 9])
+        self.assertEqual(history.prices('Oil', True, self.day1_later, self.day2), [14, 11])
+        self.assertEqual(history.price_range('Gold', False), (100, 120))
+        self.assertEqual(history.price_range('Gold', True, end=self.day2), None)
+        self.assertEqual(history.price_range('Tin', True), None)
+        self.assertEqual(history.daily_stats('Oil', True),
+                         [(self.day1.date(), price_stats([10, 12, 14, 11])),
+                          (self.day2.date(), price_stats([9]))])
+        self.assertEqual(history.map_prices('Gold', False, self.day2), [110, 120])
+        self.assertEqual(history.map_prices('Gold', False, self.day1_later), [])
+        self.assertEqual(history.port_changes('Oil', True, self.day1, self.day1_later),
+                         (set([8]), set([5])))
+        self.assertEqual(history.port_changes('Gold', False, self.day1, self.day2),
+                         (set([9]), set()))
+
+    def testInMemory(self):
+        '''Queries should find the prices from the maps added'''
+        history = PriceHistory()
+        for m in self.maps():
+            self.assertTrue(history.add_map(m))
+        self.assertFalse(history.add_map(self.maps()[0]))
+        self.check(history)
+
+    def testSaved(self):
+        '''Queries should find the same prices whether the rows are saved or not'''
+        dirname = tempfile.mkdtemp()
+        try:
+            history = PriceHistory(dirname)
+            maps = self.maps()
+            history.add_map(maps[0])
+            history.save()
+            history.close()
+            history = PriceHistory(dirname)
+            self.assertEqual(history.saved_maps, 1)
+            history.add_map(maps[1])
+            history.add_map(maps[2])
+            self.check(history)
+            history.save()
+            history.close()
+            history = PriceHistory(dirname)
+            self.assertEqual(history.saved_maps, 3)
+            self.check(history)
+            history.close()
+        finally:
+            shutil.rmtree(dirname)
+
+    def testPartialSave(self):
+        '''Rows left by a save() that didn't finish should be replaced by the next save()'''
+        dirname = tempfile.mkdtemp()
+        try:
+            history = PriceHistory(dirname)
+            history.add_map(FakeMap(self.day1, {'Oil': [(10, 5)]}, {}))
+            history.save()
+            history.close()
+            # Write the columns for another map, but not maps.txt
+            history = PriceHistory(dirname)
+            history.add_map(FakeMap(self.day1_later, {'Oil': [(20, 6)]}, {}))
+            for name, typecode in _columns:
+                with open(os.path.join(dirname, name + '.bin'), 'ab') as f:
+                    history.columns[name].tofile(f)
+            history.close()
+            history = PriceHistory(dirname)
+            self.assertEqual(history.prices('Oil', True), [10])
+            history.add_map(FakeMap(self.day2, {'Oil': [(30, 7)]}, {}))
+            history.save()
+            history.close()
+            history = PriceHistory(dirname)
+            self.assertEqual(history.prices('Oil', True), [10, 30])
+            history.close()
+        finally:
+            shutil.rmtree(dirname)
+
+    def testInterruptedIndexSave(self):
+        '''A save() interrupted while writing maps.txt should leave the old maps.txt'''
+        global _replace
+        dirname = tempfile.mkdtemp()
+        try:
+            history = PriceHistory(dirname)
+            history.add_map(FakeMap(self.day1, {'Oil': [(10, 5)]}, {}))
+            history.save()
+            history.close()
+            history = PriceHistory(dirname)
+            history.add_map(FakeMap(self.day2, {'Oil': [(30, 7)]}, {'Gold': [(90, 6)]}))
+            replace = _replace
+            def interrupted(src, dst):
+                if dst.endswith('maps.txt'):
+                    raise KeyboardInterrupt()
+                replace(src, dst)
+            _replace = interrupted
+            try:
+                self.assertRaises(KeyboardInterrupt, history.save)
+            finally:
+                _replace = replace
+            self.assertEqual(sorted(os.listdir(dirname)),
+                             sorted(['maps.txt', 'ores.txt'] +
+                                    [name + '.bin' for name, typecode in _columns]))
+            history = PriceHistory(dirname)
+            self.assertEqual(history.datetimes, [self.day1])
+            self.assertEqual(history.prices('Oil', True), [10])
+            history.add_map(FakeMap(self.day2, {'Oil': [(30, 7)]}, {'Gold': [(90, 6)]}))
+            history.save()
+            history.close()
+            history = PriceHistory(dirname)
+            self.assertEqual(history.prices('Oil', True), [10, 30])
+            self.assertEqual(history.prices('Gold', False), [90])
+            history.close()
+        finally:
+            shutil.rmtree(dirname)
+
+    def testSaveWithoutDirectory(self):
+        '''save() should complain if there's no directory to save to'''
+        history = PriceHistory()
+        history.add_map(self.maps()[0])
+        self.assertRaises(ValueError, history.save)
+
+if __name__ == "__main__":
+    unittest.main()
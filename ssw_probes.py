@@ -40,9 +40,10 @@ else:
             enemy_sectors = [int(x) for x in line[start+1:-2].split(',')]
 
 # Parse the map, and check that it's valid and current
-page = open(map_filename)
+page = ssw_sector_map.open_map_file(map_filename)
 
-p = ssw_sector_map.SectorMapParser(page)
+# Unexplored sectors are always parsed, so jellyfish are all we need on top
+p = ssw_sector_map.SectorMapParser(page, ssw_sector_map.script_fields['ssw_probes'])
 
 map_valid,reason = p.valid()
 if not map_valid:
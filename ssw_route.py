@@ -9,7 +9,7 @@ Script to find a route through an SSW sector map
 from __future__ import absolute_import
 from __future__ import print_function
 import ssw_sector_map2 as ssw_sector_map
-import ssw_map_utils, ssw_societies, ssw_utils
+import ssw_map_utils, ssw_societies, ssw_utils, ssw_route_server
 import operator, sys, getopt, datetime
 
 version = 1.00
@@ -20,39 +20,98 @@ def usage(progname, map_file):
     '''
     Prints usage information
     '''
-    print("Usage: %s [-d {a|e|i|o|t}] [-e] [-m] [map_filename] sector [sectors]" % progname)
+    print("Usage: %s [-d {a|e|i|o|t}] [-e] [-k count] [-l] [-m] [-w] [map_filename] sector [sectors]" % progname)
     print()
     print(" Find route to visit the specified sectors")
     print(" Looks for a route to the first sector from anywhere. If more")
     print(" sectors are listed, looks for a route to travel through them.")
     print(" Currently only tries to visit them in the specified order.")
+    print(" If ssw_route_server.py is running for the map, it finds the route.")
     print()
     print("  -d|--drones {a|e|i|o|t} - avoid drones not belonging to the specified society")
     print("  -e|--empire - assume that unexplored sectors contain Amaranth drones")
     print("  -h|--help - print this usage messge")
+    print("  -k|--alternatives count - also list up to count routes flying between each pair of sectors")
+    print("  -l|--local - parse the map here, even if ssw_route_server.py is running")
     print("  -m|--missing_links - dump the list of found missing links")
+    print("  -w|--warps - also list routes between each pair of sectors that save moves")
+    print("               by using IR warps with known fuel costs")
     print("  map_filename defaults to %s" % map_file)
     print()
     print(" Version %.2f. Brought to you by Squiffle" % version)
 
+def print_route(route):
+    '''
+    Prints a ssw_route_server.route_query() result
+    '''
+    print("Total distance is %d" % route['distance'])
+    for route_str in route['routes']:
+        print(route_str, end=' ')
+    print(ssw_utils.drones_str(route['drones'], route['possible_drones']))
+    # List any fallbacks, in case drones appear
+    for alternative in route['alternatives']:
+        print("Alternative routes from %d to %d:" % (alternative['from'], alternative['to']))
+        for r in alternative['routes']:
+            print("  %d moves - %s %s" % (r['distance'],
+                                          ssw_utils.sector_str(r['route']),
+                                          ssw_utils.drones_str(r['drones'], r['possible_drones'])))
+    # List the trade-offs between moves and fuel, if asked for
+    for warp_route in route['warp_routes']:
+        print("Routes from %d to %d using known IR warps:" % (warp_route['from'], warp_route['to']))
+        for r in warp_route['routes']:
+            print("  %d moves, %d fuel - %s" % (r['moves'],
+                                                r['fuel'],
+                                                ssw_utils.sector_str(r['route'])))
+
+def print_server_route(route):
+    '''
+    Prints a route found by ssw_route_server, along with what we'd have printed
+    while parsing the map ourselves, so that it looks the same either way
+    '''
+    for line in route['map']['notes']:
+        print(line)
+    print_route(route)
+    print_map_warnings(route['map'])
+
+def print_map_warnings(info):
+    '''
+    Prints any warnings about the map from a ssw_route_server.map_info() dict
+    '''
+    # Check that this is today's map
+    if not info['todays']:
+        print()
+        print("**** Map is more than 24 hours old")
+    
+    # Check for unknown sectors with jellyfish
+    unknown_sectors_with_jellyfish = info['unknown_sectors_with_jellyfish']
+    if len(unknown_sectors_with_jellyfish) > 0:
+        print()
+        print("**** Don't forget to feed the empaths at New Ceylon")
+        print("**** That will explore %d sector(s) : %s" % (len(unknown_sectors_with_jellyfish),
+                                                            str(unknown_sectors_with_jellyfish)))
+
 def main(*arguments):
     '''
     Do whatever the user wants !
-    Returns the parsed map.
+    Returns the parsed map, or None if ssw_route_server found the route.
     '''
     # Defaults, changeable from the command line
     default_map_file = "ssw_sector_map.htm"
     map_file = default_map_file
     society = None
+    drones_arg = None
     unexplored_sector_society = None
     sectors_to_visit = []
     dump_missing_links = False
+    alternatives = 0
+    use_server = True
+    warp_routes = False
 
     global fout
 
     # Parse command-line options
     try:
-        opts, args = getopt.getopt(arguments,"ed:hm",["empire","drones=","help","missing_links"])
+        opts, args = getopt.getopt(arguments,"ed:hk:lmw",["empire","drones=","help","alternatives=","local","missing_links","warps"])
     except getopt.GetoptError:
         usage(sys.argv[0], map_file)
         sys.exit(2)
@@ -76,6 +135,7 @@ def main(*arguments):
         if (opt == '-d') or (opt == '--drones'):
             try:
                 society = ssw_societies.adjective(arg)
+                drones_arg = arg
             except ssw_societies.Invalid_Society:
                 print('Unrecognised society "%s" - should be one of %s' % (arg, ssw_societies.initials))
                 usage(sys.argv[0], map_file)
@@ -85,16 +145,47 @@ def main(*arguments):
         elif (opt == '-h') or (opt == '--help'):
             usage(sys.argv[0], default_map_file)
             sys.exit(0)
+        elif (opt == '-k') or (opt == '--alternatives'):
+            try:
+                alternatives = int(arg)
+            except ValueError:
+                usage(sys.argv[0], default_map_file)
+                sys.exit(2)
+        elif (opt == '-l') or (opt == '--local'):
+            use_server = False
         elif (opt == '-m') or (opt == '--missing_links'):
             dump_missing_links = True
+        elif (opt == '-w') or (opt == '--warps'):
+            warp_routes = True
     
     if (len(sectors_to_visit) == 0) and not dump_missing_links:
         usage(sys.argv[0], default_map_file)
         sys.exit(2)
              
+    # Let the server find the route, if it's running for this map
+    if use_server and not dump_missing_links:
+        params = {'sectors': ','.join([str(s) for s in sectors_to_visit]),
+                  'alternatives': alternatives}
+        if drones_arg != None:
+            params['drones'] = drones_arg
+        if unexplored_sector_society != None:
+            params['empire'] = 1
+        if warp_routes:
+            params['warps'] = 1
+        route = ssw_route_server.query('route', params, map_file)
+        # If the server couldn't find the route, parse the map here to say why
+        if (route != None) and ('error' not in route):
+            print_server_route(route)
+            return None
+
     # Read and parse the sector map
-    page = open(map_file)
-    p = ssw_sector_map.SectorMapParser(page)
+    # We only need to know what affects routes and the warnings about the map,
+    # plus the warp costs if we're using them
+    fields = set(ssw_sector_map.script_fields['ssw_route'])
+    if warp_routes:
+        fields.add('warps')
+    page = ssw_sector_map.open_map_file(map_file)
+    p = ssw_sector_map.SectorMapParser(page, fields)
     
     # Don't print warnings if we're extracting missing links,
     # because there will likely be lots of "missing link" warnings
@@ -109,28 +200,12 @@ def main(*arguments):
     if len(sectors_to_visit) > 0:
         # Find and print the route
         # TODO Find the best route through the listed sectors
-        # Note that first time through the loop, from_sector == to_sector,
-        # which means "find a route to this sector from anywhere"
-        from_sector = sectors_to_visit[0]
-        total_distance = 0
-        overall_route = []
-        drones = []
-        possible_drones = False
-        for to_sector in sectors_to_visit:
-            #print "Finding route from %d to %d" % (from_sector, to_sector)
-            (distance, route_str, drone_list, poss) = p.shortest_route(from_sector,
-                                                                       to_sector,
-                                                                       society,
-                                                                       unexplored_sector_society)
-            total_distance += distance
-            overall_route.append(route_str)
-            drones += drone_list
-            from_sector = to_sector
-            possible_drones = possible_drones or poss
-        print("Total distance is %d" % total_distance)
-        for route in overall_route:
-            print(route, end=' ')
-        print(ssw_utils.drones_str(drones, possible_drones))
+        print_route(ssw_route_server.route_query(p,
+                                                 sectors_to_visit,
+                                                 society,
+                                                 unexplored_sector_society,
+                                                 alternatives,
+                                                 warp_routes))
 
     if dump_missing_links:
         var_str = "cycle_%d_links = " % p.cycle()
@@ -161,18 +236,7 @@ def main(*arguments):
                 end_idx = idx
                 #print "Set end_idx to %d" % end_idx
     
-    # Check that this is today's map
-    if not ssw_map_utils.is_todays(p):
-        print()
-        print("**** Map is more than 24 hours old")
-    
-    # Check for unknown sectors with jellyfish
-    unknown_sectors_with_jellyfish = ssw_map_utils.unknown_sectors_with_jellyfish(p)
-    if len(unknown_sectors_with_jellyfish) > 0:
-        print()
-        print("**** Don't forget to feed the empaths at New Ceylon")
-        print("**** That will explore %d sector(s) : %s" % (len(unknown_sectors_with_jellyfish),
-                                                            str(sorted(list(unknown_sectors_with_jellyfish)))))
+    print_map_warnings(ssw_route_server.map_info(p, map_file))
     
     # Return the parsed map, in case we're a mere utility
     return p
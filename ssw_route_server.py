@@ -0,0 +1,541 @@
+#!/usr/bin/python
+
+'''
+Local server that keeps an SSW sector map parsed, and answers queries about it
+'''
+
+# Copyright 2009, 2015-2016 Squiffle
+
+from __future__ import absolute_import
+from __future__ import print_function
+import ssw_sector_map2 as ssw_sector_map
+import ssw_map_utils, ssw_societies
+import sys, getopt, os, json, socket, tempfile, unittest
+import six
+from six.moves import BaseHTTPServer, urllib, http_client
+
+version = 1.00
+
+default_map_file = "ssw_sector_map.htm"
+default_port = 8033
+
+# Seconds query() waits for a server to accept the connection, and then for the answer
+# (which may mean parsing the map again first)
+connect_timeout = 0.5
+query_timeout = 120
+
+# Probe queries don't suggest the empaths for fewer sectors than this
+jellyfish_sectors_for_empaths = 2
+
+class QueryError(Exception):
+    '''
+    Raised when a query can't be answered, with the reason
+    '''
+    pass
+
+def _printed_lines(function, *args):
+    '''
+    Calls function with args, and returns the lines it printed.
+    They're still printed, too.
+    '''
+    saved = sys.stdout
+    sys.stdout = six.StringIO()
+    try:
+        function(*args)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = saved
+    print(output, end='')
+    return output.splitlines()
+
+def map_info(p, map_file, notes=()):
+    '''
+    Returns a dict of things about the map that any client may want to know.
+    notes are the lines ssw_route prints when it parses the map itself.
+    '''
+    return {'file': map_file,
+            'notes': list(notes),
+            'datetime': str(p.datetime),
+            'todays': ssw_map_utils.is_todays(p),
+            'unknown_sectors_with_jellyfish': sorted(ssw_map_utils.unknown_sectors_with_jellyfish(p))}
+
+def route_query(p,
+                sectors,
+                society=None,
+                unexplored_sector_society=None,
+                alternatives=0,
+                warp_routes=False):
+    '''
+    Finds a route to visit the list of sectors, in order, as ssw_route does.
+    Returns a dict of the total distance, the route description for each leg,
+    drones en route, possible drones, and up to alternatives fallback routes
+    between each pair of sectors.
+    If warp_routes is True, it also has the pareto_routes() between each pair of sectors,
+    trading off moves against fuel for known IR warps.
+    '''
+    # Note that for the first pair, from_sector == to_sector,
+    # which means "find a route to this sector from anywhere"
+    pairs = list(zip([sectors[0]] + sectors[:-1], sectors))
+    retval = {'distance': 0,
+              'routes': [],
+              'drones': [],
+              'possible_drones': False,
+              'alternatives': [],
+              'warp_routes': []}
+    for (distance, route_str, drone_list, poss) in p.shortest_routes_many(pairs,
+                                                                          society,
+                                                                          unexplored_sector_society):
+        retval['distance'] += distance
+        retval['routes'].append(route_str)
+        retval['drones'] += drone_list
+        retval['possible_drones'] = retval['possible_drones'] or poss
+    if alternatives > 0:
+        for from_sector, to_sector in zip(sectors, sectors[1:]):
+            routes = [{'distance': distance,
+                       'route': route,
+                       'drones': drone_list,
+                       'possible_drones': poss}
+                      for (distance, route, drone_list, poss) in p.alternative_routes(from_sector,
+                                                                                      to_sector,
+                                                                                      alternatives,
+                                                                                      society,
+                                                                                      unexplored_sector_society)]
+            retval['alternatives'].append({'from': from_sector,
+                                           'to': to_sector,
+                                           'routes': routes})
+    if warp_routes:
+        for from_sector, to_sector in zip(sectors, sectors[1:]):
+            routes = [{'moves': moves, 'fuel': fuel, 'route': route}
+                      for (moves, fuel, route) in p.pareto_routes(from_sector,
+                                                                  to_sector,
+                                                                  society,
+                                                                  unexplored_sector_society)]
+            retval['warp_routes'].append({'from': from_sector,
+                                          'to': to_sector,
+                                          'routes': routes})
+    return retval
+
+def nearest_query(p,
+                  sector,
+                  to='planet',
+                  society=None,
+                  unexplored_sector_society=None):
+    '''
+    Finds the nearest planet, IPT or either (as specified by to) to sector.
+    Returns a dict of the name, sector, distance, drones en route and possible drones.
+    '''
+    finders = {'planet': p.nearest_planet,
+               'ipt': p.nearest_ipt,
+               'either': p.nearest_planet_or_ipt}
+    if to not in finders:
+        raise QueryError('Unknown destination "%s" - should be one of %s' % (to, sorted(finders)))
+    (name, nearest, distance, drones, poss) = finders[to](sector,
+                                                          for_society=society,
+                                                          unexplored_sector_society=unexplored_sector_society)
+    return {'name': name,
+            'sector': nearest,
+            'distance': distance,
+            'drones': drones,
+            'possible_drones': poss}
+
+def trade_query(p, ore, society=None):
+    '''
+    Finds where ore can be bought and sold.
+    Returns a dict with lists of (price, list of (sector, port alignment)),
+    cheapest first for 'buy' and most lucrative first for 'sell'.
+    Includes no sectors with enemy drones if society is specified.
+    '''
+    retval = {'ore': ore, 'buy': [], 'sell': []}
+    if ore in p.ores_sold:
+        retval['buy'] = ssw_map_utils.places_to_buy_ore(p, ore, society)
+    if ore in p.ores_bought:
+        retval['sell'] = ssw_map_utils.places_to_sell_ore(p, ore, society)
+    return retval
+
+def probe_query(p, enemy_sectors=[]):
+    '''
+    Works out which unexplored sectors are worth probing, as ssw_probes does.
+    Returns a dict of the sectors to get the empaths to explore, and those to probe.
+    '''
+    probe = set(ssw_map_utils.all_unknown_sectors(p)) - set(enemy_sectors)
+    empaths = ssw_map_utils.unknown_sectors_with_jellyfish(p)
+    # Not worth doing the jellyfish thing for one sector
+    if len(empaths) >= jellyfish_sectors_for_empaths:
+        probe = probe - empaths
+    else:
+        empaths = set()
+    return {'empaths': sorted(empaths), 'probe': sorted(probe)}
+
+def _sectors(text):
+    '''
+    Internal - Parses a comma-separated list of sectors.
+    '''
+    try:
+        sectors = [int(s) for s in text.split(',') if s]
+    except ValueError:
+        raise QueryError('Bad sector list "%s"' % text)
+    for sector in sectors:
+        if sector not in ssw_sector_map.all_sectors:
+            raise QueryError('No sector %d' % sector)
+    return sectors
+
+def _society(params):
+    '''
+    Internal - Returns the (society, unexplored_sector_society) from the query parameters.
+    '''
+    society = None
+    unexplored_sector_society = None
+    if 'drones' in params:
+        try:
+            society = ssw_societies.adjective(params['drones'])
+        except ssw_societies.Invalid_Society:
+            raise QueryError('Unrecognised society "%s" - should be one of %s'
+                             % (params['drones'], ssw_societies.initials))
+    if params.get('empire'):
+        unexplored_sector_society = ssw_societies.adjective('a')
+    return (society, unexplored_sector_society)
+
+def _int(params, name, default):
+    '''
+    Internal - Returns the named query parameter as an int.
+    '''
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        raise QueryError('Bad %s "%s"' % (name, params[name]))
+
+def _one_sector(params):
+    '''
+    Internal - Returns the one sector in the 'sector' query parameter.
+    '''
+    sectors = _sectors(params.get('sector', ''))
+    if len(sectors) != 1:
+        raise QueryError('Need exactly one sector')
+    return sectors[0]
+
+def _route(p, params):
+    sectors = _sectors(params.get('sectors', ''))
+    if not sectors:
+        raise QueryError('No sectors to visit')
+    (society, unexplored_sector_society) = _society(params)
+    return route_query(p,
+                       sectors,
+                       society,
+                       unexplored_sector_society,
+                       _int(params, 'alternatives', 0),
+                       _int(params, 'warps', 0) != 0)
+
+def _nearest(p, params):
+    (society, unexplored_sector_society) = _society(params)
+    return nearest_query(p,
+                         _one_sector(params),
+                         params.get('to', 'planet'),
+                         society,
+                         unexplored_sector_society)
+
+def _trade(p, params):
+    if 'ore' not in params:
+        raise QueryError('No ore specified')
+    (society, unexplored_sector_society) = _society(params)
+    return trade_query(p, params['ore'], society)
+
+def _probe(p, params):
+    return probe_query(p, _sectors(params.get('enemy', '')))
+
+def _status(p, params):
+    return {}
+
+'''
+The queries the server answers, keyed by path, each taking (map, query parameters)
+'''
+queries = {'/route': _route,
+           '/nearest': _nearest,
+           '/trade': _trade,
+           '/probe': _probe,
+           '/status': _status}
+
+class MapHolder():
+    '''
+    Keeps a parsed and enhanced sector map,
+    parsing the file again whenever it changes on disk,
+    with the sector popups split between processes worker processes
+    '''
+    def __init__(self, map_file, processes=1):
+        self.map_file = os.path.abspath(map_file)
+        self.processes = processes
+        self.mtime = None
+        # Populated on-demand in self.map()
+        self.the_map = None
+        self.notes = []
+
+    def map(self):
+        '''
+        Returns the parsed map, reading the file again if it's changed.
+        Raises QueryError if the map can't be read or isn't valid.
+        '''
+        try:
+            mtime = os.stat(self.map_file).st_mtime
+        except OSError as e:
+            raise QueryError("Can't read sector map file %s - %s" % (self.map_file, e))
+        if mtime != self.mtime:
+            with ssw_sector_map.open_map_file(self.map_file) as page:
+                p = ssw_sector_map.SectorMapParser(page, processes=self.processes)
+            (map_valid, reason) = p.valid(True)
+            if not map_valid:
+                raise QueryError("Sector map file is invalid - %s" % reason)
+            # ssw_route prints the warnings and additions for the fields it parses,
+            # so note those for its output to be the same when it asks us
+            route_fields = set(p.fields).intersection(ssw_sector_map.script_fields['ssw_route'])
+            notes = [finding.warning() for finding in p.validate(route_fields)]
+            notes += _printed_lines(p.enhance_map, route_fields)
+            p.enhance_map(set(p.fields) - route_fields)
+            # Within a cycle, usually only the drones will have changed,
+            # so update the routes worked out for the last map rather than starting again
+            if self.the_map != None:
+                p.adopt_routes(self.the_map)
+            self.the_map = p
+            self.notes = notes
+            self.mtime = mtime
+        return self.the_map
+
+def handle_query(holder, path, params):
+    '''
+    Answers one query.
+    path selects one of queries, and params is a dict of its parameters.
+    Returns a tuple of (HTTP status, dict to send back as JSON).
+    '''
+    if path not in queries:
+        return (404, {'error': 'Unknown query "%s" - should be one of %s' % (path, sorted(queries))})
+    try:
+        p = holder.map()
+        retval = queries[path](p, params)
+    except QueryError as e:
+        return (400, {'error': str(e)})
+    retval['map'] = map_info(p, holder.map_file, holder.notes)
+    return (200, retval)
+
+class QueryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Turns HTTP GET requests into handle_query() calls, for self.server.holder
+    '''
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict([(name, values[-1])
+                       for name, values in six.iteritems(urllib.parse.parse_qs(url.query))])
+        (status, retval) = handle_query(self.server.holder, url.path, params)
+        body = json.dumps(retval).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't clutter the terminal with every query
+        pass
+
+def serve(map_file=default_map_file, port=default_port, processes=1):
+    '''
+    Answers queries about map_file on localhost:port, until interrupted.
+    The map is parsed with processes worker processes.
+    '''
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), QueryHandler)
+    server.holder = MapHolder(map_file, processes)
+    # Parse the map now, rather than on the first query
+    server.holder.map()
+    print("Answering queries about %s on port %d" % (server.holder.map_file, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+def query(name, params, map_file=default_map_file, port=default_port):
+    '''
+    Asks a running server the named query (a key of queries, without the '/'),
+    with the dict of params.
+    Returns the dict the server sent back, which will have an 'error' if the query failed.
+    Returns None if no server is running, or the server is for a different map file.
+    '''
+    conn = http_client.HTTPConnection('127.0.0.1', port, timeout=connect_timeout)
+    try:
+        conn.connect()
+        conn.sock.settimeout(query_timeout)
+        conn.request('GET', '/%s?%s' % (name, urllib.parse.urlencode(params)))
+        body = conn.getresponse().read()
+    except (socket.error, http_client.HTTPException):
+        return None
+    finally:
+        conn.close()
+    try:
+        retval = json.loads(body.decode('utf-8'))
+    except ValueError:
+        return None
+    if ('map' in retval) and (retval['map']['file'] != os.path.abspath(map_file)):
+        return None
+    return retval
+
+def usage(progname):
+    '''
+    Prints usage information
+    '''
+    print("Usage: %s [-j processes] [-p port] [map_filename]" % progname)
+    print()
+    print(" Keep a sector map parsed, and answer queries about it")
+    print(" Queries are HTTP GET requests to localhost, answered with JSON:")
+    print("  /route?sectors=s1,s2[&drones=x][&empire=1][&alternatives=count][&warps=1]")
+    print("  /nearest?sector=s[&to={planet|ipt|either}][&drones=x][&empire=1]")
+    print("  /trade?ore=name[&drones=x]")
+    print("  /probe[?enemy=s1,s2]")
+    print("  /status")
+    print(" The map is read again whenever the file changes.")
+    print(" ssw_route.py uses the server, when it's running.")
+    print()
+    print("  -h|--help - print this usage messge")
+    print("  -j|--processes processes - parse the map with this many worker processes")
+    print("  -p|--port port - listen on port, instead of %d" % default_port)
+    print("  map_filename defaults to %s" % default_map_file)
+    print()
+    print(" Version %.2f. Brought to you by Squiffle" % version)
+
+def main(*arguments):
+    '''
+    Do whatever the user wants !
+    '''
+    map_file = default_map_file
+    port = default_port
+    processes = 1
+
+    # Parse command-line options
+    try:
+        opts, args = getopt.getopt(arguments, "hj:p:", ["help", "processes=", "port="])
+    except getopt.GetoptError:
+        usage(sys.argv[0])
+        sys.exit(2)
+
+    if len(args) > 1:
+        usage(sys.argv[0])
+        sys.exit(2)
+    elif len(args) == 1:
+        map_file = args[0]
+
+    for opt,arg in opts:
+        if (opt == '-h') or (opt == '--help'):
+            usage(sys.argv[0])
+            sys.exit(0)
+        elif (opt == '-j') or (opt == '--processes'):
+            try:
+                processes = int(arg)
+            except ValueError:
+                usage(sys.argv[0])
+                sys.exit(2)
+        elif (opt == '-p') or (opt == '--port'):
+            try:
+                port = int(arg)
+            except ValueError:
+                usage(sys.argv[0])
+                sys.exit(2)
+
+    try:
+        serve(map_file, port, processes)
+    except QueryError as e:
+        print(e)
+        sys.exit(2)
+
+class Queries(unittest.TestCase):
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile(suffix='.htm', delete=False)
+        f.write(ssw_sector_map.sample_map_page(len(ssw_sector_map.all_sectors)).encode('utf-8'))
+        f.close()
+        self.holder = MapHolder(f.name)
+
+    def tearDown(self):
+        os.remove(self.holder.map_file)
+
+    def testRoute(self):
+        '''A route query should give the same route as the parser'''
+        (status, retval) = handle_query(self.holder, '/route', {'sectors': '1,3'})
+        self.assertEqual(status, 200)
+        (distance, route_str, drones, poss) = self.holder.map().shortest_route(1, 3)
+        self.assertEqual(retval['distance'], distance)
+        self.assertEqual(retval['routes'][1], route_str)
+        self.assertEqual(retval['map']['file'], self.holder.map_file)
+
+    def testWarpRoutes(self):
+        '''A route query with warps should list the parser's pareto_routes() for each leg'''
+        (status, retval) = handle_query(self.holder, '/route', {'sectors': '2,500', 'warps': '1'})
+        self.assertEqual(status, 200)
+        expected = [{'moves': moves, 'fuel': fuel, 'route': route}
+                    for moves, fuel, route in self.holder.map().pareto_routes(2, 500)]
+        self.assertEqual(retval['warp_routes'], [{'from': 2, 'to': 500, 'routes': expected}])
+        self.assertEqual(expected[0], {'moves': 1, 'fuel': 10, 'route': [500]})
+        (status, retval) = handle_query(self.holder, '/route', {'sectors': '2,500'})
+        self.assertEqual(retval['warp_routes'], [])
+
+    def testTrade(self):
+        '''A trade query should find where ore is bought and sold'''
+        (status, retval) = handle_query(self.holder, '/trade', {'ore': 'Afaikite'})
+        self.assertEqual(status, 200)
+        self.assertEqual(retval['buy'], [(60, [(2, 'O')])])
+        self.assertEqual(retval['sell'], [])
+
+    def testErrors(self):
+        '''Bad queries should say what's wrong'''
+        self.assertEqual(handle_query(self.holder, '/bogus', {})[0], 404)
+        (status, retval) = handle_query(self.holder, '/route', {'sectors': '1,2000'})
+        self.assertEqual(status, 400)
+        self.assertEqual(retval['error'], 'No sector 2000')
+        (status, retval) = handle_query(self.holder, '/nearest', {'sector': '1', 'drones': 'z'})
+        self.assertEqual(status, 400)
+
+    def testReload(self):
+        '''The map should be read again when the file changes, keeping the routes worked out'''
+        p = self.holder.map()
+        self.assertIs(self.holder.map(), p)
+        handle_query(self.holder, '/route', {'sectors': '1,3'})
+        rows = p.the_route_rows
+        self.assertTrue(rows)
+        stat = os.stat(self.holder.map_file)
+        os.utime(self.holder.map_file, (stat.st_atime, stat.st_mtime + 10))
+        p2 = self.holder.map()
+        self.assertIsNot(p2, p)
+        self.assertIs(p2.the_route_rows, rows)
+
+    def testSameAsLocal(self):
+        '''ssw_route should print the same for the server's answer as when it parses the map'''
+        import ssw_route
+        params = {'sectors': '1,3', 'alternatives': '1', 'warps': '1'}
+        (status, retval) = handle_query(self.holder, '/route', params)
+        self.assertEqual(status, 200)
+        self.assertTrue(retval['map']['notes'])
+        # As query() would return it
+        route = json.loads(json.dumps(retval))
+        server = _printed_lines(ssw_route.print_server_route, route)
+        local = _printed_lines(ssw_route.main, '-l', '-k', '1', '-w', self.holder.map_file, '1', '3')
+        self.assertEqual(server, local)
+
+class Client(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.saved_timeout = query_timeout
+
+    def tearDown(self):
+        global query_timeout
+        query_timeout = self.saved_timeout
+        self.sock.close()
+
+    def testNoServer(self):
+        '''query() should return None if nothing is listening'''
+        self.assertEqual(query('status', {}, port=self.port), None)
+
+    def testStuckServer(self):
+        '''query() should give up on a server that doesn't answer within query_timeout'''
+        global query_timeout
+        query_timeout = 0.2
+        self.sock.listen(1)
+        self.assertEqual(query('status', {}, port=self.port), None)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -13,13 +13,25 @@ This is a copy of ssw_sector_map, reworked to use BeautifulSoup.
 
 from __future__ import absolute_import
 from __future__ import print_function
-import operator, datetime, unittest, re
+import operator, datetime, unittest, re, binascii, heapq, itertools, collections, array
+import mmap, os, tempfile, bisect, multiprocessing
+import io, copy, gzip, bz2, tarfile, glob, sys, runpy, shutil
+try:
+    import lzma
+except ImportError:
+    # Not available in Python 2
+    lzma = None
+try:
+    import zstandard
+except ImportError:
+    # Only needed for zstd-compressed maps
+    zstandard = None
 from bs4 import BeautifulSoup
 import ssw_missing_links, ssw_societies, ssw_utils
 from ssw_trading_port import TradingPort
 import ssw_get_asteroids, ssw_get_planets, ssw_get_stores, ssw_get_trading_ports
 import six
-from six.moves import range
+from six.moves import range, collections_abc
 
 '''Set this to True to log debugging information'''
 debug = False
@@ -103,6 +115,12 @@ SSW came back from the dead.
 shutdown_datetime = datetime.datetime(3012, 0o2, 12)
 reboot_datetime = datetime.datetime(3015, 11, 17, 18, 12)
 
+'''
+Missing links changed part way through these cycles
+'''
+cycle_16_map_change_datetime = datetime.datetime(3011, 7, 3, 23, 59)
+cycle_19_map_change_datetime = datetime.datetime(3016, 4, 25, 23, 59)
+
 '''
 Hedrok vanished, then reappeared
 '''
@@ -175,27 +193,45 @@ def cycle(map_datetime):
     Identifies the cycle that was happening at the specified SSW time.
     Returns 0 for dates before the first cycle.
     """
-    for cycle in range(len(cycle_start)-1):
-        if (map_datetime < cycle_start[cycle+1]):
-            return cycle
-    return len(cycle_start)-1
+    return game_rules(map_datetime).cycle
 
 def war_ongoing(map_datetime):
     """
     Returns True if the war hadn't yet ended.
     """
+    return game_rules(map_datetime).war_ongoing
+
+def can_move_diagonally(map_datetime):
+    """
+    Returns True if diagonal moves were possible, False otherwise.
+    """
+    return game_rules(map_datetime).can_move_diagonally
+
+def _cycle(map_datetime):
+    """
+    Internal - Works out cycle() from cycle_start.
+    """
+    return bisect.bisect_right(cycle_start, map_datetime, 1) - 1
+
+def _war_ongoing(map_datetime):
+    """
+    Internal - Works out war_ongoing() from war_end.
+    """
+    if _cycle(map_datetime) == 0:
+        # No war had started
+        return False
     try:
-        return map_datetime < war_end[cycle(map_datetime)]
+        return map_datetime < war_end[_cycle(map_datetime)]
     except IndexError:
         # Must be the current war, which is still ongoing
         return True
 
 '''For cycle 13, diagonal moves were disallowed'''
-def can_move_diagonally(map_datetime):
+def _can_move_diagonally(map_datetime):
     """
-    Returns True if diagonal moves were possible, False otherwise.
+    Internal - Works out can_move_diagonally().
     """
-    return not (13 == cycle(map_datetime))
+    return not (13 == _cycle(map_datetime))
 
 '''Mars appears on a regular schedule'''
 def mars_present(map_date):
@@ -264,13 +300,36 @@ def planet_x_present(map_date):
     # Christmastime
     return ((map_date.month == 12) and (map_date.day >= 25))
 
-'''Planets we expect to always find. List of (name, sector) tuples.'''
 def expected_planets(map_datetime):
     """
     Where planets should appear.
     Returns a list of tuples with (name, sector).
     """
-    '''Planets we expect to always find. List of (name, sector) tuples.'''
+    retval = list(game_rules(map_datetime).planets)
+
+    # Intermittent planets
+    map_date = map_datetime.date()
+    if (mars_present(map_date)):
+        retval.append(mars)
+    if (love_boat_present(map_date)):
+        sector = love_boat_sector(map_date.year)
+        if (sector):
+            retval.append((love_boat[0],sector))
+    if (planet_x_present(map_date)):
+        sector = planet_x_sector(map_date.year)
+        if (sector):
+            if type(sector) is dict:
+                retval.append((planet_x[0],sector[map_date]))
+            else:
+                retval.append((planet_x[0],sector))
+
+    return retval
+
+'''Planets we expect to always find. List of (name, sector) tuples.'''
+def _expected_planets(map_datetime):
+    """
+    Internal - Works out where the permanent planets should appear.
+    """
     retval = [('Earth', 1),
               ('Solaris', 15),
               ('Yeranus', 30),
@@ -331,7 +390,7 @@ def expected_planets(map_datetime):
     # Is the date after the huge re-work ?
     if (map_datetime > space_rework_datetime):
         if ((map_datetime > eroticon_69_removed_datetime) and
-            (cycle(map_datetime) < 21)):
+            (_cycle(map_datetime) < 21)):
             retval = v2_planets
         elif (map_datetime > phallorus_removed_datetime):
             retval = v2_planets + leftovers[2:]
@@ -356,57 +415,45 @@ def expected_planets(map_datetime):
         if (map_datetime > hedrok_restored_datetime):
             retval.append(restored_planet)
 
-    # Intermittent planets
-    map_date = map_datetime.date()
-    if (mars_present(map_date)):
-        retval.append(mars)
-    if (love_boat_present(map_date)):
-        sector = love_boat_sector(map_date.year)
-        if (sector):
-            retval.append((love_boat[0],sector))
-    if (planet_x_present(map_date)):
-        sector = planet_x_sector(map_date.year)
-        if (sector):
-            if type(sector) is dict:
-                retval.append((planet_x[0],sector[map_date]))
-            else:
-                retval.append((planet_x[0],sector))
-
     return retval
 
-'''Sectors that we expect to have missing links'''
 def expected_missing_links(map_datetime):
     """
     Which sectors should have missing links.
     Constant up to cycle 13, then space got mazified.
     dict, indexed by sector, of list of neighbouring sectors that you can't move to.
     """
+    return game_rules(map_datetime).missing_links
+
+'''Sectors that we expect to have missing links'''
+def _expected_missing_links(map_datetime):
+    """
+    Internal - Works out expected_missing_links().
+    """
     maze_free_sectors = {501: [467, 468, 469, 533, 534, 535],
                          502: [468, 469, 470, 501, 503, 534, 535, 536]}
-    cycle_16_map_change_datetime = datetime.datetime(3011, 7, 3, 23, 59)
-    cycle_19_map_change_datetime = datetime.datetime(3016, 4, 25, 23, 59)
 
-    if (cycle(map_datetime) < 13):
+    if (_cycle(map_datetime) < 13):
         return maze_free_sectors
-    elif (cycle(map_datetime) == 13):
+    elif (_cycle(map_datetime) == 13):
         if (map_datetime < space_mazified_datetime):
             return ssw_missing_links.cycle_13_war_links
         else:
             return ssw_missing_links.cycle_13_late_links
-    elif (cycle(map_datetime) == 14):
+    elif (_cycle(map_datetime) == 14):
         return ssw_missing_links.cycle_14_links
-    elif (cycle(map_datetime) == 15):
+    elif (_cycle(map_datetime) == 15):
         return ssw_missing_links.cycle_15_links
-    elif (cycle(map_datetime) == 16):
+    elif (_cycle(map_datetime) == 16):
         if (map_datetime < cycle_16_map_change_datetime):
             return ssw_missing_links.cycle_16_war_links
         else:
             return ssw_missing_links.cycle_16_late_links
-    elif (cycle(map_datetime) == 17):
+    elif (_cycle(map_datetime) == 17):
         return ssw_missing_links.cycle_17_links
-    elif (cycle(map_datetime) == 18):
+    elif (_cycle(map_datetime) == 18):
         return ssw_missing_links.cycle_18_links
-    elif (cycle(map_datetime) == 19):
+    elif (_cycle(map_datetime) == 19):
         # Map was reworked after the war ended but before cycle 20 started
         if (map_datetime > war_end[19]):
             if (map_datetime < cycle_19_map_change_datetime):
@@ -414,25 +461,31 @@ def expected_missing_links(map_datetime):
             else:
                 return ssw_missing_links.cycle_19_post_war_links_2
         return ssw_missing_links.cycle_19_links
-    elif (cycle(map_datetime) == 20):
+    elif (_cycle(map_datetime) == 20):
         return ssw_missing_links.cycle_20_links
-    elif (cycle(map_datetime) == 21):
+    elif (_cycle(map_datetime) == 21):
         return ssw_missing_links.cycle_21_links
     else:
         # If we get here, we need to add missing links for this cycle
         return {}
 
-'''Number of asteroids we expect to find'''
 def expected_asteroids(map_datetime):
     """
     How many asteroids should be present in a sector map.
     """
+    return game_rules(map_datetime).asteroids
+
+'''Number of asteroids we expect to find'''
+def _expected_asteroids(map_datetime):
+    """
+    Internal - Works out expected_asteroids().
+    """
     # TODO: I've got a cycle 4 map, which has 9 of each asteroid, plus an extra Tanst
     # Cycle 7 had just 3 of each asteroid
-    if (cycle(map_datetime) == 7):
+    if (_cycle(map_datetime) == 7):
         expected_asteroids_per_ore = 3
     # Cycles 11 and later have fewer asteroids - 6 of each
-    elif (cycle(map_datetime) > 10):
+    elif (_cycle(map_datetime) > 10):
         expected_asteroids_per_ore = 6
     else:
         # Before that, 9 was the standard number
@@ -442,12 +495,18 @@ def expected_asteroids(map_datetime):
 '''List of sectors where we expect to find black holes'''
 expected_black_holes = [2, 54, 99, 112, 205, 292, 355, 370, 409, 446, 500, 502, 521, 641, 696, 737, 755, 777, 869, 928, 951, 1040, 1059, 1089]
 
-'''NPC stores we expect to always find.'''
 def expected_npc_stores(map_datetime):
     """
     What NPC stores exist, and where.
     Returns a list of (name, sector) tuples.
     """
+    return list(game_rules(map_datetime).npc_stores)
+
+'''NPC stores we expect to always find.'''
+def _expected_npc_stores(map_datetime):
+    """
+    Internal - Works out expected_npc_stores().
+    """
     retval = [('Salty Bob`s Waterin` Hole', 1),
               ('Syawillim', 502),
               ('Captain Jork`s Last Chance Saloon', 1075)]
@@ -483,6 +542,76 @@ def expected_npc_stores(map_datetime):
             retval.append(p)
     return retval
 
+'''
+The rules of the game that depend on the date, as returned by game_rules()
+'''
+GameRules = collections.namedtuple('GameRules',
+                                   ['cycle',
+                                    'war_ongoing',
+                                    'can_move_diagonally',
+                                    'missing_links',
+                                    'planets',
+                                    'npc_stores',
+                                    'asteroids'])
+
+def rule_change_datetimes():
+    """
+    Returns a sorted list of every datetime when any of the GameRules changed.
+    """
+    retval = cycle_start[1:] + war_end[1:]
+    retval += [space_mazified_datetime,
+               flambe_added_datetime,
+               planets_moved_datetime,
+               shutdown_datetime,
+               reboot_datetime,
+               hedrok_removed_datetime,
+               hedrok_restored_datetime,
+               space_rework_datetime,
+               deep_six_removed_datetime,
+               phallorus_removed_datetime,
+               eroticon_69_removed_datetime,
+               leroy_tongs_datetime,
+               clingons_datetime,
+               gobbles_datetime,
+               cycle_16_map_change_datetime,
+               cycle_19_map_change_datetime]
+    return sorted(set(retval))
+
+def _compile_epochs():
+    """
+    Internal - Works out the GameRules for each epoch - a period when none of them change.
+    Returns a tuple of (sorted list of epoch start datetimes, list of GameRules).
+    Each rule change datetime and the instant after it both start an epoch,
+    so it doesn't matter whether the change applies from that time or just after it.
+    """
+    starts = set([datetime.datetime.min])
+    for d in rule_change_datetimes():
+        starts.add(d)
+        starts.add(d + datetime.timedelta(microseconds=1))
+    starts = sorted(starts)
+    rules = [GameRules(_cycle(d),
+                       _war_ongoing(d),
+                       _can_move_diagonally(d),
+                       _expected_missing_links(d),
+                       tuple(_expected_planets(d)),
+                       tuple(_expected_npc_stores(d)),
+                       _expected_asteroids(d)) for d in starts]
+    return (starts, rules)
+
+_epoch_starts, _epoch_rules = _compile_epochs()
+
+def game_rules(map_datetime):
+    """
+    Returns the GameRules in force at the specified SSW time.
+    """
+    return _epoch_rules[bisect.bisect_right(_epoch_starts, map_datetime) - 1]
+
+def game_rule_epochs():
+    """
+    Returns a list of (start datetime, GameRules) tuples, one per epoch, in order.
+    """
+    return list(zip(_epoch_starts, _epoch_rules))
+
 '''Number of space jellyfish we expect to find'''
 expected_jellyfish = 100
 
@@ -602,10 +731,10 @@ def adj_sectors_towards(from_sector, to_sector, can_move_diagonally):
     retval.sort()
     return retval
 
-def adjacent_sectors(to_sector, can_move_diagonally):
+def _find_adjacent_sectors(to_sector, can_move_diagonally):
     '''
-    Returns the list of adjacent sectors
-    Note that you can't necessarily get to all of them
+    Internal - Returns the list of adjacent sectors
+    Used to build the tables that adjacent_sectors() looks them up in
     '''
     retval = []
     col,row = sector_to_coords(to_sector)
@@ -626,6 +755,50 @@ def adjacent_sectors(to_sector, can_move_diagonally):
             retval.append(coords_to_sector(col,row+1))
     return retval
 
+'''
+Adjacent sectors, with and without diagonal moves.
+dict, keyed by can_move_diagonally, of lists, indexed by sector, of tuples of sectors.
+'''
+_adjacent_sectors = {}
+for _diagonal in [True, False]:
+    _adjacent_sectors[_diagonal] = [()] + [tuple(_find_adjacent_sectors(_sector, _diagonal))
+                                           for _sector in all_sectors]
+
+def adjacent_sectors(to_sector, can_move_diagonally):
+    '''
+    Returns the list of adjacent sectors
+    Note that you can't necessarily get to all of them
+    '''
+    return list(_adjacent_sectors[bool(can_move_diagonally)][to_sector])
+
+def passable_neighbours(can_move_diagonally, missing_links={}):
+    '''
+    Returns a list, indexed by sector, of tuples of the adjacent sectors
+    that you can actually move to (i.e. excluding any missing links).
+    This is much quicker to use than calling adjacent_sectors() and can_move()
+    for every move.
+    '''
+    adjacent = _adjacent_sectors[bool(can_move_diagonally)]
+    retval = [()]
+    for sector in all_sectors:
+        missing = missing_links.get(sector)
+        if missing:
+            retval.append(tuple([s for s in adjacent[sector] if s not in missing]))
+        else:
+            retval.append(adjacent[sector])
+    return retval
+
+def reverse_neighbours(neighbours):
+    '''
+    Takes a passable_neighbours() table and returns the equivalent table
+    of the sectors you can move from to reach each sector.
+    '''
+    retval = [[] for s in neighbours]
+    for sector in all_sectors:
+        for s in neighbours[sector]:
+            retval[s].append(sector)
+    return [tuple(s) for s in retval]
+
 def can_move(from_sector, to_sector, missing_links={}, avoiding_sectors=[]):
     '''
     Checks whether you can move from from_sector to adjacent to_sector
@@ -654,13 +827,15 @@ def routes_of_length(length,
                      to_sector,
                      can_move_diagonally,
                      missing_links={},
-                     avoiding_sectors=[]):
+                     avoiding_sectors=[],
+                     neighbours=None):
     '''
     Find all routes between two sectors of the specified length
     This will take a long time if length is more than about 7
+    neighbours is the passable_neighbours() table, calculated if not provided
     '''
-    # TODO Could do with a more efficient algorithm for this
-    #      It's ok for routes up to about 7 length, but rapidly slows down
+    # Note that ShortestRouteDag is far more efficient for shortest routes
+    #      This is ok for routes up to about 7 length, but rapidly slows down
     #      Probably mostly because of the number of routes :
     #      Distance Max routes
     #      1        1
@@ -680,15 +855,13 @@ def routes_of_length(length,
     if (length == 0) and (from_sector == to_sector):
        # We just need to stay in from_sector
        return [[]]
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
     retval = []
     length -= 1
-    for s in adjacent_sectors(from_sector, can_move_diagonally):
+    for s in neighbours[from_sector]:
         # Figure out whether s is 1 closer to to_sector
-        if can_move(from_sector,
-                    s,
-                    missing_links,
-                    avoiding_sectors) and (direct_distance(s,
-                                                           to_sector) <= length) :
+        if (s not in avoiding_sectors) and (direct_distance(s, to_sector) <= length):
             # It is
             retval.append([s])
     # Here's the recursive bit - termination condition is that we've got there
@@ -702,7 +875,8 @@ def routes_of_length(length,
                                     to_sector,
                                     can_move_diagonally,
                                     missing_links,
-                                    avoiding_sectors+route)
+                                    avoiding_sectors+route,
+                                    neighbours)
             for s in temp:
                 new_retval.append(route+s)
         retval = new_retval
@@ -713,9 +887,11 @@ def a_route_of_length(length,
                       to_sector,
                       can_move_diagonally,
                       missing_links={},
-                      avoiding_sectors=[]):
+                      avoiding_sectors=[],
+                      neighbours=None):
     '''
     Find any one route of the specified length between the two sectors
+    neighbours is the passable_neighbours() table, calculated if not provided
     '''
     print(file=flog)
     print("a_route_of_length(%d, %d, %d, %s, ..., %s)" % (length, from_sector, to_sector, str(can_move_diagonally), str(avoiding_sectors)), file=flog)
@@ -723,9 +899,10 @@ def a_route_of_length(length,
         # We just need to stay in from_sector
         print(" Returning []", file=flog)
         return []
-    elif (length == 1) and to_sector in adjacent_sectors(from_sector,
-                                                         can_move_diagonally):
-        if can_move(from_sector, to_sector, missing_links, avoiding_sectors):
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
+    if (length == 1) and to_sector in _adjacent_sectors[bool(can_move_diagonally)][from_sector]:
+        if (to_sector in neighbours[from_sector]) and (to_sector not in avoiding_sectors):
             print(" Returning [%d]" % to_sector, file=flog)
             return [to_sector]
         else:
@@ -733,21 +910,18 @@ def a_route_of_length(length,
             print(" Returning None (1)", file=flog)
             return None
     length -= 1
-    for s in adjacent_sectors(from_sector, can_move_diagonally):
+    for s in neighbours[from_sector]:
         print(" Trying via %d" % s, file=flog)
         # Figure out whether s is 1 closer to to_sector
-        if can_move(from_sector,
-                    s,
-                    missing_links,
-                    avoiding_sectors) and (direct_distance(s,
-                                                           to_sector) <= length) :
+        if (s not in avoiding_sectors) and (direct_distance(s, to_sector) <= length):
             print(" Recursing", file=flog)
             temp = a_route_of_length(length,
                                      s,
                                      to_sector,
                                      can_move_diagonally,
                                      missing_links,
-                                     avoiding_sectors+[from_sector,s])
+                                     avoiding_sectors+[from_sector,s],
+                                     neighbours)
             if temp != None:
                 print(" Returning [%d] + %s" % (s, str(temp)), file=flog)
                 return [s] + temp
@@ -760,29 +934,145 @@ def routes(from_sector,
            can_move_diagonally,
            missing_links={},
            avoiding_sectors=[],
-           max_length=max_route_length):
+           max_length=max_route_length,
+           neighbours=None):
     '''
     Find routes from one sector to another
     Returns a list of ordered lists of intermediate sectors
     Will only include shortest-distance routes
     (all routes returned will be the same length)
+    Use ShortestRouteDag directly to avoid building the whole list.
     '''
-    if (from_sector in avoiding_sectors) or (to_sector in avoiding_sectors):
-        # No route is possible
-        return []
-    retval = []
-    route_length = direct_distance(from_sector, to_sector)
-    # Find all shortest-distance routes first
-    # If there aren't any, find routes that are 1 longer, etc.
-    while (len(retval) == 0) and (route_length < max_length):
-        retval = routes_of_length(route_length,
-                                  from_sector,
-                                  to_sector,
-                                  can_move_diagonally,
-                                  missing_links,
-                                  avoiding_sectors)
-        route_length += 1
-    return retval
+    dag = ShortestRouteDag(from_sector,
+                           to_sector,
+                           can_move_diagonally,
+                           missing_links,
+                           avoiding_sectors,
+                           max_length,
+                           neighbours)
+    return list(dag.routes())
+
+class ShortestRouteDag():
+    '''
+    All the shortest routes between two sectors, stored as a directed acyclic graph.
+    One breadth-first search builds it. After that, routes can be counted,
+    enumerated one at a time, or the best one picked, without ever building
+    the (potentially huge) list of all of them.
+    Routes are ordered lists of sectors, excluding from_sector and including
+    to_sector, exactly as returned by routes_of_length().
+    '''
+    def __init__(self,
+                 from_sector,
+                 to_sector,
+                 can_move_diagonally,
+                 missing_links={},
+                 avoiding_sectors=[],
+                 max_length=max_route_length,
+                 neighbours=None):
+        self.from_sector = from_sector
+        self.to_sector = to_sector
+        # Length of the shortest routes, or None if there aren't any
+        self.length = None
+        # dict, indexed by sector, of lists of next sectors on a shortest route
+        self.next_sectors = {}
+        # dict, indexed by sector, of the number of shortest routes from there
+        self.route_counts = {}
+        # list, indexed by distance from from_sector, of lists of sectors on a shortest route
+        self.levels = []
+        avoiding = set(avoiding_sectors)
+        if (from_sector in avoiding) or (to_sector in avoiding):
+            # No route is possible
+            return
+        if neighbours == None:
+            neighbours = passable_neighbours(can_move_diagonally, missing_links)
+        # Breadth-first search out from from_sector, one distance at a time,
+        # stopping as soon as we reach to_sector
+        levels = [[from_sector]]
+        distance = {from_sector: 0}
+        while (to_sector not in distance) and (len(levels) < max_length):
+            level = []
+            for sector in levels[-1]:
+                for s in neighbours[sector]:
+                    if (s not in distance) and (s not in avoiding):
+                        distance[s] = len(levels)
+                        level.append(s)
+            if len(level) == 0:
+                break
+            levels.append(level)
+        if to_sector not in distance:
+            return
+        self.length = distance[to_sector]
+        # Now work back from to_sector, keeping only the sectors that lead to it
+        self.route_counts[to_sector] = 1
+        self.next_sectors[to_sector] = []
+        self.levels = [[to_sector]]
+        for d in range(self.length - 1, -1, -1):
+            level = []
+            for sector in levels[d]:
+                next_sectors = [s for s in neighbours[sector]
+                                if (s in self.route_counts) and (distance[s] == d + 1)]
+                if len(next_sectors) > 0:
+                    self.next_sectors[sector] = next_sectors
+                    self.route_counts[sector] = sum([self.route_counts[s] for s in next_sectors])
+                    level.append(sector)
+            self.levels.insert(0, level)
+
+    def count(self):
+        '''
+        Returns the number of shortest routes, without enumerating them
+        '''
+        return self.route_counts.get(self.from_sector, 0)
+
+    def routes(self):
+        '''
+        Generator that yields each shortest route in turn
+        '''
+        if self.length == None:
+            return
+        route = []
+        # Stack of iterators over the choices at each step of the route
+        choices = [iter(self.next_sectors[self.from_sector])]
+        while len(choices) > 0:
+            try:
+                s = next(choices[-1])
+            except StopIteration:
+                choices.pop()
+                if len(route) > 0:
+                    route.pop()
+                continue
+            route.append(s)
+            if s == self.to_sector:
+                yield list(route)
+                route.pop()
+            else:
+                choices.append(iter(self.next_sectors[s]))
+        if self.length == 0:
+            # We just need to stay in from_sector
+            yield []
+
+    def best_route(self, cost):
+        '''
+        Returns the shortest route that minimises the total of cost(sector)
+        over the sectors in the route, or None if there is no route.
+        Where routes tie, the first one that routes() would yield is returned.
+        '''
+        if self.length == None:
+            return None
+        # best is a dict, indexed by sector, of (total cost, next sector) tuples
+        best = {self.to_sector: (0, None)}
+        # Work back from to_sector, so the next sectors are always done first
+        for level in reversed(self.levels[:-1]):
+            for sector in level:
+                for s in self.next_sectors[sector]:
+                    total = cost(s) + best[s][0]
+                    if (sector not in best) or (total < best[sector][0]):
+                        best[sector] = (total, s)
+        route = []
+        sector = self.from_sector
+        while sector != self.to_sector:
+            sector = best[sector][1]
+            route.append(sector)
+        return route
 
 def a_route(from_sector,
             to_sector,
@@ -790,7 +1080,8 @@ def a_route(from_sector,
             missing_links={},
             avoiding_sectors=[],
             max_length=max_route_length,
-            min_length=0):
+            min_length=0,
+            neighbours=None):
     '''
     Find a route from one sector to another
     Returns an ordered list of intermediate sectors
@@ -813,6 +1104,8 @@ def a_route(from_sector,
         if len(set(adjacent_sectors(to_sector,
                                     can_move_diagonally)) - set(avoiding_sectors)) == 0:
             return None
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
     retval = None
     # Find a shortest-distance route first
     # If there aren't any, find routes that are 1 longer, etc.
@@ -823,8 +1116,555 @@ def a_route(from_sector,
                                    to_sector,
                                    can_move_diagonally,
                                    missing_links,
-                                   avoiding_sectors)
+                                   avoiding_sectors,
+                                   neighbours)
+        route_length += 1
+    return retval
+
+def safest_routes_from(from_sectors,
+                       can_move_diagonally,
+                       missing_links={},
+                       avoiding_sectors=[],
+                       drone_sectors=[],
+                       unexplored_sectors=[],
+                       max_length=max_route_length,
+                       neighbours=None,
+                       to_sector=None,
+                       count_from_sectors=False):
+    '''
+    Find the safest of the shortest routes to every sector from whichever
+    of from_sectors is nearest, in a single breadth-first search.
+    Routes are compared first by length, then by the number of drone_sectors
+    they pass through, then by the number of unexplored_sectors, then by
+    which comes first in from_sectors.
+    Only routes shorter than max_length are considered.
+    If to_sector is specified, stops as soon as it has been reached.
+    If count_from_sectors is True, drones and unexplored sectors in from_sectors
+    count against routes from them (useful when searching backwards).
+    Returns a dict, indexed by sector, of (moves, drone count, unexplored count,
+    index into from_sectors, previous sector) tuples. Use route_to() to extract routes.
+    '''
+    avoiding = set(avoiding_sectors)
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
+    drones = set(drone_sectors)
+    unexplored = set(unexplored_sectors)
+    best = {}
+    level = []
+    for i, sector in enumerate(from_sectors):
+        if (sector not in avoiding) and (sector not in best):
+            if count_from_sectors:
+                best[sector] = (0, int(sector in drones), int(sector in unexplored), i, None)
+            else:
+                best[sector] = (0, 0, 0, i, None)
+            level.append(sector)
+    route_length = 0
+    while (to_sector not in best) and (len(level) > 0) and (route_length + 1 < max_length):
         route_length += 1
+        next_level = []
+        next_best = {}
+        for sector in level:
+            (moves, drone_count, unexplored_count, i, previous) = best[sector]
+            for s in neighbours[sector]:
+                if (s in best) or (s in avoiding):
+                    continue
+                label = (route_length,
+                         drone_count + (s in drones),
+                         unexplored_count + (s in unexplored),
+                         i,
+                         sector)
+                if s not in next_best:
+                    next_level.append(s)
+                elif label[:4] >= next_best[s][:4]:
+                    continue
+                next_best[s] = label
+        best.update(next_best)
+        level = next_level
+    return best
+
+def route_to(best, to_sector):
+    '''
+    Extract the route to to_sector from the return value of safest_routes_from().
+    Returns an ordered list of intermediate sectors, or None if there's no route
+    '''
+    if to_sector not in best:
+        return None
+    route = []
+    sector = to_sector
+    while best[sector][4] != None:
+        route.append(sector)
+        sector = best[sector][4]
+    route.reverse()
+    return route
+
+def distances_by_policy(from_sectors,
+                        blocked_masks,
+                        can_move_diagonally,
+                        missing_links={},
+                        max_length=max_route_length,
+                        neighbours=None):
+    '''
+    Breadth-first search from the nearest of from_sectors for several sets of
+    blocked sectors at once, sharing each expansion of the frontier between them.
+    blocked_masks is a list of bitsets (see sectors_to_bits()) of blocked sectors.
+    Returns a list, in the same order as blocked_masks, of arrays, indexed by sector,
+    of the number of moves from the nearest of from_sectors (0xFFFF if there's no
+    route shorter than max_length).
+    '''
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
+    size = len(all_sectors) + 1
+    # Bit i of blocked[sector] is set if the sector is in blocked_masks[i]
+    blocked = [0] * size
+    for i, mask in enumerate(blocked_masks):
+        for sector in bits_to_sectors(mask):
+            blocked[sector] |= 1 << i
+    all_masks = (1 << len(blocked_masks)) - 1
+    retval = [array.array('H', [RouteRow._none]) * size for mask in blocked_masks]
+    # Which of the blocked_masks each sector has been reached for
+    reached = [0] * size
+    frontier = {}
+    for sector in from_sectors:
+        new = all_masks & ~blocked[sector] & ~reached[sector]
+        if new:
+            reached[sector] |= new
+            frontier[sector] = new
+    moves = 0
+    while len(frontier) > 0:
+        for sector, bits in six.iteritems(frontier):
+            while bits:
+                bit = bits & -bits
+                retval[bit.bit_length() - 1][sector] = moves
+                bits ^= bit
+        moves += 1
+        if moves >= max_length:
+            break
+        next_frontier = {}
+        for sector, bits in six.iteritems(frontier):
+            for s in neighbours[sector]:
+                new = bits & ~reached[s] & ~blocked[s]
+                if new:
+                    reached[s] |= new
+                    next_frontier[s] = next_frontier.get(s, 0) | new
+        frontier = next_frontier
+    return retval
+
+def connected_components(neighbours, blocked=0):
+    '''
+    Labels each sector that isn't in bitset blocked with the (weakly)
+    connected component it's in, using union-find.
+    Links can go just one way, so there may be no route between two sectors
+    with the same label, but there's never one between different labels.
+    Returns an array, indexed by sector, of labels, with 0 for blocked sectors.
+    '''
+    blocked = set(bits_to_sectors(blocked))
+    parent = list(range(len(all_sectors) + 1))
+
+    def find(sector):
+        while parent[sector] != sector:
+            parent[sector] = parent[parent[sector]]
+            sector = parent[sector]
+        return sector
+
+    for sector in all_sectors:
+        if sector in blocked:
+            continue
+        for s in neighbours[sector]:
+            if s not in blocked:
+                a = find(sector)
+                b = find(s)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+    retval = array.array('H', [0]) * (len(all_sectors) + 1)
+    for sector in all_sectors:
+        if sector not in blocked:
+            retval[sector] = find(sector)
+    return retval
+
+def update_distances(distances,
+                     from_sectors,
+                     old_blocked,
+                     new_blocked,
+                     neighbours,
+                     predecessors,
+                     max_length=max_route_length):
+    '''
+    Updates in place one of the arrays of distances from distances_by_policy(),
+    when the blocked sectors change from bitset old_blocked to new_blocked.
+    predecessors is the reverse_neighbours() of neighbours.
+    Only the entries that can have changed are looked at - first the ones that
+    depended on newly blocked sectors are discarded, then they and the sectors
+    around newly unblocked sectors are searched from again.
+    Returns the number of entries that were discarded.
+    '''
+    none = RouteRow._none
+    sources = set(from_sectors)
+    # Sectors whose distance went via a newly blocked sector, nearest first
+    invalid = set()
+    heap = [(distances[s], s) for s in bits_to_sectors(new_blocked & ~old_blocked)
+            if distances[s] != none]
+    heapq.heapify(heap)
+    while len(heap) > 0:
+        moves, sector = heapq.heappop(heap)
+        if sector in invalid:
+            continue
+        if not (new_blocked >> sector) & 1:
+            # Is there still another way here that's just as short ?
+            if sector in sources:
+                continue
+            if any(distances[p] == moves - 1 and p not in invalid
+                   for p in predecessors[sector]):
+                continue
+        invalid.add(sector)
+        for s in neighbours[sector]:
+            if distances[s] == moves + 1 and s not in invalid:
+                heapq.heappush(heap, (moves + 1, s))
+    for sector in invalid:
+        distances[sector] = none
+    # Search again from around the discarded and newly unblocked sectors
+    heap = []
+    for sector in invalid.union(bits_to_sectors(old_blocked & ~new_blocked)):
+        if (new_blocked >> sector) & 1:
+            continue
+        if sector in sources:
+            moves = 0
+        else:
+            moves = min([distances[p] for p in predecessors[sector]] + [none])
+            if moves == none:
+                continue
+            moves += 1
+        if moves < min(max_length, distances[sector]):
+            distances[sector] = moves
+            heapq.heappush(heap, (moves, sector))
+    while len(heap) > 0:
+        moves, sector = heapq.heappop(heap)
+        if moves > distances[sector] or moves + 1 >= max_length:
+            continue
+        for s in neighbours[sector]:
+            if moves + 1 < distances[s] and not (new_blocked >> s) & 1:
+                distances[s] = moves + 1
+                heapq.heappush(heap, (moves + 1, s))
+    return len(invalid)
+
+def safest_route(from_sector,
+                 to_sector,
+                 can_move_diagonally,
+                 missing_links={},
+                 avoiding_sectors=[],
+                 drone_sectors=[],
+                 unexplored_sectors=[],
+                 max_length=max_route_length,
+                 neighbours=None):
+    '''
+    Find the safest of the shortest routes from one sector to another
+    Routes are compared first by length, then by the number of drone_sectors
+    they pass through, then by the number of unexplored_sectors,
+    all in a single breadth-first search.
+    Returns an ordered list of intermediate sectors, or None if there's no route
+    '''
+    if (from_sector in avoiding_sectors) or (to_sector in avoiding_sectors):
+        # No route is possible
+        return None
+    best = safest_routes_from([from_sector],
+                              can_move_diagonally,
+                              missing_links,
+                              avoiding_sectors,
+                              drone_sectors,
+                              unexplored_sectors,
+                              max_length,
+                              neighbours,
+                              to_sector)
+    return route_to(best, to_sector)
+
+class RouteRow():
+    '''
+    A compact, read-only form of the dict returned by safest_routes_from().
+    Supports "in" and [] in the same way, so route_to() works with either.
+    '''
+    # Marks sectors that can't be reached
+    _none = 0xFFFF
+
+    def __init__(self, best):
+        size = len(all_sectors) + 1
+        self.moves = array.array('H', [self._none]) * size
+        self.drones = array.array('H', [0]) * size
+        self.unexplored = array.array('H', [0]) * size
+        self.index = array.array('H', [0]) * size
+        # 0 isn't a sector, so we use it for None
+        self.previous = array.array('H', [0]) * size
+        for sector, (moves, drones, unexplored, index, previous) in six.iteritems(best):
+            self.moves[sector] = moves
+            self.drones[sector] = drones
+            self.unexplored[sector] = unexplored
+            self.index[sector] = index
+            self.previous[sector] = previous or 0
+
+    def __contains__(self, sector):
+        return self.moves[sector] != self._none
+
+    def __getitem__(self, sector):
+        if self.moves[sector] == self._none:
+            raise KeyError(sector)
+        return (self.moves[sector],
+                self.drones[sector],
+                self.unexplored[sector],
+                self.index[sector],
+                self.previous[sector] or None)
+
+class RouteRows():
+    '''
+    Provides safest_routes_from() results as RouteRows, computing each row -
+    one per source sector, or per tuple of source sectors - when it's first needed.
+    Up to max_rows rows are remembered, forgetting the least recently used.
+    Once full_threshold different single sectors have been asked for,
+    the rows for every sector are computed and kept.
+    '''
+    def __init__(self,
+                 can_move_diagonally,
+                 missing_links={},
+                 avoiding_sectors=[],
+                 drone_sectors=[],
+                 unexplored_sectors=[],
+                 neighbours=None,
+                 count_from_sectors=False,
+                 max_rows=100,
+                 full_threshold=300):
+        self.can_move_diagonally = can_move_diagonally
+        self.missing_links = missing_links
+        self.avoiding_sectors = avoiding_sectors
+        self.drone_sectors = drone_sectors
+        self.unexplored_sectors = unexplored_sectors
+        if neighbours == None:
+            neighbours = passable_neighbours(can_move_diagonally, missing_links)
+        self.neighbours = neighbours
+        self.count_from_sectors = count_from_sectors
+        self.max_rows = max_rows
+        self.full_threshold = full_threshold
+        self.rows = collections.OrderedDict()
+        self.requested = set()
+        # Populated once full_threshold is reached
+        self.full = None
+        self.searches = 0
+
+    def _search(self, from_sectors):
+        '''
+        Internal - Computes one row.
+        '''
+        self.searches += 1
+        return RouteRow(safest_routes_from(from_sectors,
+                                           self.can_move_diagonally,
+                                           self.missing_links,
+                                           self.avoiding_sectors,
+                                           self.drone_sectors,
+                                           self.unexplored_sectors,
+                                           len(all_sectors) + 1,
+                                           self.neighbours,
+                                           count_from_sectors=self.count_from_sectors))
+
+    def row(self, sources):
+        '''
+        Returns the RouteRow for routes from the nearest of sources,
+        which can be a single sector or a tuple of sectors.
+        '''
+        single = not isinstance(sources, tuple)
+        if single and (self.full != None):
+            if self.full[sources] == None:
+                self.full[sources] = self._search([sources])
+            return self.full[sources]
+        try:
+            retval = self.rows.pop(sources)
+        except KeyError:
+            if single:
+                self.requested.add(sources)
+                if len(self.requested) >= self.full_threshold:
+                    self.fill()
+                    return self.full[sources]
+                retval = self._search([sources])
+            else:
+                retval = self._search(list(sources))
+            if len(self.rows) >= self.max_rows:
+                self.rows.popitem(last=False)
+        # (Re-)insert it as the most recently used
+        self.rows[sources] = retval
+        return retval
+
+    def update(self, avoiding_sectors, drone_sectors):
+        '''
+        Change the avoiding_sectors and drone_sectors, forgetting just
+        the rows that this can change - those that reach a sector that's
+        changed, or that reach a sector next to one that's no longer avoided.
+        '''
+        old_avoiding = set(self.avoiding_sectors)
+        changed = old_avoiding.symmetric_difference(avoiding_sectors)
+        changed.update(set(self.drone_sectors).symmetric_difference(drone_sectors))
+        cleared = old_avoiding.difference(avoiding_sectors)
+        if cleared:
+            predecessors = reverse_neighbours(self.neighbours)
+            for sector in cleared:
+                changed.update(predecessors[sector])
+        self.avoiding_sectors = avoiding_sectors
+        self.drone_sectors = drone_sectors
+
+        def affected(row):
+            return any(sector in row for sector in changed)
+
+        for sources in [k for k, row in six.iteritems(self.rows) if affected(row)]:
+            del self.rows[sources]
+        if self.full != None:
+            for sector in all_sectors:
+                if (self.full[sector] != None) and affected(self.full[sector]):
+                    self.full[sector] = None
+
+    def fill(self):
+        '''
+        Compute and keep the rows for every sector.
+        '''
+        self.full = [None]
+        for sector in all_sectors:
+            try:
+                self.full.append(self.rows.pop(sector))
+            except KeyError:
+                self.full.append(self._search([sector]))
+
+def k_shortest_routes(from_sector,
+                      to_sector,
+                      can_move_diagonally,
+                      missing_links={},
+                      avoiding_sectors=[],
+                      drone_sectors=[],
+                      unexplored_sectors=[],
+                      max_length=max_route_length,
+                      neighbours=None):
+    '''
+    Generator of the distinct routes (that don't visit any sector twice)
+    from one sector to another, best first, using Yen's algorithm.
+    Routes are compared as in safest_route() - by length, then by the number of
+    drone_sectors, then by the number of unexplored_sectors they pass through.
+    Only routes shorter than max_length are generated.
+    Each route is found on demand, so stop iterating once you have enough.
+    '''
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
+    drones = set(drone_sectors)
+    unexplored = set(unexplored_sectors)
+
+    def cost(route):
+        return (len(route),
+                len([s for s in route if s in drones]),
+                len([s for s in route if s in unexplored]))
+
+    route = safest_route(from_sector,
+                         to_sector,
+                         can_move_diagonally,
+                         missing_links,
+                         avoiding_sectors,
+                         drone_sectors,
+                         unexplored_sectors,
+                         max_length,
+                         neighbours)
+    if route == None:
+        return
+    # Found routes, and the sectors they pass through
+    found = [[from_sector] + route]
+    seen = set([tuple(route)])
+    candidates = []
+    while True:
+        yield route
+        last = found[-1]
+        for i in range(len(last) - 1):
+            # Deviate from the last route at its i'th sector
+            spur = last[i]
+            root = last[:i+1]
+            # Don't go the same way as any route that got here the same way
+            blocked = set([r[i+1] for r in found if r[:i+1] == root])
+            spur_neighbours = list(neighbours)
+            spur_neighbours[spur] = tuple([s for s in neighbours[spur] if s not in blocked])
+            spur_route = safest_route(spur,
+                                      to_sector,
+                                      can_move_diagonally,
+                                      missing_links,
+                                      list(avoiding_sectors) + root[:-1],
+                                      drone_sectors,
+                                      unexplored_sectors,
+                                      max_length - i,
+                                      spur_neighbours)
+            if spur_route == None:
+                continue
+            candidate = root[1:] + spur_route
+            if tuple(candidate) not in seen:
+                seen.add(tuple(candidate))
+                heapq.heappush(candidates, (cost(candidate), candidate))
+        if len(candidates) == 0:
+            return
+        (c, route) = heapq.heappop(candidates)
+        found.append([from_sector] + route)
+
+def warp_graph(warp_costs):
+    '''
+    Takes a dict of dicts of warp fuel costs, like SectorMapParser.warp_costs,
+    and returns a list, indexed by sector, of tuples of (destination, fuel) tuples.
+    '''
+    retval = [() for s in range(len(all_sectors) + 1)]
+    for start, costs in six.iteritems(warp_costs):
+        retval[start] = tuple(sorted(six.iteritems(costs)))
+    return retval
+
+def pareto_routes(from_sector,
+                  to_sector,
+                  can_move_diagonally,
+                  warps=None,
+                  missing_links={},
+                  avoiding_sectors=[],
+                  max_length=max_route_length,
+                  neighbours=None):
+    '''
+    Find the routes between two sectors that trade off moves against fuel.
+    Each IR warp in warps (a warp_graph()) counts as one move plus its fuel cost.
+    Normal moves are assumed to cost no fuel.
+    Returns a list of (moves, fuel, route) tuples in order of increasing moves
+    (and so decreasing fuel), such that no route is beaten on both moves and fuel.
+    Only routes shorter than max_length are considered.
+    '''
+    if (from_sector in avoiding_sectors) or (to_sector in avoiding_sectors):
+        return []
+    if from_sector == to_sector:
+        return [(0, 0, [])]
+    avoiding = set(avoiding_sectors)
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
+    if warps == None:
+        warps = warp_graph({})
+    # Lowest fuel used to get to each sector in fewer moves
+    best_fuel = {from_sector: 0}
+    level = {from_sector: (0, [])}
+    retval = []
+    moves = 0
+    while (len(level) > 0) and (moves + 1 < max_length):
+        moves += 1
+        next_level = {}
+        for sector, (fuel, route) in six.iteritems(level):
+            edges = [(s, 0) for s in neighbours[sector]] + list(warps[sector])
+            for s, f in edges:
+                f += fuel
+                if s in avoiding:
+                    continue
+                # Only interested if it's an improvement on any quicker route
+                if (s in best_fuel) and (best_fuel[s] <= f):
+                    continue
+                if (to_sector in best_fuel) and (best_fuel[to_sector] <= f):
+                    continue
+                if (s in next_level) and (next_level[s][0] <= f):
+                    continue
+                next_level[s] = (f, route + [s])
+        for s, (fuel, route) in six.iteritems(next_level):
+            best_fuel[s] = fuel
+        if to_sector in next_level:
+            (fuel, route) = next_level.pop(to_sector)
+            retval.append((moves, fuel, route))
+            if fuel == 0:
+                # Can't do any better
+                break
+        level = next_level
     return retval
 
 def drones_en_route(route, drones):
@@ -841,6 +1681,99 @@ def drones_en_route(route, drones):
     retval = [drone_dict[sector] for sector in drone_sectors]
     return retval
 
+def sectors_to_bits(sectors):
+    '''
+    Convert a list (or set) of sectors to an integer bitset,
+    where bit n is set if sector n is in the list
+    '''
+    bits = 0
+    for sector in sectors:
+        bits |= 1 << sector
+    return bits
+
+# For each possible byte value, the list of bits that are set
+_bits_in_byte = [[b for b in range(8) if (byte >> b) & 1] for byte in range(256)]
+
+def bits_to_sectors(bits):
+    '''
+    Convert an integer bitset back to a sorted list of sectors
+    '''
+    retval = []
+    hex_str = '%x' % bits
+    if len(hex_str) % 2:
+        hex_str = '0' + hex_str
+    base = 0
+    # Work a byte at a time, which is much faster than a bit at a time
+    for byte in reversed(bytearray(binascii.unhexlify(hex_str))):
+        if byte:
+            retval += [base + b for b in _bits_in_byte[byte]]
+        base += 8
+    return retval
+
+def movement_masks(can_move_diagonally, missing_links={}, neighbours=None):
+    '''
+    Returns a list of (offset, mask) tuples, one for each direction you can move in.
+    Bit n of mask is set if you can move from sector n to sector n + offset.
+    Moving off the edge of the map or along a missing link is never allowed.
+    neighbours is the passable_neighbours() table, calculated if not provided
+    '''
+    if neighbours == None:
+        neighbours = passable_neighbours(can_move_diagonally, missing_links)
+    masks = {}
+    for sector in all_sectors:
+        for s in neighbours[sector]:
+            masks[s - sector] = masks.get(s - sector, 0) | (1 << sector)
+    return sorted(masks.items())
+
+def expand_bits(bits, masks, avoiding_bits=0):
+    '''
+    Add every sector that can be reached in one move to the bitset bits.
+    masks is the return value from movement_masks().
+    avoiding_bits is a bitset of sectors that can't be entered.
+    '''
+    retval = bits
+    for offset, mask in masks:
+        if offset > 0:
+            retval |= (bits & mask) << offset
+        else:
+            retval |= (bits & mask) >> -offset
+    return retval & ~avoiding_bits
+
+def reachable_bits(from_bits, masks, avoiding_bits=0, max=None):
+    '''
+    Bitset of the sectors that can be reached from any of the sectors in from_bits
+    in up to max moves (or any number of moves, if max is None).
+    '''
+    retval = from_bits & ~avoiding_bits
+    moves = 0
+    while (max == None) or (moves < max):
+        new_retval = expand_bits(retval, masks, avoiding_bits)
+        if new_retval == retval:
+            # Nowhere new to go
+            break
+        retval = new_retval
+        moves += 1
+    return retval
+
+def sectors_connected(from_sector,
+                      to_sector,
+                      can_move_diagonally,
+                      missing_links={},
+                      avoiding_sectors=[]):
+    '''
+    Can you fly from from_sector to to_sector at all (by any length of route) ?
+    '''
+    masks = movement_masks(can_move_diagonally, missing_links)
+    avoiding_bits = sectors_to_bits(avoiding_sectors)
+    bits = (1 << from_sector) & ~avoiding_bits
+    to_bit = 1 << to_sector
+    while not (bits & to_bit):
+        new_bits = expand_bits(bits, masks, avoiding_bits)
+        if new_bits == bits:
+            return False
+        bits = new_bits
+    return True
+
 def accessible_sectors(from_sector,
                        can_move_diagonally,
                        missing_links={},
@@ -851,24 +1784,11 @@ def accessible_sectors(from_sector,
     Figure out which sectors can be reached from the specified start sector.
     Returns a set of sectors.
     '''
-    # Is start_sector accessible ?
-    if from_sector in avoiding_sectors:
-        return set()
-    retval = set([from_sector])
-    # Now keep adding adjacent accessible sectors that aren't already in the list
-    # until there are no more sectors to check
-    for d in range(0, max):
-        new_retval = retval.copy()
-        for sector in retval:
-            try:
-                missing = missing_links[sector]
-            except KeyError:
-                missing = []
-            for adj in adjacent_sectors(sector, can_move_diagonally):
-                if adj not in avoiding_sectors and adj not in missing:
-                    new_retval.add(adj)
-        retval = new_retval
-    return retval
+    bits = reachable_bits(1 << from_sector,
+                          movement_masks(can_move_diagonally, missing_links),
+                          sectors_to_bits(avoiding_sectors),
+                          max)
+    return set(bits_to_sectors(bits))
 
 
 HOSTILITY_RE = re.compile('<B>PvP Hostility Level:</B> ([-\d]*) \(PvP:(\d*) - PsP:(\d*)\)')
@@ -907,42 +1827,826 @@ CONTENT_RE = re.compile('(.*) \((\d*)\)')
 
 TELEPORTER_RE = re.compile('(.*) \((\d*)\)')
 
+'''
+The things that a SectorMapParser can be asked to parse.
+The date, universe state, totals and which sectors are explored are always parsed.
+'''
+all_fields = frozenset(['ores',
+                        'warps',
+                        'jellyfish',
+                        'luvsats',
+                        'black holes',
+                        'planets',
+                        'links',
+                        'npc stores',
+                        'ipts',
+                        'asteroids',
+                        'drones',
+                        'trading ports',
+                        'names',
+                        'notes'])
+
+'''
+The fields each script asks SectorMapParser for - just those its output depends on.
+ssw_track_movement also adds the fields for whatever it's been told to track.
+'''
+script_fields = {'ssw_route': frozenset(['links', 'planets', 'ipts', 'drones', 'jellyfish']),
+                 'ssw_probes': frozenset(['jellyfish']),
+                 'ssw_track_movement': frozenset(['ipts']),
+                 'ssw_trade_routes': all_fields}
+
+def parse_map_datetime(text):
+    '''
+    Returns the datetime of the map from text starting with (or containing)
+    its "UTC: hh:mm Mon d, yyyy" line.
+    '''
+    text = text.replace('&nbsp;', ' ')
+    temp = text.find('UTC:')
+    words = text[temp:].split()
+    return datetime.datetime(int(words[4].split('<')[0]),
+                             int(months[words[2]]),
+                             int(words[3][:-1]),
+                             int(words[1][:-3]),
+                             int(words[1][3:]))
+
+'''
+What quick_scan() looks for to count each thing - the same text as
+parse_sector_map.TradingPostParser looks for
+'''
+_quick_scan_markers = {'planets': b'Planet:',
+                       'asteroids': b'There is an asteroid in this sector:',
+                       'black holes': b'Black Hole in sector',
+                       'npc stores': b'NPC Store:',
+                       'jellyfish': b'Space Jellyfish in sector',
+                       'trading ports': b'Trading Port #',
+                       'ipts': b'Emergency IPT',
+                       'luvsats': b'LuvSat in sector'}
+
+_SECTOR_CELL_RE = re.compile(b'<td[^>]*width=[\'"]?4%')
+
+class QuickScan(collections.namedtuple('QuickScan', ['datetime', 'sectors', 'counts'])):
+    '''
+    What quick_scan() found in a file.
+    datetime is None if no map date was found,
+    counts is a dict, indexed by thing (see all_fields), of the number found.
+    '''
+    __slots__ = ()
+
+    def problem(self):
+        '''
+        Returns the reason why the file isn't an SSW sector map, or an empty string
+        '''
+        if self.datetime == None:
+            return 'No map date found'
+        if self.sectors != len(all_sectors):
+            return 'Found %d sectors, not %d' % (self.sectors, len(all_sectors))
+        return ''
+
+def _count_in(buf, text):
+    '''
+    Internal - Counts the occurrences of text in buf.
+    '''
+    retval = 0
+    i = buf.find(text)
+    while i > -1:
+        retval += 1
+        i = buf.find(text, i + len(text))
+    return retval
+
+def _quick_scan_buffer(buf):
+    '''
+    Internal - Does the work for quick_scan() on anything with find().
+    '''
+    map_datetime = None
+    i = buf.find(b'UTC:')
+    while (i > -1) and (map_datetime == None):
+        try:
+            map_datetime = parse_map_datetime(buf[i:i + 60].decode('latin-1'))
+        except (ValueError, KeyError, IndexError):
+            i = buf.find(b'UTC:', i + 1)
+    sectors = len(_SECTOR_CELL_RE.findall(buf))
+    counts = dict([(thing, _count_in(buf, marker))
+                   for thing, marker in six.iteritems(_quick_scan_markers)])
+    return QuickScan(map_datetime, sectors, counts)
+
+def quick_scan(source):
+    '''
+    Takes a quick look at a map, without parsing it, to find its date,
+    the number of sectors, and how many of various things it has.
+    source is either the contents of the map, as bytes, or a filename.
+    Uncompressed files are memory-mapped and just searched for the relevant text.
+    Returns a QuickScan.
+    '''
+    if isinstance(source, bytes):
+        return _quick_scan_buffer(source)
+    if _compression(source) != None:
+        with open_map_file(source, True) as f:
+            return _quick_scan_buffer(f.read())
+    with open(source, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return QuickScan(None, 0, {})
+    try:
+        return _quick_scan_buffer(buf)
+    finally:
+        buf.close()
+
+def quick_scan_files(paths):
+    '''
+    Generator that goes through the maps in paths (see iter_map_files()),
+    quick_scan()ning each to find the ones worth parsing - those that look like
+    SSW sector maps, and aren't for the same time as an earlier one.
+    Generates (name, contents, reason, duplicate_of) tuples, where reason is
+    an empty string for the maps worth parsing, and otherwise says why it isn't.
+    duplicate_of is the name of the earlier map for the same time, or None.
+    Uncompressed files are scanned where they lie, and only read if they're
+    worth parsing, so contents is None for those that aren't.
+    '''
+    seen = {}
+    for name, f in iter_map_files(paths):
+        if os.path.isfile(name) and (_compression(name) == None):
+            contents = None
+            scan = quick_scan(name)
+        else:
+            contents = f.read()
+            scan = quick_scan(contents)
+        reason = scan.problem()
+        duplicate_of = None
+        if (not reason) and (scan.datetime in seen):
+            duplicate_of = seen[scan.datetime]
+            reason = 'Same map date as %s' % duplicate_of
+        if not reason:
+            seen[scan.datetime] = name
+            if contents == None:
+                contents = f.read()
+        yield (name, contents, reason, duplicate_of)
+
+'''
+The first few bytes of files compressed in each way that open_map_file() understands
+'''
+_compression_magic = [(b'\x1f\x8b', 'gzip'),
+                      (b'BZh', 'bzip2'),
+                      (b'\xfd7zXZ\x00', 'xz'),
+                      (b'\x28\xb5\x2f\xfd', 'zstd')]
+
+def _compression_of(start):
+    '''
+    Internal - Returns how data starting with start is compressed
+    (see _compression_magic), or None.
+    '''
+    for magic, compression in _compression_magic:
+        if start.startswith(magic):
+            return compression
+    return None
+
+def _compression(filename):
+    '''
+    Internal - Returns how the file is compressed (see _compression_magic), or None.
+    '''
+    with open(filename, 'rb') as f:
+        return _compression_of(f.read(6))
+
+def _no_decompressor(compression, name):
+    '''
+    Internal - Returns the error for compressed data we don't have the module to read.
+    '''
+    return IOError("Can't read %s-compressed file %s without the %s module" %
+                   (compression, name, {'xz': 'lzma', 'zstd': 'zstandard'}[compression]))
+
+def _open_decompressed(filename):
+    '''
+    Internal - Returns a binary file object for the decompressed contents of the file.
+    '''
+    compression = _compression(filename)
+    if compression == None:
+        return open(filename, 'rb')
+    if compression == 'gzip':
+        return gzip.GzipFile(filename, 'rb')
+    if compression == 'bzip2':
+        return bz2.BZ2File(filename, 'rb')
+    if (compression == 'xz') and (lzma != None):
+        return lzma.LZMAFile(filename, 'rb')
+    if (compression == 'zstd') and (zstandard != None):
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'),
+                                                          closefd=True)
+    raise _no_decompressor(compression, filename)
+
+def _decompressed_member(f, name):
+    '''
+    Internal - Returns a binary file object for the decompressed contents of f,
+    a file in a tar archive, which may itself be compressed.
+    The whole of f is read, because tar archives are read as a stream.
+    '''
+    data = f.read()
+    compression = _compression_of(data[:6])
+    if compression == None:
+        return io.BytesIO(data)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb')
+    if compression == 'bzip2':
+        return io.BytesIO(bz2.decompress(data))
+    if (compression == 'xz') and (lzma != None):
+        return io.BytesIO(lzma.decompress(data))
+    if (compression == 'zstd') and (zstandard != None):
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    raise _no_decompressor(compression, name)
+
+def open_map_file(filename, binary=False):
+    '''
+    Opens a sector map file for reading, like open() but decompressing it
+    as it's read if it's gzip, bzip2, xz or zstd compressed.
+    '''
+    if (not binary) and (_compression(filename) == None):
+        return open(filename)
+    f = _open_decompressed(filename)
+    if binary:
+        return f
+    return io.TextIOWrapper(f)
+
+def _is_tar(filename):
+    '''
+    Internal - Is the file, once decompressed, a tar archive (going by its name) ?
+    '''
+    name = filename.lower()
+    for suffix in ['.gz', '.bz2', '.xz', '.zst']:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name.endswith('.tar') or name.endswith('.tgz') or name.endswith('.tbz2')
+
+def iter_map_files(paths):
+    '''
+    Generator of (name, binary file object) for each map in the list of paths.
+    Each path can be a (possibly compressed) map file, a (possibly compressed)
+    tar archive of (possibly compressed) maps, a directory of those, or a glob pattern.
+    Nothing is extracted to disk, and tar archives are read as a stream,
+    so each file must be read before moving on to the next one.
+    '''
+    for path in paths:
+        if os.path.isdir(path):
+            names = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+            for name, f in iter_map_files([n for n in names if os.path.isfile(n)]):
+                yield (name, f)
+        elif (not os.path.exists(path)) and glob.has_magic(path):
+            for name, f in iter_map_files(sorted(glob.glob(path))):
+                yield (name, f)
+        elif _is_tar(path):
+            with _open_decompressed(path) as stream:
+                archive = tarfile.open(fileobj=stream, mode='r|')
+                for member in archive:
+                    if member.isfile():
+                        name = '%s:%s' % (path, member.name)
+                        yield (name, _decompressed_member(archive.extractfile(member), name))
+                archive.close()
+        else:
+            with _open_decompressed(path) as f:
+                yield (path, f)
+
+'''
+What ValidationFinding.message() says for each kind of finding
+(other than the "<things> total", "too many <things>" and "too few <things>" ones)
+'''
+_finding_messages = {
+    'sectors': 'Known plus unknown plus forgotten sectors is %(found)d, not %(expected)d',
+    'missing links absent': "Didn't find expected missing links from sector %(sector)d",
+    'unexpected missing links': "Didn't expect to find missing links in sector %(sector)d",
+    'planet missing': 'Planet %(expected)s is missing from sector %(sector)d',
+    'unexpected planet': "Didn't expect to find planet %(found)s in sector %(sector)d",
+    'black hole missing': 'Black hole is missing from sector %(sector)d',
+    'unexpected black hole': "Didn't expect to find black hole in sector %(sector)d",
+    'npc store missing': 'NPC store %(expected)s is missing from sector %(sector)d',
+    'unexpected npc store': "Didn't expect to find NPC store %(found)s in sector %(sector)d",
+    'ipt to unknown planet': 'IPT in sector %(sector)d goes to unknown planet %(expected)s',
+}
+
+class ValidationFinding(collections.namedtuple('ValidationFinding',
+                                               ['severity',
+                                                'kind',
+                                                'sector',
+                                                'expected',
+                                                'found'])):
+    '''
+    One problem found by SectorMapParser.validate().
+    severity is 'error' (the map isn't valid) or 'warning' (the code may need updating).
+    sector is None for problems that aren't with one particular sector.
+    '''
+    __slots__ = ()
+
+    def message(self):
+        '''
+        Describe the problem
+        '''
+        if self.kind.endswith(' total'):
+            return 'Expected %d %s, found %d' % (self.expected,
+                                                 self.kind[:-len(' total')],
+                                                 self.found)
+        if self.kind.startswith('too many '):
+            return 'code expects fewer %s' % self.kind[len('too many '):]
+        if self.kind.startswith('too few '):
+            return 'code expects more %s' % self.kind[len('too few '):]
+        return _finding_messages[self.kind] % self._asdict()
+
+    def warning(self):
+        '''
+        The line SectorMapParser.valid() prints for the problem,
+        keeping the text that each kind has always been printed with
+        '''
+        if self.kind.startswith('too ') or (self.kind == 'ipt to unknown planet'):
+            return 'WARNING: %s' % self.message()
+        return 'WARNING %s' % self.message()
+
+def _parse_sector_popups(args):
+    '''
+    Internal - Parses a chunk of sector popups in a worker process.
+    args is a tuple of (fields, map datetime, list of (sector, popup) tuples).
+    Returns the SectorMapParser.popup_info() for just those sectors.
+    '''
+    (fields, map_datetime, popups) = args
+    p = SectorMapParser.__new__(SectorMapParser)
+    p.fields = fields
+    p.datetime = map_datetime
+    p.the_rules = None
+    p.reset_popup_info()
+    for sector, popup in popups:
+        p.parse_sector_popup(popup, sector)
+    return p.popup_info()
+
+class MapValues():
+    '''
+    Table of the values (ore, planet and society names, lists of links, ...)
+    in compact()ed maps. The maps store the index of each value in the table
+    rather than the value itself, so values repeated within or between maps
+    are only stored once. Create one for each set of maps that are kept together,
+    and it goes when they do.
+    '''
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        '''
+        Returns the index of value (which must be hashable) in the table,
+        adding it if necessary.
+        '''
+        if value not in self.codes:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.codes[value]
+
+    def value(self, code):
+        '''
+        Returns the value with index code.
+        '''
+        return self.values[code]
+
+    def shared(self, value):
+        '''
+        Returns the table's copy of value.
+        '''
+        return self.values[self.code(value)]
+
+def _shared_sector(sector):
+    '''
+    Internal - Returns the copy of sector in all_sectors, so that compact()ed maps share it.
+    '''
+    if 1 <= sector <= len(all_sectors):
+        return all_sectors[sector - 1]
+    return sector
+
+def _encode_field(value, typecode, values):
+    '''
+    Internal - Returns what to store in an array for one field of a compact()ed item.
+    Typecode 'v' means the value is stored as its code in values,
+    and 'V' means the same for a list (stored as a tuple).
+    '''
+    if typecode == 'v':
+        return values.code(value)
+    if typecode == 'V':
+        return values.code(tuple(value))
+    return value
+
+def _decode_field(stored, typecode, values):
+    '''
+    Internal - Reverses _encode_field().
+    '''
+    if typecode == 'v':
+        return values.value(stored)
+    if typecode == 'V':
+        return list(values.value(stored))
+    return stored
+
+def _array_typecode(typecode):
+    '''
+    Internal - Returns the array typecode used to store fields with typecode.
+    '''
+    if typecode in 'vV':
+        return 'I'
+    return typecode
+
+class CompactList(collections_abc.MutableSequence):
+    '''
+    List of sectors, tuples or records, as used by compact()ed maps.
+    Each field of the items is stored in its own array, with the typecode given
+    for it in typecodes (see _encode_field() for the extra 'v' and 'V' typecodes,
+    which need values to be a MapValues).
+    Items are tuples if there's more than one field, unless record is given,
+    in which case they're made by calling record with the fields, and
+    the fields are read back from the record's __slots__.
+    Items read back are equal to the ones added, and the list can be used
+    wherever the parser's lists are, except that sort() isn't supported.
+    '''
+    __slots__ = ('columns', 'typecodes', 'values', 'record')
+
+    def __init__(self, items=(), typecodes='H', values=None, record=None):
+        self.columns = [array.array(_array_typecode(typecode)) for typecode in typecodes]
+        self.typecodes = typecodes
+        self.values = values
+        self.record = record
+        self.extend(items)
+
+    def _encode(self, item):
+        '''
+        Internal - Returns the list of values to store for item.
+        '''
+        if self.record != None:
+            item = [getattr(item, name) for name in self.record.__slots__]
+        elif len(self.columns) == 1:
+            item = (item,)
+        return [_encode_field(value, typecode, self.values)
+                for value, typecode in zip(item, self.typecodes)]
+
+    def _decode(self, stored):
+        '''
+        Internal - Returns the item for the tuple of stored values.
+        '''
+        item = tuple([_decode_field(value, typecode, self.values)
+                      for value, typecode in zip(stored, self.typecodes)])
+        if self.record != None:
+            return self.record(*item)
+        if len(self.columns) == 1:
+            return item[0]
+        return item
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __iter__(self):
+        for stored in zip(*self.columns):
+            yield self._decode(stored)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._decode(tuple([column[index] for column in self.columns]))
+
+    def __setitem__(self, index, item):
+        if isinstance(index, slice):
+            items = list(self)
+            items[index] = item
+            del self[:]
+            self.extend(items)
+            return
+        for column, value in zip(self.columns, self._encode(item)):
+            column[index] = value
+
+    def __delitem__(self, index):
+        for column in self.columns:
+            del column[index]
+
+    def insert(self, index, item):
+        for column, value in zip(self.columns, self._encode(item)):
+            column.insert(index, value)
+
+    def append(self, item):
+        for column, value in zip(self.columns, self._encode(item)):
+            column.append(value)
+
+    def extend(self, items):
+        for item in list(items):
+            self.append(item)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, CompactList)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        if not isinstance(other, (list, CompactList)):
+            return NotImplemented
+        return list(self) != list(other)
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __copy__(self):
+        # The default copy would share the arrays with this list
+        return CompactList(self, self.typecodes, self.values, self.record)
+
+class CompactSectorDict(collections_abc.MutableMapping):
+    '''
+    Dict from sector to value, as used by compact()ed maps.
+    Values are stored as their codes in values (a MapValues), in one array
+    indexed by sector. typecode is 'v', or 'V' for values that are lists.
+    Sectors are iterated over in order.
+    '''
+    __slots__ = ('codes', 'typecode', 'values', 'count')
+
+    def __init__(self, items=None, typecode='v', values=None):
+        # Code of each sector's value plus one, or zero for sectors not in the dict
+        self.codes = array.array('I', [0]) * (len(all_sectors) + 1)
+        self.typecode = typecode
+        self.values = values
+        self.count = 0
+        if items:
+            self.update(items)
+
+    def _index(self, sector):
+        '''
+        Internal - Returns the index of sector in self.codes.
+        '''
+        if isinstance(sector, six.integer_types) and (1 <= sector <= len(all_sectors)):
+            return sector
+        raise KeyError(sector)
+
+    def __getitem__(self, sector):
+        code = self.codes[self._index(sector)]
+        if code == 0:
+            raise KeyError(sector)
+        return _decode_field(code - 1, self.typecode, self.values)
+
+    def __setitem__(self, sector, value):
+        i = self._index(sector)
+        if self.codes[i] == 0:
+            self.count += 1
+        self.codes[i] = _encode_field(value, self.typecode, self.values) + 1
+
+    def __delitem__(self, sector):
+        i = self._index(sector)
+        if self.codes[i] == 0:
+            raise KeyError(sector)
+        self.codes[i] = 0
+        self.count -= 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for sector, code in enumerate(self.codes):
+            if code != 0:
+                yield sector
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __copy__(self):
+        # The default copy would share the array with this dict
+        return CompactSectorDict(self, self.typecode, self.values)
+
 class SectorMapParser():
     '''
     Class to parse the sector map
     '''
-    def __init__(self, page):
+    # The attributes that parse_sector_popup() fills in
+    popup_attributes = ['ores_bought',
+                        'ores_sold',
+                        'missing_links',
+                        'drones',
+                        'your_drones',
+                        'planets',
+                        'asteroids',
+                        'black_holes',
+                        'npc_stores',
+                        'jellyfish',
+                        'trading_ports',
+                        'ipts',
+                        'luvsats',
+                        'known_sectors',
+                        'unknown_sectors',
+                        'last_density',
+                        'names',
+                        'notes',
+                        'warp_costs']
+
+    # The lists that compact() stores as CompactLists, with their typecodes
+    compact_typecodes = {'drones': 'vH',
+                         'your_drones': 'iH',
+                         'planets': 'vH',
+                         'asteroids': 'vH',
+                         'black_holes': 'H',
+                         'npc_stores': 'vH',
+                         'jellyfish': 'H',
+                         'ipts': 'vH',
+                         'luvsats': 'H',
+                         'unknown_sectors': 'H',
+                         'forgotten_sectors': 'H'}
+
+    def __init__(self, page, fields=None, processes=1, low_memory=False, values=None):
+        '''
+        fields is the set of things (from all_fields) to parse from the map,
+        with None meaning all of them. The attributes for the rest are left empty.
+        If processes is more than 1, the sector popups are parsed by that many
+        worker processes, giving the same results as parsing them all here.
+        If low_memory is True, the map is compact()ed once it has been parsed,
+        storing its strings and repeated values in values (a MapValues) if given.
+        '''
+        if fields == None:
+            fields = all_fields
+        unknown_fields = set(fields) - all_fields
+        if unknown_fields:
+            raise ValueError("Unknown field(s) %s" % ', '.join(sorted(unknown_fields)))
+        self.fields = frozenset(fields)
         self.soup = BeautifulSoup(page)
 
-        self.ores_bought = {}
-        self.ores_sold = {}
-        self.missing_links = {}
-        self.drones = []
-        self.your_drones = []
-        self.planets = []
-        self.asteroids = []
-        self.black_holes = []
-        self.npc_stores = []
-        self.jellyfish = []
-        self.trading_ports = []
-        self.ipts = []
-        self.luvsats = []
-        self.known_sectors = 0
-        self.unknown_sectors = []
+        self.reset_popup_info()
         self.forgotten_sectors = []
         self.expected_totals = {}
         self.density = {}
-        self.last_density = {}
-        self.names = {}
-        self.notes = {}
-        self.warp_costs = {}
+        # Populated on-demand in self.game_rules()
+        self.the_rules = None
+
+        self.parse_soup(self.soup, processes)
+        if low_memory:
+            self.compact(values)
+
+        # This is fairly arbitrary - a balance between time taken and accuracy
+        self.max_distance = 15
+        # Maximum number of shortest_route() results to remember
+        self.route_cache_size = 10000
+        self.route_cache_hits = 0
+        self.route_cache_misses = 0
+        # Populated on-demand in self.shortest_route(), least recently used first
+        self.the_routes = collections.OrderedDict()
+        # The drones that everything derived from the map currently reflects
+        self.the_drones = list(self.drones)
+        # Populated on-demand in self.distances()
+        self.the_distances = None
+        # Populated on-demand in self.neighbours()
+        self.the_neighbours = None
+        # Populated on-demand in self.movement_masks()
+        self.the_movement_masks = None
+        # Populated on-demand in self.can_reach_planets()
+        self.the_planet_reach = {}
+        # Populated on-demand in self.blocked_masks()
+        self.the_blocked_masks = {}
+        # Populated on-demand in self.enemy_drones()
+        self.the_enemy_drones = {}
+        # Populated on-demand in self.components()
+        self.the_components = {}
+        # Populated on-demand in self.reverse_neighbours()
+        self.the_reverse_neighbours = None
+        # Limits for each of the RouteRows - see RouteRows
+        self.max_route_rows = 100
+        self.full_route_rows_threshold = 300
+        # Beyond this many changes to self.drones, work everything out again
+        # rather than updating what's already known
+        self.max_drone_changes = 50
+        # Populated on-demand in self.route_rows()
+        self.the_route_rows = {}
+        # Populated on-demand in self.warp_graph()
+        self.the_warp_graph = None
+
+    def forget_routes(self, links_changed=False):
+        '''
+        Discard everything derived from the map that routing uses,
+        because the planets, drones or (if links_changed) missing links have changed.
+        Called automatically by enhance_map() and when self.drones changes.
+        '''
+        if links_changed:
+            self.the_distances = None
+            self.the_neighbours = None
+            self.the_reverse_neighbours = None
+            self.the_movement_masks = None
+        self.the_planet_reach = {}
+        self.the_blocked_masks = {}
+        self.the_enemy_drones = {}
+        self.the_components = {}
+        self.the_route_rows = {}
+        self.the_routes.clear()
+        self.the_drones = list(self.drones)
+
+    def check_drones(self):
+        '''
+        Internal - Updates or forgets any routes if self.drones has changed
+        since they were found.
+        '''
+        if self.drones != self.the_drones:
+            self.update_routes()
 
-        self.parse_soup(self.soup)
+    def update_routes(self):
+        '''
+        Bring everything derived from self.drones up to date, changing
+        just the parts affected by the drones that have come or gone
+        (or starting again if more than self.max_drone_changes have).
+        '''
+        changes = set(self.drones).symmetric_difference(self.the_drones)
+        if len(changes) > self.max_drone_changes:
+            self.forget_routes()
+            return
+        old_masks = self.the_blocked_masks
+        self.the_blocked_masks = {}
+        self.the_enemy_drones = {}
+        self.the_components = {}
+        self.the_routes.clear()
+        self.the_drones = list(self.drones)
+        for key in list(self.the_planet_reach.keys()):
+            ipts_too, policy = key
+            if policy not in old_masks:
+                del self.the_planet_reach[key]
+                continue
+            places = [s for n,s in self.planets]
+            if ipts_too:
+                places += [s for n,s in self.ipts]
+                neighbours = self.reverse_neighbours()
+                predecessors = self.neighbours()
+            else:
+                neighbours = self.neighbours()
+                predecessors = self.reverse_neighbours()
+            update_distances(self.the_planet_reach[key],
+                             places,
+                             old_masks[policy],
+                             self.blocked_mask(*policy),
+                             neighbours,
+                             predecessors,
+                             self.max_distance + 1)
+        for key, rows in six.iteritems(self.the_route_rows):
+            for_society, unexplored_sector_society, reverse = key
+            rows.update(self.enemy_drones(for_society, unexplored_sector_society),
+                        self.drone_sectors(for_society))
+
+    def adopt_routes(self, other):
+        '''
+        Take over the route tables that other, a SectorMapParser for an
+        earlier map from the same cycle, has worked out, updating them
+        for any drones that have changed since.
+        Returns False, taking nothing, if anything other than the drones differs.
+        '''
+        if ((self.can_move_diagonally() != other.can_move_diagonally()) or
+            (self.missing_links != other.missing_links) or
+            (sorted(self.planets) != sorted(other.planets)) or
+            (sorted(self.ipts) != sorted(other.ipts)) or
+            (self.unknown_sectors != other.unknown_sectors) or
+            (self.forgotten_sectors != other.forgotten_sectors) or
+            (self.max_distance != other.max_distance)):
+            return False
+        other.check_drones()
+        self.the_distances = other.the_distances
+        self.the_neighbours = other.the_neighbours
+        self.the_reverse_neighbours = other.the_reverse_neighbours
+        self.the_movement_masks = other.the_movement_masks
+        self.the_planet_reach = other.the_planet_reach
+        self.the_blocked_masks = other.the_blocked_masks
+        self.the_route_rows = other.the_route_rows
+        self.the_drones = list(other.the_drones)
+        other.forget_routes(True)
+        self.check_drones()
+        return True
 
-        # This is fairly arbitrary - a balance between time taken and accuracy
-        self.max_distance = 15
-        # Populated on-demand in self.distances()
-        self.the_distances = None
+    def _recall_route(self, key):
+        '''
+        Internal - Returns the remembered shortest_route() result for key, or None.
+        '''
+        try:
+            retval = self.the_routes.pop(key)
+        except KeyError:
+            self.route_cache_misses += 1
+            return None
+        self.route_cache_hits += 1
+        # Re-insert it as the most recently used
+        self.the_routes[key] = retval
+        return retval
+
+    def _remember_route(self, key, retval):
+        '''
+        Internal - Remembers a shortest_route() result, forgetting the least
+        recently used one if the cache is full.
+        '''
+        if len(self.the_routes) >= self.route_cache_size:
+            self.the_routes.popitem(last=False)
+        self.the_routes[key] = retval
+
+    def route_cache_info(self):
+        '''
+        Returns a tuple of (hits, misses, maximum size, current size)
+        for the shortest_route() cache.
+        '''
+        return (self.route_cache_hits,
+                self.route_cache_misses,
+                self.route_cache_size,
+                len(self.the_routes))
 
     def _add_warp_cost(self, start, end, fuel):
         '''
@@ -968,6 +2672,14 @@ class SectorMapParser():
         except KeyError:
             return None
 
+    def warp_graph(self):
+        '''
+        Return the warp_graph() of known IR warp fuel costs for this map.
+        '''
+        if not self.the_warp_graph:
+            self.the_warp_graph = warp_graph(self.warp_costs)
+        return self.the_warp_graph
+
     def distances(self):
         '''
         Return a list, indexed by distance (up to self.max_distance), of
@@ -981,6 +2693,81 @@ class SectorMapParser():
             self.the_distances = self.distances_array(self.max_distance)
         return self.the_distances
 
+    def neighbours(self):
+        '''
+        Return the passable_neighbours() table for this map.
+        A list, indexed by sector, of tuples of the sectors you can move to.
+        '''
+        if not self.the_neighbours:
+            self.the_neighbours = passable_neighbours(self.can_move_diagonally(),
+                                                      self.missing_links)
+        return self.the_neighbours
+
+    def reverse_neighbours(self):
+        '''
+        Return the reverse_neighbours() table for this map.
+        A list, indexed by sector, of tuples of the sectors you can move from.
+        '''
+        if not self.the_reverse_neighbours:
+            self.the_reverse_neighbours = reverse_neighbours(self.neighbours())
+        return self.the_reverse_neighbours
+
+    def movement_masks(self):
+        '''
+        Return the movement_masks() for this map, for use with the bitset functions.
+        '''
+        if not self.the_movement_masks:
+            self.the_movement_masks = movement_masks(self.can_move_diagonally(),
+                                                     self.missing_links,
+                                                     self.neighbours())
+        return self.the_movement_masks
+
+    def can_reach_planets(self,
+                          sector,
+                          ipts_too=False,
+                          for_society=None,
+                          unexplored_sector_society=None):
+        '''
+        Is sector within self.max_distance moves of any planet ?
+        If ipts_too is True, is there a planet or IPT within self.max_distance moves
+        of sector, going the other way ?
+        This is a quick check that nearest_planet() (or a route out of sector)
+        has a chance of finding something.
+        Distances for all the drone_policies() are found together.
+        '''
+        self.check_drones()
+        policy = (for_society, unexplored_sector_society)
+        if policy in self.drone_policies():
+            policies = self.drone_policies()
+        else:
+            policies = [policy]
+        key = (ipts_too, policy)
+        if key not in self.the_planet_reach:
+            places = [s for n,s in self.planets]
+            if ipts_too:
+                places += [s for n,s in self.ipts]
+                neighbours = self.reverse_neighbours()
+            else:
+                neighbours = self.neighbours()
+            masks = [self.blocked_mask(f, u) for f, u in policies]
+            distances = distances_by_policy(places,
+                                            masks,
+                                            self.can_move_diagonally(),
+                                            self.missing_links,
+                                            self.max_distance + 1,
+                                            neighbours)
+            for p, d in zip(policies, distances):
+                self.the_planet_reach[(ipts_too, p)] = d
+        return self.the_planet_reach[key][sector] <= self.max_distance
+
+    def game_rules(self):
+        '''
+        Returns the GameRules in force at the time of this map.
+        '''
+        if (self.the_rules == None) or (self.the_rules[0] != self.datetime):
+            self.the_rules = (self.datetime, game_rules(self.datetime))
+        return self.the_rules[1]
+
     def expected_planets(self):
         '''
         Which planets should be present in this map ?
@@ -992,37 +2779,37 @@ class SectorMapParser():
         '''
         How many asteroids should be present in this map ?
         '''
-        return expected_asteroids(self.datetime)
+        return self.game_rules().asteroids
 
     def expected_npc_stores(self):
         '''
         Which NPC stores should be present in this map ?
         '''
-        return expected_npc_stores(self.datetime)
+        return list(self.game_rules().npc_stores)
 
     def expected_missing_links(self):
         '''
         Which missing links should be present in this map ?
         '''
-        return expected_missing_links(self.datetime)
+        return self.game_rules().missing_links
 
     def can_move_diagonally(self):
         '''
         Are diagonal moves possible on this map ?
         '''
-        return can_move_diagonally(self.datetime)
+        return self.game_rules().can_move_diagonally
 
     def cycle(self):
         '''
         What cycle does this map belong to ?
         '''
-        return cycle(self.datetime)
+        return self.game_rules().cycle
 
     def war_ongoing(self):
         '''
         Was the war ongoing at the time of this map ?
         '''
-        return war_ongoing(self.datetime)
+        return self.game_rules().war_ongoing
 
     def parse_prices(self, text):
         """Parse a price list into a dict"""
@@ -1077,48 +2864,53 @@ class SectorMapParser():
             self.high = int(m.group(1))
 
     def parse_sector_popup(self, popup, num):
-        """Parse all the info about sector 'num' from 'popup'."""
+        """Parse the info in self.fields about sector 'num' from 'popup'."""
+        fields = self.fields
         ore_buys = []
         ore_sells = []
-        # Find any buy prices
-        m = BUYING_RE.search(popup)
-        if m:
-            prices = self.parse_prices(m.group(1))
-            for ore,cost in six.iteritems(prices):
+        if ('ores' in fields) or ('trading ports' in fields):
+            # Find any buy prices
+            m = BUYING_RE.search(popup)
+            if m:
+                ore_buys = list(six.iteritems(self.parse_prices(m.group(1))))
+            # And any sell prices
+            m = SELLING_RE.search(popup)
+            if m:
+                ore_sells = list(six.iteritems(self.parse_prices(m.group(1))))
+        if 'ores' in fields:
+            for ore,cost in ore_buys:
                 if not ore in self.ores_bought:
                     self.ores_bought[ore] = []
                 self.ores_bought[ore].append((cost, num))
-                ore_buys.append((ore, cost))
-        # And any sell prices
-        m = SELLING_RE.search(popup)
-        if m:
-            prices = self.parse_prices(m.group(1))
-            for ore,cost in six.iteritems(prices):
+            for ore,cost in ore_sells:
                 if not ore in self.ores_sold:
                     self.ores_sold[ore] = []
                 self.ores_sold[ore].append((cost, num))
-                ore_sells.append((ore, cost))
         # Is there a warp fuel cost ?
-        m = WARP_RE.search(popup)
-        if m:
-            start = int(m.group(1))
-            end = int(m.group(2))
-            fuel = int(m.group(3))
-            self._add_warp_cost(start, end, fuel)
-            # TODO If warp costs are always the same both ways, populate both here
+        if 'warps' in fields:
+            m = WARP_RE.search(popup)
+            if m:
+                start = int(m.group(1))
+                end = int(m.group(2))
+                fuel = int(m.group(3))
+                self._add_warp_cost(start, end, fuel)
+                # Only record the direction we've seen. If ssw_track_movement never
+                # reports any ssw_map_utils.asymmetric_warp_costs() across archived
+                # maps, it would be safe to populate both directions here
         # Are there jellyfish ?
-        if JELLYFISH_RE.search(popup):
+        if ('jellyfish' in fields) and JELLYFISH_RE.search(popup):
             self.jellyfish.append(num)
         # Is there a Luvsat ?
-        if LUVSAT_RE.search(popup):
+        if ('luvsats' in fields) and LUVSAT_RE.search(popup):
             self.luvsats.append(num)
         # A black hole ?
-        if BLACKHOLE_RE.search(popup):
+        if ('black holes' in fields) and BLACKHOLE_RE.search(popup):
             self.black_holes.append(num)
         # A planet ?
-        m = PLANET_RE.search(popup)
-        if m:
-            self.planets.append((m.group(1), num))
+        if 'planets' in fields:
+            m = PLANET_RE.search(popup)
+            if m:
+                self.planets.append((m.group(1), num))
         # What's the last recorded density ?
         # Note that things may have moved around since this was recorded
         m = LAST_DENSITY_RE.search(popup)
@@ -1128,61 +2920,170 @@ class SectorMapParser():
         else:
             self.unknown_sectors.append(num)
         # What links are there ?
-        m = LINKS_RE.search(popup)
-        if m:
-            links = self.parse_links(m.group(1))
-            for s in adjacent_sectors(num, self.can_move_diagonally()):
-                if s not in links:
-                    if not num in self.missing_links:
-                        self.missing_links[num] = []
-                    self.missing_links[num].append(s)
-        # Trading port alignment ?
-        m = PORT_ALIGNMENT_RE.search(popup)
-        if m:
-            port_alignment = m.group(1)
-        m = PORT_GE_OC_RE.search(popup)
-        if m:
-            good = int(m.group(1))
-            order = int(m.group(2))
+        if 'links' in fields:
+            m = LINKS_RE.search(popup)
+            if m:
+                links = self.parse_links(m.group(1))
+                for s in adjacent_sectors(num, self.can_move_diagonally()):
+                    if s not in links:
+                        if not num in self.missing_links:
+                            self.missing_links[num] = []
+                        self.missing_links[num].append(s)
+        if 'trading ports' in fields:
+            # Trading port alignment ?
+            m = PORT_ALIGNMENT_RE.search(popup)
+            if m:
+                port_alignment = m.group(1)
+            m = PORT_GE_OC_RE.search(popup)
+            if m:
+                good = int(m.group(1))
+                order = int(m.group(2))
         # Any NPC stores ?
-        m = NPC_STORE_RE.search(popup)
-        if m:
-            self.npc_stores.append((m.group(1), num))
+        if 'npc stores' in fields:
+            m = NPC_STORE_RE.search(popup)
+            if m:
+                self.npc_stores.append((m.group(1), num))
         # Any IPTs ?
-        m = IPT_RE.search(popup)
-        if m:
-            self.ipts.append((m.group(1), num))
+        if 'ipts' in fields:
+            m = IPT_RE.search(popup)
+            if m:
+                self.ipts.append((m.group(1), num))
         # Any asteroids ?
-        m = ASTEROID_RE.search(popup)
-        if m:
-            self.asteroids.append((m.group(1), num))
+        if 'asteroids' in fields:
+            m = ASTEROID_RE.search(popup)
+            if m:
+                self.asteroids.append((m.group(1), num))
         # Any drones ?
-        m = DRONES_RE.search(popup)
-        if m:
-            self.drones.append((m.group(1), num))
-        m = YOUR_DRONES_RE.search(popup)
-        if m:
-            self.your_drones.append((int(m.group(1)), num))
+        if 'drones' in fields:
+            m = DRONES_RE.search(popup)
+            if m:
+                self.drones.append((m.group(1), num))
+            m = YOUR_DRONES_RE.search(popup)
+            if m:
+                self.your_drones.append((int(m.group(1)), num))
         # A trading port ?
         # Relies on having already parsed port prices, alignment, etc
-        m = TRADING_PORT_RE.search(popup)
-        if m:
-            port_name = m.group(1)
-            port = TradingPort(port_name,
-                               num,
-                               good,
-                               order,
-                               ore_buys,
-                               ore_sells)
-            # port_alignment should be what we derive from GE/OC
-            assert port_alignment == ssw_societies.full_name(port.society_initial()), "port_alignment = %s, not %s" % (port_alignment, ssw_societies.full_name(port.society_initial()))
-            self.trading_ports.append(port)
-        m = NAME_RE.search(popup)
-        if m:
-            self.names[num] = m.group(1)
-        m = NOTES_RE.search(popup)
-        if m:
-            self.notes[num] = m.group(1)
+        if 'trading ports' in fields:
+            m = TRADING_PORT_RE.search(popup)
+            if m:
+                port_name = m.group(1)
+                port = TradingPort(port_name,
+                                   num,
+                                   good,
+                                   order,
+                                   ore_buys,
+                                   ore_sells)
+                # port_alignment should be what we derive from GE/OC
+                assert port_alignment == ssw_societies.full_name(port.society_initial()), "port_alignment = %s, not %s" % (port_alignment, ssw_societies.full_name(port.society_initial()))
+                self.trading_ports.append(port)
+        if 'names' in fields:
+            m = NAME_RE.search(popup)
+            if m:
+                self.names[num] = m.group(1)
+        if 'notes' in fields:
+            m = NOTES_RE.search(popup)
+            if m:
+                self.notes[num] = m.group(1)
+
+    def compact(self, values=None):
+        '''
+        Reduces the memory used by the parsed map, for when lots of maps are kept.
+        Drops the soup, and replaces the parsed info with CompactLists and
+        CompactSectorDicts. Strings and other repeated values are stored as
+        their codes in values, a MapValues that should be shared by all the maps
+        kept together. By default the map gets its own.
+        '''
+        if values == None:
+            values = MapValues()
+        self.soup = None
+        for attr, typecodes in six.iteritems(self.compact_typecodes):
+            setattr(self, attr, CompactList(getattr(self, attr), typecodes, values))
+        self.trading_ports = CompactList(self.trading_ports, 'vHiiVV', values, TradingPort)
+        for attr, typecode in [('missing_links', 'V'),
+                               ('last_density', 'v'),
+                               ('names', 'v'),
+                               ('notes', 'v')]:
+            setattr(self, attr, CompactSectorDict(getattr(self, attr), typecode, values))
+        self.ores_bought = dict([(values.shared(ore), CompactList(prices, 'iH'))
+                                 for ore, prices in six.iteritems(self.ores_bought)])
+        self.ores_sold = dict([(values.shared(ore), CompactList(prices, 'iH'))
+                               for ore, prices in six.iteritems(self.ores_sold)])
+        self.warp_costs = dict([(_shared_sector(start),
+                                 dict([(_shared_sector(end), fuel)
+                                       for end, fuel in six.iteritems(costs)]))
+                                for start, costs in six.iteritems(self.warp_costs)])
+        self.expected_totals = dict([(values.shared(item), total)
+                                     for item, total in six.iteritems(self.expected_totals)])
+        self.density = dict([(values.shared(item), density)
+                             for item, density in six.iteritems(self.density)])
+
+    def reset_popup_info(self):
+        '''
+        Internal - Empties all the popup_attributes.
+        '''
+        self.ores_bought = {}
+        self.ores_sold = {}
+        self.missing_links = {}
+        self.drones = []
+        self.your_drones = []
+        self.planets = []
+        self.asteroids = []
+        self.black_holes = []
+        self.npc_stores = []
+        self.jellyfish = []
+        self.trading_ports = []
+        self.ipts = []
+        self.luvsats = []
+        self.known_sectors = 0
+        self.unknown_sectors = []
+        self.last_density = {}
+        self.names = {}
+        self.notes = {}
+        self.warp_costs = {}
+
+    def popup_info(self):
+        '''
+        Internal - Returns a dict of the popup_attributes.
+        '''
+        return dict([(name, getattr(self, name)) for name in self.popup_attributes])
+
+    def merge_popup_info(self, info):
+        '''
+        Internal - Adds in the popup_info() from parsing later sectors,
+        leaving everything as if they had been parsed here.
+        '''
+        for name in self.popup_attributes:
+            value = info[name]
+            mine = getattr(self, name)
+            if name == 'known_sectors':
+                self.known_sectors += value
+            elif isinstance(value, list):
+                mine.extend(value)
+            elif name in ['ores_bought', 'ores_sold']:
+                for ore, prices in six.iteritems(value):
+                    mine.setdefault(ore, []).extend(prices)
+            elif name == 'warp_costs':
+                for start, costs in six.iteritems(value):
+                    mine.setdefault(start, {}).update(costs)
+            else:
+                mine.update(value)
+
+    def parse_sector_popups(self, popups, processes):
+        '''
+        Internal - Parses a list of (sector, popup) tuples with a pool of processes,
+        each taking a chunk of consecutive sectors, and merges the results in order.
+        '''
+        size = (len(popups) + processes - 1) // processes
+        chunks = [(self.fields, self.datetime, popups[i:i + size])
+                  for i in range(0, len(popups), size)]
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_parse_sector_popups, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        for info in results:
+            self.merge_popup_info(info)
 
     def ipt_in_sector(self, sector):
         '''
@@ -1282,7 +3183,7 @@ class SectorMapParser():
         # TODO Add in drones, if any
         return density
 
-    def parse_soup(self, soup):
+    def parse_soup(self, soup, processes=1):
         '''
         Internal - parse the soup created from the map file
         '''
@@ -1311,6 +3212,7 @@ class SectorMapParser():
             self.density[item] = density
 
         # Iterate through each sector
+        sectors = []
         for td in soup.body.find_all('td', width='4%'):
             # Find the sector number
             link = td.find('a')
@@ -1318,14 +3220,23 @@ class SectorMapParser():
             # Find the popup text
             div = td.find('div')
             popup = div.attrs['onmouseover']
+            if processes > 1:
+                # Parse them all together, later
+                sectors.append((sector, popup, link.attrs['style']))
+                continue
             # Parse the popup and store the result
             self.parse_sector_popup(popup, sector)
             # Parse the sector colour
             self.extract_explored(link.attrs['style'], sector)
+        if sectors:
+            self.parse_sector_popups([(sector, popup) for sector, popup, style in sectors],
+                                     processes)
+            for sector, popup, style in sectors:
+                self.extract_explored(style, sector)
 
         # Find the teleporter dropdown
         for form in soup.body.find_all('form'):
-            if form.attrs['name'] == 'telform':
+            if ('planets' in self.fields) and (form.attrs['name'] == 'telform'):
                 teleporter = form
                 for option in teleporter.find_all('option'):
                     m = TELEPORTER_RE.search(option.string)
@@ -1344,6 +3255,7 @@ class SectorMapParser():
         if len(self.planets) < len(expected_planets):
             unknown_planets = [planet for planet in expected_planets if planet not in self.planets]
             self.planets += unknown_planets
+            self.forget_routes()
             print("Added %d planet(s) - %s" % (len(unknown_planets),
                                                str(unknown_planets)))
             for name, sector in unknown_planets:
@@ -1392,7 +3304,7 @@ class SectorMapParser():
                 if (port.sector not in self.unknown_sectors) and (port.sector not in self.forgotten_sectors):
                     print("*** Added trading port %s to known sector %d. Out-of-date trading port list ?" % (port.name, port.sector))
 
-    def enhance_map(self):
+    def enhance_map(self, fields=None):
         '''
         Adds known info to a partially-populated map.
         Can include black holes, NPC stores and planets, because they all stay put (more-or-less).
@@ -1400,40 +3312,50 @@ class SectorMapParser():
         IPTs, jellyfish and luvsats move daily, so nothing is added regarding those.
         If the map is for today, it also retrieves the lists of planets, NPC stores, asteroids,
         and trading ports from the databuddy and enhances the map with those, too.
+        Only the things in fields (default self.fields) are added.
         '''
-        self.enhance_map_with_planets(self.expected_planets())
+        if fields == None:
+            fields = self.fields
+        if 'planets' in fields:
+            self.enhance_map_with_planets(self.expected_planets())
 
-        if len(self.black_holes) < len(expected_black_holes):
+        if ('black holes' in fields) and (len(self.black_holes) < len(expected_black_holes)):
             unknown_black_holes = [black_hole for black_hole in expected_black_holes if black_hole not in self.black_holes]
             self.black_holes += unknown_black_holes
             print("Added %d black hole(s)" % len(unknown_black_holes))
 
         self.enhance_map_with_npc_stores(self.expected_npc_stores())
 
-        if len(self.missing_links) < len(self.expected_missing_links()):
+        if ('links' in fields) and (len(self.missing_links) < len(self.expected_missing_links())):
             unknown_missing_links = [(sector,links) for sector,links in six.iteritems(self.expected_missing_links()) if sector not in self.missing_links]
             for sector, links in unknown_missing_links:
                 self.missing_links[sector] = links
             print("Added %d missing link(s)" % len(unknown_missing_links))
+            # Anything derived from the missing links is now out-of-date
+            self.forget_routes(True)
 
         # If it's today's map, we can also pull info from the databuddy
         if (ssw_utils.now_in_ssw() - self.datetime) > datetime.timedelta(1):
             return
 
-        p = ssw_get_planets.get_planets()
-        self.enhance_map_with_planets(p)
+        if 'planets' in fields:
+            p = ssw_get_planets.get_planets()
+            self.enhance_map_with_planets(p)
 
-        s = ssw_get_stores.get_npc_stores()
-        self.enhance_map_with_npc_stores(s)
+        if 'npc stores' in fields:
+            s = ssw_get_stores.get_npc_stores()
+            self.enhance_map_with_npc_stores(s)
 
-        a = ssw_get_asteroids.get_asteroids()
-        self.enhance_map_with_asteroids(a)
+        if 'asteroids' in fields:
+            a = ssw_get_asteroids.get_asteroids()
+            self.enhance_map_with_asteroids(a)
 
         # TODO the prices here will reflect what you're currently wearing,
         # while those from the map will reflect what you were wearing at the time
         # it was captured. We should probably check for disparities and address them.
-        t = ssw_get_trading_ports.get_trading_ports()
-        self.enhance_map_with_trading_ports(t)
+        if 'trading ports' in fields:
+            t = ssw_get_trading_ports.get_trading_ports()
+            self.enhance_map_with_trading_ports(t)
 
     def valid(self, quiet=False):
         '''
@@ -1441,110 +3363,120 @@ class SectorMapParser():
         Returns a tuple of (boolean validity, error message).
         Setting quiet to True inhibits printing any problems found
         '''
-        # A Valid map should have the right number of sectors
-        if (self.known_sectors + len(self.unknown_sectors) + len(self.forgotten_sectors)) != len(all_sectors):
-            return False,'Known plus unknown plus forgotten sectors is %d, not %d' % (self.known_sectors + len(self.unknown_sectors) + len(self.forgotten_sectors), len(all_sectors))
-
-        # A Valid map should have the numbers of things that it says it has
-        for key,value in six.iteritems(self.expected_totals):
-            if key == 'planets':
-                if len(self.planets) != value:
-                    return False,'Expected %d planets, found %d' % (value,
-                                                                    len(self.planets))
-            elif key == 'asteroid':
-                if len(self.asteroids) != value:
-                    return False,'Expected %d asteroids, found %d' % (value,
-                                                                      len(self.asteroids))
-            elif key == 'black hole':
-                if len(self.black_holes) != value:
-                    return False,'Expected %d black holes, found %d' % (value,
-                                                                        len(self.black_holes))
-            elif key == 'npc store':
-                if len(self.npc_stores) != value:
-                    return False,'Expected %d npc stores, found %d' % (value,
-                                                                       len(self.npc_stores))
-            elif key == 'space jellyfish':
-                if len(self.jellyfish) != value:
-                    return False,'Expected %d jellyfish, found %d' % (value,
-                                                                      len(self.jellyfish))
-            elif key == 'trading port':
-                if len(self.trading_ports) != value:
-                    return False,'Expected %d trading ports, found %d' % (value,
-                                                                          len(self.trading_ports))
-            elif key == 'ipt beacon':
-                if len(self.ipts) != value:
-                    return False,'Expected %d IPT beacons, found %d' % (value,
-                                                                        len(self.ipt_beacons))
-            elif key == 'luvsat':
-                if len(self.luvsats) != value:
-                    return False,'Expected %d luvsats, found %d' % (value,
-                                                                    len(self.luvsats))
-
+        findings = self.validate()
+        for finding in findings:
+            if finding.severity == 'error':
+                return False,finding.message()
         if not quiet:
             # These are more tests of this code than tests of the map file itself,
             # but this is the one place we know will be called once after parsing
-            for sector in set(self.expected_missing_links()) - set(self.missing_links):
-                if sector not in self.unknown_sectors + self.forgotten_sectors:
-                    print("WARNING Didn't find expected missing links from sector %d" % (sector))
-            for sector in set(self.missing_links) - set(self.expected_missing_links()):
-                print("WARNING Didn't expect to find missing links in sector %d" % (sector))
-            for planet, sector in set(self.expected_planets()) - set(self.planets):
-                if sector not in self.unknown_sectors + self.forgotten_sectors:
-                    print("WARNING Planet %s is missing from sector %d" % (planet, sector))
-            for planet, sector in set(self.planets) - set(self.expected_planets()):
-                if ((planet, sector) not in temporary_planets) and ((planet, None) not in temporary_planets):
-                    print("WARNING Didn't expect to find planet %s in sector %d" % (planet, sector))
-            if self.expected_asteroids() < len(self.asteroids):
-                print("WARNING: code expects fewer asteroids")
-            elif self.expected_asteroids() > len(self.asteroids) + len(self.unknown_sectors) + len(self.forgotten_sectors):
-                print("WARNING: code expects more asteroids")
-            for sector in set(expected_black_holes) - set(self.black_holes):
-                if sector not in self.unknown_sectors + self.forgotten_sectors:
-                    print("WARNING Black hole is missing from sector %d" % (sector))
-            for sector in set(self.black_holes) - set(expected_black_holes):
-                print("WARNING Didn't expect to find black hole in sector %d" % (sector))
-            for store, sector in set(self.expected_npc_stores()) - set(self.npc_stores):
-                if sector not in self.unknown_sectors + self.forgotten_sectors:
-                    print("WARNING NPC store %s is missing from sector %d" % (store, sector))
-            for store, sector in set(self.npc_stores) - set(self.expected_npc_stores()):
-                print("WARNING Didn't expect to find NPC store %s in sector %d" % (store, sector))
-            if expected_jellyfish < len(self.jellyfish):
-                print("WARNING: code expects fewer jellyfish")
-            elif expected_jellyfish > len(self.jellyfish) + len(self.unknown_sectors) + len(self.forgotten_sectors):
-                print("WARNING: code expects more jellyfish")
-            if expected_trading_ports < len(self.trading_ports):
-                print("WARNING: code expects fewer trading ports")
-            elif expected_trading_ports > len(self.trading_ports) + len(self.unknown_sectors) + len(self.forgotten_sectors):
-                print("WARNING: code expects more trading ports")
-            if expected_ipts < len(self.ipts):
-                print("WARNING: code expects fewer IPT beacons")
-            elif expected_ipts > len(self.ipts) + len(self.unknown_sectors) + len(self.forgotten_sectors):
-                print("WARNING: code expects more IPT beacons")
-            if expected_luvsats < len(self.luvsats):
-                print("WARNING: code expects fewer luvsats")
-            elif expected_luvsats > len(self.luvsats) + len(self.unknown_sectors) + len(self.forgotten_sectors):
-                print("WARNING: code expects more luvsats")
-            for planet, sector in self.ipts:
-                if (planet, self.sector_of_planet(planet)) not in self.planets:
-                    print("WARNING: IPT in sector %d goes to unknown planet %s" % (sector, planet))
+            for finding in findings:
+                print(finding.warning())
 
         # If we get here, all is good
         return True,''
 
+    def validate(self, fields=None):
+        '''
+        Checks the map that was parsed against what we expect to find.
+        Only the things in fields (default self.fields) are checked.
+        Returns a list of ValidationFindings, errors first.
+        '''
+        if fields == None:
+            fields = self.fields
+        retval = []
+        unexplored = set(self.unknown_sectors).union(self.forgotten_sectors)
+
+        # A Valid map should have the right number of sectors
+        if (self.known_sectors + len(unexplored)) != len(all_sectors):
+            retval.append(ValidationFinding('error',
+                                            'sectors',
+                                            None,
+                                            len(all_sectors),
+                                            self.known_sectors + len(unexplored)))
+
+        # A Valid map should have the numbers of things that it says it has
+        things = {'planets': (self.planets, 'planets', 'planets'),
+                  'asteroid': (self.asteroids, 'asteroids', 'asteroids'),
+                  'black hole': (self.black_holes, 'black holes', 'black holes'),
+                  'npc store': (self.npc_stores, 'npc stores', 'npc stores'),
+                  'space jellyfish': (self.jellyfish, 'jellyfish', 'jellyfish'),
+                  'trading port': (self.trading_ports, 'trading ports', 'trading ports'),
+                  'ipt beacon': (self.ipts, 'IPT beacons', 'ipts'),
+                  'luvsat': (self.luvsats, 'luvsats', 'luvsats')}
+        for key,value in six.iteritems(self.expected_totals):
+            if key in things:
+                found, description, field = things[key]
+                if (field in fields) and (len(found) != value):
+                    retval.append(ValidationFinding('error',
+                                                    description + ' total',
+                                                    None,
+                                                    value,
+                                                    len(found)))
+
+        def warn(kind, sector=None, expected=None, found=None):
+            retval.append(ValidationFinding('warning', kind, sector, expected, found))
+
+        if 'links' in fields:
+            expected_links = self.expected_missing_links()
+            for sector in set(expected_links) - set(self.missing_links):
+                if sector not in unexplored:
+                    warn('missing links absent', sector, expected_links[sector])
+            for sector in set(self.missing_links) - set(expected_links):
+                warn('unexpected missing links', sector, None, self.missing_links[sector])
+        if 'planets' in fields:
+            planets = set(self.planets)
+            expected = set(self.expected_planets())
+            for planet, sector in expected - planets:
+                if sector not in unexplored:
+                    warn('planet missing', sector, planet)
+            temporary = set([name for name, sector in temporary_planets if sector == None])
+            temporary.update(temporary_planets)
+            for planet, sector in planets - expected:
+                if ((planet, sector) not in temporary) and (planet not in temporary):
+                    warn('unexpected planet', sector, None, planet)
+        if 'black holes' in fields:
+            black_holes = set(self.black_holes)
+            for sector in set(expected_black_holes) - black_holes:
+                if sector not in unexplored:
+                    warn('black hole missing', sector)
+            for sector in black_holes - set(expected_black_holes):
+                warn('unexpected black hole', sector)
+        if 'npc stores' in fields:
+            stores = set(self.npc_stores)
+            expected = set(self.expected_npc_stores())
+            for store, sector in expected - stores:
+                if sector not in unexplored:
+                    warn('npc store missing', sector, store)
+            for store, sector in stores - expected:
+                warn('unexpected npc store', sector, None, store)
+        # Counts of things that could be hiding in the unexplored sectors
+        for expected, found, description, field in [(self.expected_asteroids(), self.asteroids, 'asteroids', 'asteroids'),
+                                                    (expected_jellyfish, self.jellyfish, 'jellyfish', 'jellyfish'),
+                                                    (expected_trading_ports, self.trading_ports, 'trading ports', 'trading ports'),
+                                                    (expected_ipts, self.ipts, 'IPT beacons', 'ipts'),
+                                                    (expected_luvsats, self.luvsats, 'luvsats', 'luvsats')]:
+            if field not in fields:
+                continue
+            if expected < len(found):
+                warn('too many ' + description, None, expected, len(found))
+            elif expected > len(found) + len(unexplored):
+                warn('too few ' + description, None, expected, len(found))
+        if ('ipts' in fields) and ('planets' in fields):
+            planet_names = set([name for name, sector in self.planets])
+            for planet, sector in self.ipts:
+                if planet not in planet_names:
+                    warn('ipt to unknown planet', sector, planet)
+
+        return retval
+
     def extract_date(self, text):
         '''
         Internal - Extracts the date of the map
         '''
         #text = text.replace('\xa0', ' ')
-        text = text.replace('&nbsp;', ' ')
-        temp = text.find('UTC:')
-        assert temp > -1, text
-        words = text[temp:].split()
-        self.datetime = datetime.datetime(int(words[4].split('<')[0]),
-                                          int(months[words[2]]),
-                                          int(words[3][:-1]),
-                                          int(words[1][:-3]),
-                                          int(words[1][3:]))
+        assert text.find('UTC:') > -1, text
+        self.datetime = parse_map_datetime(text)
         #print "Map for " + str(self.datetime)
 
     def extract_explored(self, text, num):
@@ -1583,19 +3515,101 @@ class SectorMapParser():
         elif num != 0:
             assert 0, 'Unrecognised sector colour ' + colour + ' in sector ' + str(num)
 
+    def components(self, for_society=None, unexplored_sector_society=None):
+        '''
+        Returns a tuple of (connected_components() of the sectors without enemy drones,
+        set of labels of components with a planet,
+        set of labels of components with a planet or IPT).
+        '''
+        self.check_drones()
+        key = (for_society, unexplored_sector_society)
+        if key not in self.the_components:
+            labels = connected_components(self.neighbours(),
+                                          self.blocked_mask(for_society,
+                                                            unexplored_sector_society))
+            with_planets = set([labels[s] for n,s in self.planets]) - set([0])
+            with_exits = with_planets.union([labels[s] for n,s in self.ipts]) - set([0])
+            self.the_components[key] = (labels, with_planets, with_exits)
+        return self.the_components[key]
+
+    def route_possible(self,
+                       from_sector,
+                       to_sector,
+                       for_society=None,
+                       unexplored_sector_society=None,
+                       whole_route=True):
+        '''
+        Quick check, using the components(), for a route from from_sector to to_sector
+        (and, if whole_route is True, to from_sector from a planet and from
+        to_sector to a planet or IPT), either flying or via a planet or IPT.
+        False means that there's definitely no route, True that there may be.
+        '''
+        (labels, with_planets, with_exits) = self.components(for_society,
+                                                             unexplored_sector_society)
+        from_label = labels[from_sector]
+        to_label = labels[to_sector]
+        if (from_label == 0) or (to_label == 0):
+            return False
+        if whole_route and ((from_label not in with_planets) or (to_label not in with_exits)):
+            return False
+        return (from_label == to_label) or ((from_label in with_exits) and
+                                            (to_label in with_planets))
+
+    def drone_policies(self):
+        '''
+        Returns the list of (for_society, unexplored_sector_society) tuples
+        for the usual ways of avoiding drones - not at all, or for each society,
+        with and without assuming that unexplored sectors contain Amaranth drones.
+        '''
+        empire = ssw_societies.adjective('a')
+        return [(None, None)] + [(society, unexplored)
+                                 for society in ssw_societies.adjectives
+                                 for unexplored in [None, empire]]
+
+    def blocked_mask(self, for_society, unexplored_sector_society=None):
+        '''
+        Returns a bitset (see sectors_to_bits()) of the sectors with enemy drones
+        The masks for all the drone_policies() are worked out together
+        '''
+        self.check_drones()
+        policy = (for_society, unexplored_sector_society)
+        if policy not in self.the_blocked_masks:
+            by_society = {}
+            for society, sector in self.drones:
+                by_society[society] = by_society.get(society, 0) | (1 << sector)
+            unknown = sectors_to_bits(self.unknown_sectors)
+            policies = self.drone_policies()
+            if policy not in policies:
+                policies = [policy]
+            for f, u in policies:
+                mask = 0
+                if f != None:
+                    for society, bits in six.iteritems(by_society):
+                        if society != f:
+                            mask |= bits
+                    if (u != None) and (f != u):
+                        # All unexplored sectors count, too
+                        mask |= unknown
+                self.the_blocked_masks[(f, u)] = mask
+        return self.the_blocked_masks[policy]
+
     def enemy_drones(self, for_society, unexplored_sector_society=None):
         '''
         Return list of sectors with enemy drones
         for_society is a string : "Illuminati", "Oddfellowish", "Eastern Star", etc
         unexplored sectors will be assumed to belong to unexplored_sector_society
         '''
-        if for_society == None:
-            return []
-        retval = [sector for society,sector in self.drones if society != for_society]
-        if (unexplored_sector_society != None) and (society != unexplored_sector_society):
-            # Add all unexplored sectors to retval
-            retval += self.unknown_sectors
-        return retval
+        policy = (for_society, unexplored_sector_society)
+        mask = self.blocked_mask(for_society, unexplored_sector_society)
+        if policy not in self.the_enemy_drones:
+            self.the_enemy_drones[policy] = bits_to_sectors(mask)
+        return list(self.the_enemy_drones[policy])
+
+    def has_enemy_drones(self, sector, for_society, unexplored_sector_society=None):
+        '''
+        Is sector one of the enemy_drones() ?
+        '''
+        return (self.blocked_mask(for_society, unexplored_sector_society) >> sector) & 1 == 1
 
     def route_traverses_unexplored_sectors(self, route):
         '''
@@ -1607,34 +3621,138 @@ class SectorMapParser():
                 return True
         return False
 
+    def unexplored_sectors_en_route(self, route):
+        '''
+        Returns the list of unexplored or forgotten sectors on a route
+        '''
+        return [sector for sector in route if (sector in self.unknown_sectors) or (sector in self.forgotten_sectors)]
+
+    def drone_sectors(self, for_society=None):
+        '''
+        Return list of sectors with drones that don't belong to for_society
+        (i.e. all sectors with drones, if for_society is None)
+        '''
+        return [sector for society,sector in self.drones if society != for_society]
+
+    def safest_route(self,
+                     from_sector,
+                     to_sector,
+                     for_society=None,
+                     unexplored_sector_society=None,
+                     max_length=max_route_length,
+                     best=None):
+        '''
+        Find the safest of the shortest flying routes between two sectors
+        Avoids enemy drones if for_society is specified.
+        Otherwise, prefers routes with the fewest sectors with drones,
+        then with the fewest unexplored sectors.
+        best can be from_sector's row of route_rows(), if the caller already has it.
+        Returns an ordered list of intermediate sectors, or None if there's no route
+        '''
+        if best == None:
+            best = self.route_rows(for_society, unexplored_sector_society).row(from_sector)
+        if (to_sector not in best) or (best[to_sector][0] >= max_length):
+            return None
+        return route_to(best, to_sector)
+
+    def route_rows(self,
+                   for_society=None,
+                   unexplored_sector_society=None,
+                   reverse=False):
+        '''
+        Returns the RouteRows for the specified drone policy, which every
+        route search for this map goes through.
+        Routes go from the source sectors, or towards them if reverse is True.
+        '''
+        self.check_drones()
+        key = (for_society, unexplored_sector_society, reverse)
+        if key not in self.the_route_rows:
+            if reverse:
+                neighbours = self.reverse_neighbours()
+            else:
+                neighbours = self.neighbours()
+            self.the_route_rows[key] = RouteRows(self.can_move_diagonally(),
+                                                 self.missing_links,
+                                                 self.enemy_drones(for_society,
+                                                                   unexplored_sector_society),
+                                                 self.drone_sectors(for_society),
+                                                 self.unknown_sectors + self.forgotten_sectors,
+                                                 neighbours,
+                                                 reverse,
+                                                 self.max_route_rows,
+                                                 self.full_route_rows_threshold)
+        return self.the_route_rows[key]
+
+    def alternative_routes(self,
+                           from_sector,
+                           to_sector,
+                           k,
+                           for_society=None,
+                           unexplored_sector_society=None,
+                           max_length=max_route_length):
+        '''
+        Find up to k different routes flying from one sector to another, best first.
+        Returns a list of (distance, route, list of drones en route, possible drones)
+        tuples, where route is a list of sectors and "possible drones" is True if the
+        route traverses sectors where we don't know whether drones are present or not.
+        '''
+        retval = []
+        for route in k_shortest_routes(from_sector,
+                                       to_sector,
+                                       self.can_move_diagonally(),
+                                       self.missing_links,
+                                       self.enemy_drones(for_society,
+                                                         unexplored_sector_society),
+                                       self.drone_sectors(for_society),
+                                       self.unknown_sectors + self.forgotten_sectors,
+                                       max_length,
+                                       self.neighbours()):
+            retval.append((len(route),
+                           route,
+                           drones_en_route(route, self.drones),
+                           self.route_traverses_unexplored_sectors(route)))
+            if len(retval) >= k:
+                break
+        return retval
+
+    def pareto_routes(self,
+                      from_sector,
+                      to_sector,
+                      for_society=None,
+                      unexplored_sector_society=None,
+                      max_length=max_route_length):
+        '''
+        Find the routes from one sector to another that trade off moves against fuel,
+        using any IR warps whose fuel cost is known.
+        Returns a list of (moves, fuel, route) tuples - see pareto_routes().
+        '''
+        return pareto_routes(from_sector,
+                             to_sector,
+                             self.can_move_diagonally(),
+                             self.warp_graph(),
+                             self.missing_links,
+                             self.enemy_drones(for_society,
+                                               unexplored_sector_society),
+                             max_length,
+                             self.neighbours())
+
     def distances_array(self, max_distance):
         '''
         Return a dict, indexed by distance (up to max_distance) of dicts
-        indexed by sector of lists of sectors that are the specified distance
-        from the starting sector.
+        indexed by sector of sets of sectors that are within the specified
+        distance of the starting sector.
         '''
         retval = {}
-        # Note that we only include flying distances, not via IPT or planets
         for d in range(0, max_distance+1):
-            per_sector = {}
-            for s in all_sectors:
-                per_sector[s] = set()
-                if d == 0:
-                    per_sector[s].add(s)
-                elif d == 1:
-                    # For every sector we can get to in one less move, add all
-                    # the sectors we can get to in one move
-                    for s1 in retval[d-1][s]:
-                        for s2 in accessible_sectors(s1,
-                                                     self.can_move_diagonally(),
-                                                     self.missing_links,
-                                                     max=1):
-                            per_sector[s].add(s2)
-                else:
-                    # We can do that faster if we've already populated retval[1]
-                    for s1 in retval[d-1][s]:
-                        per_sector[s].update(retval[1][s1])
-            retval[d] = per_sector
+            retval[d] = {}
+        # Note that we only include flying distances, not via IPT or planets
+        masks = self.movement_masks()
+        for s in all_sectors:
+            bits = 1 << s
+            for d in range(0, max_distance+1):
+                if d > 0:
+                    bits = expand_bits(bits, masks)
+                retval[d][s] = set(bits_to_sectors(bits))
         return retval
 
     def nearest(self,
@@ -1650,33 +3768,84 @@ class SectorMapParser():
         whether drones are present or not.
         This is really just the code common to nearest_planet() and nearest_ipt()
         Check for it returning None for the sector to see whether it found one.
+        Where several are equally near, the one with the safest route is chosen.
         Note that we assume that direction doesn't matter
         '''
-        route = None
-        enemy_drones = self.enemy_drones(for_society, unexplored_sector_society)
-        for d in range(0, self.max_distance+1):
-            #print("nearest(%d) - checking distance %d" % (to_sector, d))
-            for name, sector in planets_or_ipts:
-                if sector in self.distances()[d][to_sector]:
-                    #print("nearest() checking %s in %d" % (name, sector))
-                    #print("nearest(%d) checking %s in sector %d at distance %d" % (to_sector, name, sector, d+1))
-                    drones = []
-                    # find drones en route
-                    # Unfortunately, we have to find the actual route
-                    # Sometimes the route is blocked by drones, so we have to keep looking
-                    # TODO Probably need to check all routes of that length
-                    route = a_route(sector,
-                                    to_sector,
-                                    self.can_move_diagonally(),
-                                    self.missing_links,
-                                    enemy_drones,
-                                    min_length = d)
-                    #print("nearest() checking route %s" % route)
-                    if route == None:
-                        continue
-                    drones = drones_en_route(route, self.drones)
-                    return (name, sector, d, drones, self.route_traverses_unexplored_sectors(route))
-        return ("", None, max_length, [], False)
+        best = self.nearest_table(planets_or_ipts, for_society, unexplored_sector_society)
+        if not self.near_enough(best, to_sector):
+            return ("", None, max_length, [], False)
+        (d, drone_count, unexplored_count, i, previous) = best[to_sector]
+        (name, sector) = planets_or_ipts[i]
+        route = route_to(best, to_sector)
+        return (name, sector, d, drones_en_route(route, self.drones), unexplored_count > 0)
+
+    def nearest_table(self,
+                      planets_or_ipts,
+                      for_society=None,
+                      unexplored_sector_society=None,
+                      reverse=False):
+        '''
+        Internal - Finds the nearest of planets_or_ipts to every sector at once,
+        for the specified drone policy.
+        Routes go from the planets or IPTs, or towards them if reverse is True.
+        Returns a RouteRow. Anything further than self.max_distance is
+        too far away to count.
+        '''
+        sectors = tuple([sector for name, sector in planets_or_ipts])
+        return self.route_rows(for_society, unexplored_sector_society, reverse).row(sectors)
+
+    def near_enough(self, best, sector):
+        '''
+        Internal - Is sector within self.max_distance in the nearest_table() best ?
+        '''
+        return (sector in best) and (best[sector][0] <= self.max_distance)
+
+    def route_into(self,
+                   to_sector,
+                   for_society=None,
+                   unexplored_sector_society=None):
+        '''
+        Internal - Finds the safest route from the nearest planet to to_sector.
+        Returns a tuple of (planet name, planet sector, route),
+        or (None, None, None) if there isn't one within self.max_distance.
+        '''
+        best = self.nearest_table(self.planets, for_society, unexplored_sector_society)
+        if not self.near_enough(best, to_sector):
+            return (None, None, None)
+        (name, sector) = self.planets[best[to_sector][3]]
+        return (name, sector, route_to(best, to_sector))
+
+    def route_out_of(self,
+                     from_sector,
+                     for_society=None,
+                     unexplored_sector_society=None):
+        '''
+        Internal - Finds the safest route from from_sector to the nearest planet or IPT.
+        Returns a tuple of (IPT dest or planet name, sector, route),
+        or (None, None, None) if there isn't one within self.max_distance.
+        '''
+        places = self.planets + self.ipts
+        best = self.nearest_table(places, for_society, unexplored_sector_society, True)
+        if not self.near_enough(best, from_sector):
+            return (None, None, None)
+        (name, sector) = places[best[from_sector][3]]
+        # The search went backwards, from the planets and IPTs,
+        # so the route needs to be turned around
+        route = route_to(best, from_sector)
+        if route:
+            route = [sector] + route[:-1]
+            route.reverse()
+        return (name, sector, route)
+
+    def route_cost(self, route, for_society=None):
+        '''
+        Internal - Returns a (moves, drone sectors, unexplored sectors) tuple
+        for a route, for comparing routes of the same length.
+        '''
+        drones = set(self.drone_sectors(for_society))
+        return (len(route),
+                len([s for s in route if s in drones]),
+                len(self.unexplored_sectors_en_route(route)))
 
     def nearest_planet(self,
                        to_sector,
@@ -1744,7 +3913,36 @@ class SectorMapParser():
         if ipt_dist < planet_dist:
             return (ipt_dest, ipt_sector, ipt_dist, ipt_drones, ipt_poss)
         else:
-            return (planet_name, planet_sector, planet_dist, planet_drones, ipt_drones)
+            return (planet_name, planet_sector, planet_dist, planet_drones, planet_poss)
+
+    def route_lower_bound(self,
+                          from_sector,
+                          to_sector,
+                          for_society=None,
+                          unexplored_sector_society=None):
+        '''
+        Returns a lower bound on the distance that shortest_route() will return
+        (which is sectors_per_row if there's no route), without looking for the
+        route between the two sectors.
+        '''
+        (start_name, start_sector, start_route) = self.route_into(from_sector,
+                                                                  for_society,
+                                                                  unexplored_sector_society)
+        (end_name, end_sector, end_route) = self.route_out_of(to_sector,
+                                                              for_society,
+                                                              unexplored_sector_society)
+        if (start_route == None) or (end_route == None):
+            return sectors_per_row
+        middle = direct_distance(from_sector, to_sector)
+        (via_name, via_sector, via_route) = self.route_out_of(from_sector,
+                                                              for_society,
+                                                              unexplored_sector_society)
+        (dest_name, dest_sector, dest_route) = self.route_into(to_sector,
+                                                               for_society,
+                                                               unexplored_sector_society)
+        if (via_route != None) and (dest_route != None):
+            middle = min(middle, len(via_route) + len(dest_route))
+        return min(sectors_per_row, len(start_route) + middle + len(end_route))
 
     def shortest_distance(self,
                           from_sector,
@@ -1760,75 +3958,69 @@ class SectorMapParser():
         whether drones are present or not.
         Distance will be None if there's no route between the two
         '''
-        enemy_drones = self.enemy_drones(for_society,
-                                         unexplored_sector_society)
-        # Short-circuiting at this point saves an awful lot of effort when there are lots of drones around
-        # Otherwise, we can get hung up trying to find a route between a planet or IPT and a drone-free sector
-        if (for_society != None):
-            if (from_sector in enemy_drones) or (to_sector in enemy_drones):
-                return (None, None, None)
-        # Could go via a planet
-        (dest_name, dest_sector, dest_dist, dest_drones, dest_poss) = self.nearest_planet(to_sector,
-                                                                                          max_length,
-                                                                                          for_society,
-                                                                                          unexplored_sector_society)
-        # If we can't get to the destination from a planet,
-        # there's no point looking for a route from the source to a planet or IPT
-        if (dest_sector == None):
-            (via_dest, via_sector, via_dist, via_drones, via_poss) = ('',
-                                                                      None,
-                                                                      sectors_per_row,
-                                                                      [],
-                                                                      False)
-        else:
-            (via_dest, via_sector, via_dist, via_drones, via_poss) = self.nearest_planet_or_ipt(from_sector,
-                                                                                                max_length,
-                                                                                                for_society,
-                                                                                                unexplored_sector_society)
-        # Flying distance can't be less than direct distance
-        if (via_dist + dest_dist) < direct_distance(from_sector, to_sector):
-            return (via_dist + dest_dist,
-                    (via_sector, dest_sector),
-                    via_drones + dest_drones,
-                    via_poss or dest_poss)
-        # or, could just fly between the two
-        fly_dist = None
-        fly_drones = []
-        fly_poss = False
-        for d in range(0, self.max_distance+1):
-            #print "shortest_distance(%d,%d) - checking distance %d" % (from_sector, to_sector, d)
-            if to_sector in self.distances()[d][from_sector]:
-                #print "shortest_distance() found it"
-                fly_dist = d
-                #print "shortest_distance(%d,%d) - fly_dist = %d" % (from_sector, to_sector, d)
-                if len(self.drones):
-                    # Unfortunately, we have to find the exact route to
-                    # figure out fly_drones
-                    # Sometimes a route is blocked by drones so we have to keep looking
-                    # TODO Probably need to check all routes of that length
-                    route = a_route(from_sector,
-                                    to_sector,
-                                    self.can_move_diagonally(),
-                                    self.missing_links,
-                                    enemy_drones,
-                                    min_length = d)
-                    if route == None:
-                        continue
-                    fly_drones = drones_en_route(route, self.drones)
-                    fly_poss = self.route_traverses_unexplored_sectors(route)
-                break
-        if (dest_sector == None) or (via_sector == None):
-            # There's no route between the two via a planet
-            # fly_dist is either None or the quickest route
-            return (fly_dist, None, fly_drones, fly_poss)
-        if (fly_dist == None) or ((via_dist + dest_dist) < fly_dist):
-            # Going via a planet is quickest (or the only possible way)
-            return (via_dist + dest_dist,
-                    (via_sector, dest_sector),
-                    via_drones + dest_drones,
-                    via_poss or dest_poss)
-        # Going direct is quickest
-        return (fly_dist, None, fly_drones, fly_poss)
+        (dist, via, route) = self.shortest_leg(from_sector,
+                                               to_sector,
+                                               for_society,
+                                               unexplored_sector_society,
+                                               max_length)
+        if dist == None:
+            return (None, None, [], False)
+        if via != None:
+            via = (via[1], via[3])
+        return (dist,
+                via,
+                drones_en_route(route, self.drones),
+                self.route_traverses_unexplored_sectors(route))
+
+    def shortest_leg(self,
+                     from_sector,
+                     to_sector,
+                     for_society=None,
+                     unexplored_sector_society=None,
+                     max_length=max_route_length,
+                     from_row=None):
+        '''
+        Internal - Finds the best way to get from one sector to another,
+        either by flying directly or by flying to a planet or IPT and
+        teleporting to the planet nearest to to_sector.
+        from_row can be from_sector's row of route_rows(), if the caller already has it.
+        Returns a tuple of (distance, via, route) where via is None or a tuple of
+        (IPT dest or planet name, sector, planet name, planet sector) and route is
+        the list of sectors flown through.
+        Distance will be None if there's no route between the two.
+        '''
+        if not self.route_possible(from_sector,
+                                   to_sector,
+                                   for_society,
+                                   unexplored_sector_society,
+                                   False):
+            return (None, None, None)
+        best = None
+        fly_route = self.safest_route(from_sector,
+                                      to_sector,
+                                      for_society,
+                                      unexplored_sector_society,
+                                      max_length,
+                                      from_row)
+        if fly_route != None:
+            best = (self.route_cost(fly_route, for_society), None, fly_route)
+        # Teleporting from a planet can take us to any planet, and an IPT
+        # takes us to a planet, so the best route through a planet or IPT
+        # is always to the nearest one, then from the planet nearest to_sector
+        (via_name, via_sector, via_route) = self.route_out_of(from_sector,
+                                                              for_society,
+                                                              unexplored_sector_society)
+        (dest_name, dest_sector, dest_route) = self.route_into(to_sector,
+                                                               for_society,
+                                                               unexplored_sector_society)
+        if (via_route != None) and (dest_route != None):
+            route = via_route + dest_route
+            cost = self.route_cost(route, for_society)
+            if (best == None) or (cost < best[0]):
+                best = (cost, (via_name, via_sector, dest_name, dest_sector), route)
+        if best == None:
+            return (None, None, None)
+        return (best[0][0], best[1], best[2])
 
     def shortest_route(self,
                        from_sector,
@@ -1838,9 +4030,95 @@ class SectorMapParser():
                        max_length=max_route_length):
         '''
         Returns a tuple with (distance, route description string, list of
-        drones en route) for the shortest route
+        drones en route, possible drones) for the shortest route
+        Where there are several routes of that length, the one through
+        the fewest drones, then the fewest unexplored sectors, is chosen.
         You can set to_sector == from_sector if you only have one sector of interest
+        The most recently used self.route_cache_size results are remembered.
         '''
+        self.check_drones()
+        key = (from_sector, to_sector, for_society, unexplored_sector_society, max_length)
+        retval = self._recall_route(key)
+        if retval == None:
+            retval = self.find_shortest_route(from_sector,
+                                              to_sector,
+                                              for_society,
+                                              unexplored_sector_society,
+                                              max_length)
+            self._remember_route(key, retval)
+        (dist, route_str, drones, poss) = retval
+        return (dist, route_str, list(drones), poss)
+
+    def shortest_routes_many(self,
+                             pairs,
+                             for_society=None,
+                             unexplored_sector_society=None,
+                             max_length=max_route_length):
+        '''
+        Finds the shortest_route() for each of a list of (from, to) sector pairs,
+        working through them by from sector, so that each from sector's row of
+        route_rows() is only looked up (and searched, if need be) once.
+        A from sector of None means "from anywhere", i.e. the same as the to sector.
+        Returns a list of shortest_route() results, in the same order as pairs.
+        '''
+        self.check_drones()
+        results = {}
+        # Group the queries we don't already know the answer to by source
+        by_source = {}
+        for from_sector, to_sector in pairs:
+            if from_sector == None:
+                from_sector = to_sector
+            key = (from_sector, to_sector, for_society, unexplored_sector_society, max_length)
+            if key in results:
+                continue
+            retval = self._recall_route(key)
+            if retval == None:
+                by_source.setdefault(from_sector, []).append(key)
+            results[key] = retval
+        rows = self.route_rows(for_society, unexplored_sector_society)
+        for from_sector, keys in six.iteritems(by_source):
+            # Hang on to the row, even if rows forgets it in the meantime
+            from_row = rows.row(from_sector)
+            for key in keys:
+                retval = self.find_shortest_route(from_sector,
+                                                  key[1],
+                                                  for_society,
+                                                  unexplored_sector_society,
+                                                  max_length,
+                                                  from_row)
+                self._remember_route(key, retval)
+                results[key] = retval
+        retval = []
+        for from_sector, to_sector in pairs:
+            if from_sector == None:
+                from_sector = to_sector
+            (dist, route_str, drones, poss) = results[(from_sector,
+                                                       to_sector,
+                                                       for_society,
+                                                       unexplored_sector_society,
+                                                       max_length)]
+            retval.append((dist, route_str, list(drones), poss))
+        return retval
+
+    def find_shortest_route(self,
+                            from_sector,
+                            to_sector,
+                            for_society=None,
+                            unexplored_sector_society=None,
+                            max_length=max_route_length,
+                            from_row=None):
+        '''
+        Internal - Does the work for shortest_route(), without the cache.
+        from_row can be from_sector's row of route_rows(), if the caller already has it.
+        '''
+        # Think of teleporting as a hub linked to and from every planet,
+        # with each IPT linked to the hub via its destination planet.
+        # Every route then starts at the hub and ends when it reaches a
+        # planet or IPT, and passes through from_sector and to_sector in between.
+        # So the shortest route splits into three legs -
+        # start (hub to from_sector), middle (from_sector to to_sector,
+        # possibly via the hub) and end (to_sector to a planet or IPT),
+        # each of which can be found independently
         if for_society == None:
             soc_str = ""
         else:
@@ -1852,51 +4130,51 @@ class SectorMapParser():
 
         # Short-circuiting at this point saves an awful lot of effort when there are lots of drones around
         # Otherwise, we can get hung up trying to find a route between a planet or IPT and a drone-free sector
+        if not self.route_possible(from_sector,
+                                   to_sector,
+                                   for_society,
+                                   unexplored_sector_society):
+            return (sectors_per_row, fail_str, [], False)
         if for_society != None:
-            enemy_drones = self.enemy_drones(for_society,
-                                             unexplored_sector_society)
-            if (from_sector in enemy_drones) or (to_sector in enemy_drones):
-                return (sectors_per_row, fail_str, [])
-
-        (start_planet, start_sector, start_dist, start_drones, start_poss) = self.nearest_planet(from_sector,
-                                                                                                 max_length,
-                                                                                                 for_society,
-                                                                                                 unexplored_sector_society)
-        # If we can't get to from_sector from a planet,
-        # there's no point looking for the rest of the route
-        if (start_sector == None):
-            (end_name, end_sector, end_dist, end_drones, end_poss) = ('', None, sectors_per_row, [], False)
-        else:
-            (end_name, end_sector, end_dist, end_drones, end_poss) = self.nearest_planet_or_ipt(to_sector,
-                                                                                                max_length,
-                                                                                                for_society,
-                                                                                                unexplored_sector_society)
-        # Similarly, if we can't get back from to_sector,
-        # there's no point looking for a route to to_sector
-        if (end_sector == None):
-           (dist, route, drones, poss) = (None, [], [], False)
-        else:
-           (dist, route, drones, poss) = self.shortest_distance(from_sector,
-                                                                to_sector,
-                                                                for_society,
-                                                                unexplored_sector_society,
-                                                                max_length)
+            # Nor is there any point if drones cut us off from every planet
+            if not (self.can_reach_planets(from_sector,
+                                           False,
+                                           for_society,
+                                           unexplored_sector_society) and
+                    self.can_reach_planets(to_sector,
+                                           True,
+                                           for_society,
+                                           unexplored_sector_society)):
+                return (sectors_per_row, fail_str, [], False)
+
+        (start_planet, start_sector, start_route) = self.route_into(from_sector,
+                                                                    for_society,
+                                                                    unexplored_sector_society)
+        (end_name, end_sector, end_route) = self.route_out_of(to_sector,
+                                                              for_society,
+                                                              unexplored_sector_society)
+        if (start_route == None) or (end_route == None):
+            return (sectors_per_row, fail_str, [], False)
+        (dist, via, route) = self.shortest_leg(from_sector,
+                                               to_sector,
+                                               for_society,
+                                               unexplored_sector_society,
+                                               max_length,
+                                               from_row)
         if dist == None:
             return (sectors_per_row, fail_str, [], False)
-        if start_sector == None:
-            return (sectors_per_row, "No route to %d%s" % (to_sector, soc_str), [], False)
-        if end_sector == None:
-            return (sectors_per_row, "No route out of %d%s" % (from_sector, soc_str), [], False)
-        if route:
-            planet_name = [name for (name, sector) in self.planets if sector == route[1]]
-            route_str = "via %d and %s (%d)" % (route[0], planet_name[0], route[1])
+        if via:
+            route_str = "via %d and %s (%d)" % (via[1], via[2], via[3])
         else:
             route_str = "direct"
-        moves = start_dist+dist+end_dist
+        full_route = start_route + route + end_route
+        moves = len(full_route)
         if moves == 1:
             move_str = "move"
         else:
             move_str = "moves"
+        drones = drones_en_route(full_route, self.drones)
+        poss = self.route_traverses_unexplored_sectors(full_route)
         if from_sector == to_sector:
             return (moves,
                     "%d %s - %s (%d), to %d, to %d (%s)" % (moves,
@@ -1906,8 +4184,8 @@ class SectorMapParser():
                                                             from_sector,
                                                             end_sector,
                                                             end_name),
-                    start_drones + drones + end_drones,
-                    start_poss or poss or end_poss)
+                    drones,
+                    poss)
         return (moves,
                 "%d %s - %s (%d), to %d, %s to %d, to %d (%s)" % (moves,
                                                                   move_str,
@@ -1918,11 +4196,75 @@ class SectorMapParser():
                                                                   to_sector,
                                                                   end_sector,
                                                                   end_name),
-                start_drones + drones + end_drones,
-                start_poss or poss or end_poss)
+                drones,
+                poss)
+
+'''
+Popups for the first few sectors of sample_map_page(), with at least one of everything
+'''
+sample_popups = ['<b>Sector 1</b><br>Last Recorded Density: 3<br>Links To: 2, 34<br>'
+                 '<b>Planet:</b> Earth<br><b>Drones:</b> Illuminati<br>'
+                 '<b>Emergency IPT</b> to Boria<br><b>Your Drones:</b> 4<br>'
+                 '<b>NPC Store:</b> Salty Bob`s Waterin` Hole<br>LuvSat in sector!<br>'
+                 '<p><i>A note</i></p>',
+                 '<b>Sector 2</b><br>Last Recorded Density: 5<br>Links To: 1, 3, 34, 35, 36<br>'
+                 '<b>Trader Bob Trading Port #2</b><br>Alignment: %s<br>GE: 5 OC: -5<br>'
+                 '<b>Buying:</b> Lolnium Ore (50 SB)<br><b>Selling:</b> Afaikite Ore (60 SB)<br>'
+                 'Space Jellyfish in sector!<br>IR Warp from #2 to #500 (10 fuel)'
+                 % ssw_societies.full_name(ssw_societies.initial(5, -5)),
+                 '<b>Sector 3</b><br>Black Hole in sector!<br>'
+                 '<b>There is an asteroid in this sector:</b><br>Omgonite Ore<br>']
+
+def sample_map_page(sectors=3, popups=None, when='12:34 Jan 5, 3017'):
+    '''
+    Returns a map page (for tests) for the time when, with the popups
+    (defaulting to sample_popups) for the first sectors,
+    padded out with unexplored sectors
+    '''
+    if popups == None:
+        popups = sample_popups
+    popups = popups + ['<b>Sector %d</b><br>' % s
+                       for s in range(len(popups) + 1, sectors + 1)]
+    cells = []
+    for sector, popup in enumerate(popups, 1):
+        if 'Density' in popup:
+            colour = '#00ff00;'
+        else:
+            colour = '#999999;'
+        cells.append('<td width="4%%"><a style="background:%s">%d</a><div onmouseover="%s"></div></td>'
+                     % (colour, sector, popup))
+    return ('<html><body><span onmouseover="">UTC: %s</span>'
+            '<table><tr>%s</tr></table></body></html>' % (when, ''.join(cells)))
 
 # TODO Add lots more unit tests
 
+class ShortestRoutesMany(unittest.TestCase):
+    pairs = [(70, 500), (70, 700), (None, 900), (40, 500), (70, 900), (40, 1000)]
+
+    def testSameAsShortestRoute(self):
+        '''shortest_routes_many() should give the same results as shortest_route()'''
+        page = sample_map_page(len(all_sectors))
+        p = SectorMapParser(page)
+        expected = [SectorMapParser(page).shortest_route(src or dest, dest)
+                    for src, dest in self.pairs]
+        self.assertEqual(p.shortest_routes_many(self.pairs), expected)
+
+    def testOneSearchPerSource(self):
+        '''shortest_routes_many() should only search from each source once'''
+        p = SectorMapParser(sample_map_page(len(all_sectors)))
+        # Too few rows to keep the sources' rows between pairs
+        p.max_route_rows = 1
+        rows = p.route_rows()
+        searches = []
+        search = rows._search
+        def counting_search(from_sectors):
+            searches.append(tuple(from_sectors))
+            return search(from_sectors)
+        rows._search = counting_search
+        p.shortest_routes_many(self.pairs)
+        sources = [(40,), (70,), (900,)]
+        self.assertEqual(sorted([s for s in searches if s in sources]), sources)
+
 class CoordsKnownValues(unittest.TestCase):
     known_values = [(1, (0, 0)),
                     (2, (1, 0)),
@@ -1943,6 +4285,317 @@ class CoordsKnownValues(unittest.TestCase):
             result = coords_to_sector(col, row)
             self.assertEqual(result, sector)
 
+class GameRuleEpochs(unittest.TestCase):
+    def testEpochBoundaries(self):
+        '''game_rules() should match the rules worked out directly, either side of each change'''
+        offsets = [datetime.timedelta(microseconds=-1),
+                   datetime.timedelta(0),
+                   datetime.timedelta(microseconds=1),
+                   datetime.timedelta(hours=1)]
+        for d in rule_change_datetimes():
+            for offset in offsets:
+                rules = game_rules(d + offset)
+                self.assertEqual(rules.cycle, _cycle(d + offset))
+                self.assertEqual(rules.missing_links, _expected_missing_links(d + offset))
+                self.assertEqual(list(rules.planets), _expected_planets(d + offset))
+                self.assertEqual(list(rules.npc_stores), _expected_npc_stores(d + offset))
+
+    def testCycle(self):
+        '''cycle() should give 0 before the first cycle'''
+        self.assertEqual(cycle(cycle_start[1] - datetime.timedelta(1)), 0)
+        self.assertEqual(cycle(cycle_start[1]), 1)
+        self.assertEqual(cycle(cycle_start[-1]), len(cycle_start) - 1)
+
+class ValidationFindings(unittest.TestCase):
+    def testMessages(self):
+        '''ValidationFinding.message() should describe each kind of finding'''
+        self.assertEqual(ValidationFinding('error', 'asteroids total', None, 72, 70).message(),
+                         'Expected 72 asteroids, found 70')
+        self.assertEqual(ValidationFinding('warning', 'too many luvsats', None, 5, 6).message(),
+                         'code expects fewer luvsats')
+        self.assertEqual(ValidationFinding('warning', 'planet missing', 1, 'Earth', None).message(),
+                         'Planet Earth is missing from sector 1')
+        for kind in _finding_messages:
+            ValidationFinding('warning', kind, 1, 2, 3).message()
+
+    def testWarnings(self):
+        '''ValidationFinding.warning() should match what valid() has always printed'''
+        self.assertEqual(ValidationFinding('warning', 'too few asteroids', None, 72, 70).warning(),
+                         'WARNING: code expects more asteroids')
+        self.assertEqual(ValidationFinding('warning', 'ipt to unknown planet', 5, 'Boria', None).warning(),
+                         'WARNING: IPT in sector 5 goes to unknown planet Boria')
+        self.assertEqual(ValidationFinding('warning', 'black hole missing', 5, None, None).warning(),
+                         'WARNING Black hole is missing from sector 5')
+
+class ParseFields(unittest.TestCase):
+    attributes = {'ores': ['ores_bought', 'ores_sold'],
+                  'warps': ['warp_costs'],
+                  'jellyfish': ['jellyfish'],
+                  'luvsats': ['luvsats'],
+                  'black holes': ['black_holes'],
+                  'planets': ['planets'],
+                  'links': ['missing_links'],
+                  'npc stores': ['npc_stores'],
+                  'ipts': ['ipts'],
+                  'asteroids': ['asteroids'],
+                  'drones': ['drones', 'your_drones'],
+                  'trading ports': ['trading_ports'],
+                  'names': ['names'],
+                  'notes': ['notes']}
+
+    def testSameAsFullParse(self):
+        '''Parsing just some fields should give the same results for those fields'''
+        full = SectorMapParser(sample_map_page())
+        self.assertEqual(set(self.attributes), all_fields)
+        for field, attributes in six.iteritems(self.attributes):
+            p = SectorMapParser(sample_map_page(), [field])
+            for attribute in attributes:
+                expected = getattr(full, attribute)
+                found = getattr(p, attribute)
+                if attribute == 'trading_ports':
+                    expected = [(t.name, t.sector, t.buy_prices, t.sell_prices) for t in expected]
+                    found = [(t.name, t.sector, t.buy_prices, t.sell_prices) for t in found]
+                self.assertEqual(found, expected)
+                self.assertTrue(found, attribute)
+            self.assertEqual(p.unknown_sectors, [3])
+            self.assertEqual(p.known_sectors, 2)
+
+    def testOtherFieldsEmpty(self):
+        '''Fields that weren't asked for shouldn't be parsed'''
+        p = SectorMapParser(sample_map_page(), ['links', 'planets', 'drones'])
+        self.assertEqual(p.ipts, [])
+        self.assertEqual(p.trading_ports, [])
+        self.assertEqual(p.ores_sold, {})
+        self.assertEqual(p.jellyfish, [])
+
+    def testProcesses(self):
+        '''Parsing with several processes should give the same results'''
+        page = sample_map_page(len(all_sectors))
+        serial = SectorMapParser(page)
+        for processes in [2, 3]:
+            parallel = SectorMapParser(page, processes=processes)
+            for name in SectorMapParser.popup_attributes + ['forgotten_sectors']:
+                if name != 'trading_ports':
+                    self.assertEqual(getattr(parallel, name), getattr(serial, name))
+            self.assertEqual([t.name for t in parallel.trading_ports],
+                             [t.name for t in serial.trading_ports])
+
+    def testUnknownField(self):
+        '''Asking for a field that doesn't exist should raise ValueError'''
+        self.assertRaises(ValueError, SectorMapParser, sample_map_page(), ['wombats'])
+
+class Compact(unittest.TestCase):
+    def testSameInfo(self):
+        '''A compact()ed map should have the same info as before'''
+        page = sample_map_page()
+        p = SectorMapParser(page)
+        p2 = SectorMapParser(page, low_memory=True)
+        self.assertEqual(p2.soup, None)
+        for attr in SectorMapParser.popup_attributes:
+            if attr == 'trading_ports':
+                expected = [(t.name, t.sector, t.buy_prices, t.sell_prices) for t in p.trading_ports]
+                found = [(t.name, t.sector, t.buy_prices, t.sell_prices) for t in p2.trading_ports]
+                self.assertEqual(found, expected)
+            else:
+                self.assertEqual(getattr(p2, attr), getattr(p, attr))
+
+    def testShared(self):
+        '''compact()ed maps should only share values through the MapValues given'''
+        page = sample_map_page()
+        values = MapValues()
+        p = SectorMapParser(page, low_memory=True, values=values)
+        count = len(values)
+        p2 = SectorMapParser(page, low_memory=True, values=values)
+        self.assertEqual(len(values), count)
+        self.assertIs(p.planets[0][0], p2.planets[0][0])
+        self.assertIs(p.trading_ports[0].name, p2.trading_ports[0].name)
+        p3 = SectorMapParser(page, low_memory=True)
+        self.assertIsNot(p3.planets.values, values)
+        self.assertEqual(len(values), count)
+
+    def testCompactList(self):
+        '''A CompactList should behave like the list it replaces'''
+        values = MapValues()
+        expected = [('Earth', 1), ('Mars', 700)]
+        found = CompactList(expected, 'vH', values)
+        self.assertEqual(found, expected)
+        self.assertEqual(repr(found), repr(expected))
+        self.assertEqual(found[-1], ('Mars', 700))
+        self.assertEqual(found[:1], [('Earth', 1)])
+        self.assertTrue(('Earth', 1) in found)
+        self.assertEqual(found + [('Venus', 3)], expected + [('Venus', 3)])
+        found += [('Venus', 3)]
+        del found[0]
+        self.assertEqual(found, [('Mars', 700), ('Venus', 3)])
+        self.assertEqual(values.values, ['Earth', 'Mars', 'Venus'])
+        sectors = CompactList([5, 1089])
+        sectors.append(7)
+        self.assertEqual(sorted(sectors), [5, 7, 1089])
+        self.assertRaises(IndexError, sectors.__getitem__, 3)
+        copied = copy.copy(sectors)
+        copied.remove(5)
+        self.assertEqual(sectors, [5, 1089, 7])
+
+    def testCompactSectorDict(self):
+        '''A CompactSectorDict should behave like the dict it replaces'''
+        values = MapValues()
+        expected = {3: [4, 35], 1089: [1088]}
+        found = CompactSectorDict(expected, 'V', values)
+        self.assertEqual(found, expected)
+        self.assertEqual(list(found.keys()), [3, 1089])
+        found[2] = [1]
+        del found[3]
+        self.assertEqual(found, {2: [1], 1089: [1088]})
+        self.assertFalse(3 in found)
+        self.assertFalse(0 in found)
+        self.assertRaises(KeyError, found.__getitem__, 3)
+        self.assertEqual(found.get(1090), None)
+        copied = copy.copy(found)
+        del copied[2]
+        self.assertEqual(found, {2: [1], 1089: [1088]})
+
+class ScriptFields(unittest.TestCase):
+    '''
+    Each script should print the same with its script_fields as with all_fields
+    '''
+    # Two unexplored sectors with jellyfish, so the empaths are worth visiting
+    popups = sample_popups + ['<b>Sector 4</b><br>Space Jellyfish in sector!<br>',
+                              '<b>Sector 5</b><br>Space Jellyfish in sector!<br>']
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        for filename, when in [('ssw_sector_map.htm', '12:34 Jan 5, 3017'),
+                               ('later.htm', '12:34 Jan 6, 3017')]:
+            with open(os.path.join(self.dirname, filename), 'w') as f:
+                f.write(sample_map_page(len(all_sectors), self.popups, when))
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def run_script(self, script, fields, args):
+        '''
+        Runs the script, with script_fields[script] set to fields,
+        in self.dirname, and returns what it printed.
+        '''
+        saved = (script_fields[script], sys.argv, sys.stdout, os.getcwd())
+        script_fields[script] = fields
+        sys.argv = [script + '.py'] + args
+        sys.stdout = six.StringIO()
+        os.chdir(self.dirname)
+        try:
+            runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        script + '.py'),
+                           run_name='__main__')
+        except SystemExit:
+            pass
+        finally:
+            output = sys.stdout.getvalue()
+            (script_fields[script], sys.argv, sys.stdout, cwd) = saved
+            os.chdir(cwd)
+        return output
+
+    def check(self, script, args):
+        '''
+        Checks that script prints the same with its fields as with all_fields,
+        and returns what it printed.
+        valid() only checks, and enhance_map() only adds to, the fields that were parsed,
+        so what they print is left out.
+        '''
+        outputs = []
+        for fields in [all_fields, script_fields[script]]:
+            output = self.run_script(script, fields, args)
+            outputs.append([line for line in output.splitlines()
+                            if not (line.startswith('WARNING') or line.startswith('Added '))])
+        self.maxDiff = None
+        self.assertEqual(outputs[1], outputs[0])
+        return '\n'.join(outputs[0])
+
+    def testRoute(self):
+        '''ssw_route should find the same route, and give the same warnings'''
+        output = self.check('ssw_route', ['-l', '100', '500'])
+        self.assertIn('Total distance is', output)
+        self.assertIn("Don't forget to feed the empaths", output)
+
+    def testProbes(self):
+        '''ssw_probes should suggest the same probes'''
+        output = self.check('ssw_probes', [])
+        self.assertIn('Visit the empaths to explore these sectors: [4, 5]', output)
+
+    def testTrackMovement(self):
+        '''ssw_track_movement should report the same movements'''
+        output = self.check('ssw_track_movement', ['ssw_sector_map.htm', 'later.htm'])
+        self.assertIn('2 map file(s) parsed', output)
+
+class QuickScans(unittest.TestCase):
+    def setUp(self):
+        self.filenames = []
+        for sectors in [3, len(all_sectors), len(all_sectors), 0]:
+            f = tempfile.NamedTemporaryFile(suffix='.htm', delete=False)
+            if sectors:
+                f.write(sample_map_page(sectors).encode('utf-8'))
+            else:
+                f.write(b'Not a map')
+            f.close()
+            self.filenames.append(f.name)
+
+    def tearDown(self):
+        for filename in self.filenames:
+            os.remove(filename)
+
+    def testMatchesParser(self):
+        '''quick_scan() should find the same date and numbers of things as the parser'''
+        scan = quick_scan(self.filenames[0])
+        p = SectorMapParser(sample_map_page())
+        self.assertEqual(scan.datetime, p.datetime)
+        self.assertEqual(scan.sectors, 3)
+        for thing in _quick_scan_markers:
+            self.assertEqual(scan.counts[thing], len(getattr(p, thing.replace(' ', '_'))))
+        self.assertEqual(scan.problem(), 'Found 3 sectors, not 1089')
+
+    def testRejects(self):
+        '''quick_scan_files() should reject non-maps and later files for the same map date'''
+        results = list(quick_scan_files(self.filenames))
+        self.assertEqual([(name, reason, duplicate_of)
+                          for name, contents, reason, duplicate_of in results],
+                         [(self.filenames[0], 'Found 3 sectors, not 1089', None),
+                          (self.filenames[1], '', None),
+                          (self.filenames[2],
+                           'Same map date as %s' % self.filenames[1],
+                           self.filenames[1]),
+                          (self.filenames[3], 'No map date found', None)])
+        self.assertEqual(results[1][1], sample_map_page(len(all_sectors)).encode('utf-8'))
+        # Files that aren't worth parsing shouldn't be read
+        self.assertEqual([contents for name, contents, reason, duplicate_of in results if reason],
+                         [None, None, None])
+
+    def testArchives(self):
+        '''Compressed maps and tar archives of maps should read like the plain files'''
+        with open(self.filenames[1], 'rb') as f:
+            contents = f.read()
+        compressed = self.filenames[1] + '.gz'
+        with gzip.GzipFile(compressed, 'wb') as f:
+            f.write(contents)
+        self.filenames.append(compressed)
+        with open_map_file(compressed) as f:
+            self.assertEqual(f.read(), contents.decode('utf-8'))
+        self.assertEqual(quick_scan(compressed), quick_scan(self.filenames[1]))
+        archive = self.filenames[0] + '.tar.bz2'
+        with tarfile.open(archive, 'w:bz2') as tar:
+            tar.add(self.filenames[1], 'a.htm')
+            tar.add(compressed, 'b.htm.gz')
+        self.filenames.append(archive)
+        files = [(name, f.read()) for name, f in iter_map_files([archive, compressed])]
+        self.assertEqual([name for name, data in files], [archive + ':a.htm',
+                                                          archive + ':b.htm.gz',
+                                                          compressed])
+        self.assertEqual(files[0][1], contents)
+        self.assertEqual(files[1][1], contents)
+        self.assertEqual(files[2][1], contents)
+        self.assertEqual([(name, reason) for name, page, reason, duplicate_of
+                          in quick_scan_files([archive])],
+                         [(archive + ':a.htm', ''),
+                          (archive + ':b.htm.gz', 'Same map date as %s:a.htm' % archive)])
+
 class CoordsSanityCheck(unittest.TestCase):
     def testSanity(self):
         '''coords_to_sector(sector_to_coords(n)) == n for all n'''
@@ -2004,6 +4657,39 @@ class AdjacentSectors(unittest.TestCase):
             subset = adj_sectors_towards(sector, 500, True)
             self.assert_(set(subset).issubset((all_adj)))
 
+class PassableNeighbours(unittest.TestCase):
+    def testNoMissingLinks(self):
+        '''passable_neighbours should match adjacent_sectors if there are no missing links'''
+        for diagonal in [True, False]:
+            table = passable_neighbours(diagonal)
+            for sector in all_sectors:
+                self.assertEqual(list(table[sector]), adjacent_sectors(sector, diagonal))
+
+    def testMissingLinks(self):
+        '''passable_neighbours should exclude missing links, in one direction only'''
+        table = passable_neighbours(True, {102: [69, 103]})
+        self.assertEqual(table[102], (68, 70, 101, 134, 135, 136))
+        self.assert_(102 in table[103])
+
+    def testNonDiagonal(self):
+        '''passable_neighbours should only include orthogonal moves if told so'''
+        table = passable_neighbours(False, {102: [69]})
+        self.assertEqual(table[102], (101, 103, 135))
+
+class ReverseNeighbours(unittest.TestCase):
+    def testSymmetric(self):
+        '''reverse_neighbours should match passable_neighbours without missing links'''
+        n = passable_neighbours(True)
+        r = reverse_neighbours(n)
+        for s in all_sectors:
+            self.assertEqual(sorted(r[s]), sorted(n[s]))
+
+    def testOneWay(self):
+        '''reverse_neighbours should reflect one-way missing links'''
+        r = reverse_neighbours(passable_neighbours(False, {1: [2]}))
+        self.assertEqual(sorted(r[2]), [3, 35])
+        self.assertEqual(sorted(r[1]), [2, 34])
+
 class CanMove(unittest.TestCase):
     def testEmptyLists(self):
         '''can_move should return True if both missing_links and avoiding_sectors are empty'''
@@ -2044,6 +4730,315 @@ class CanMove(unittest.TestCase):
             result = can_move(sector, 150, [], [50, 100])
             self.assertEqual(result, True)
 
+class ShortestRouteDagKnownValues(unittest.TestCase):
+    missing_links = {35: [36, 68], 36: [35], 68: [35], 102: [69, 70]}
+
+    def testMatchesRoutesOfLength(self):
+        '''ShortestRouteDag should find the same routes, in the same order, as routes_of_length'''
+        for start, end in [(1, 4), (35, 101), (102, 36), (1, 1), (600, 534)]:
+            dag = ShortestRouteDag(start, end, True, self.missing_links)
+            expected = routes_of_length(dag.length, start, end, True, self.missing_links)
+            self.assertEqual(list(dag.routes()), expected)
+            self.assertEqual(dag.count(), len(expected))
+
+    def testNonDiagonal(self):
+        '''ShortestRouteDag should count routes correctly without diagonal moves'''
+        dag = ShortestRouteDag(1, 69, False)
+        self.assertEqual(dag.length, 4)
+        # Two moves right and two down, in any order
+        self.assertEqual(dag.count(), 6)
+        self.assertEqual(len(list(dag.routes())), 6)
+
+    def testLargeCount(self):
+        '''ShortestRouteDag should count routes without enumerating them'''
+        dag = ShortestRouteDag(1, 1089, False, max_length=65)
+        self.assertEqual(dag.length, 64)
+        # Choose which 32 of the 64 moves go right
+        self.assertEqual(dag.count(), 1832624140942590534)
+
+    def testNoRoute(self):
+        '''ShortestRouteDag should cope with there being no route'''
+        dag = ShortestRouteDag(1, 100, True, {}, [2, 34, 35])
+        self.assertEqual(dag.length, None)
+        self.assertEqual(dag.count(), 0)
+        self.assertEqual(list(dag.routes()), [])
+        self.assertEqual(dag.best_route(lambda s: 0), None)
+        self.assertEqual(routes(1, 100, True, {}, [2, 34, 35]), [])
+
+    def testAvoidingEnds(self):
+        '''ShortestRouteDag should find no route if either end is to be avoided'''
+        self.assertEqual(ShortestRouteDag(1, 4, True, {}, [1]).count(), 0)
+        self.assertEqual(ShortestRouteDag(1, 4, True, {}, [4]).count(), 0)
+
+    def testBestRoute(self):
+        '''best_route should pick the cheapest of the shortest routes'''
+        dag = ShortestRouteDag(1, 69, False)
+        expensive = [2, 35]
+        route = dag.best_route(lambda s: int(s in expensive))
+        self.assertEqual(route, [34, 67, 68, 69])
+        self.assertEqual(dag.best_route(lambda s: 0), next(dag.routes()))
+
+class SafestRoute(unittest.TestCase):
+    def testShortestFirst(self):
+        '''safest_route should always return a shortest route'''
+        route = safest_route(1, 4, True, {}, [], [2, 3, 35, 36])
+        self.assertEqual(len(route), 3)
+        self.assertEqual(route[-1], 4)
+
+    def testFewestDrones(self):
+        '''safest_route should avoid drones where a route of the same length allows'''
+        route = safest_route(1, 69, False, {}, [], [2, 35])
+        self.assertEqual(route, [34, 67, 68, 69])
+
+    def testFewestUnexplored(self):
+        '''safest_route should avoid unexplored sectors when drones are equal'''
+        route = safest_route(1, 69, False, {}, [], [], [2, 35])
+        self.assertEqual(route, [34, 67, 68, 69])
+
+    def testDronesBeforeUnexplored(self):
+        '''safest_route should prefer unexplored sectors to sectors with drones'''
+        route = safest_route(1, 36, False, {}, [], [2], [34])
+        self.assertEqual(route, [34, 35, 36])
+        route = safest_route(1, 36, False, {}, [], [], [34, 35])
+        self.assertEqual(route, [2, 3, 36])
+
+    def testAvoiding(self):
+        '''safest_route should honour missing links and sectors to avoid'''
+        self.assertEqual(safest_route(1, 3, True, {}, [2, 34, 35]), None)
+        self.assertEqual(safest_route(1, 1, True), [])
+        route = safest_route(1, 2, True, {1: [2]})
+        self.assertEqual(len(route), 2)
+
+    def testMaxLength(self):
+        '''safest_route should give up on routes of max_length or more'''
+        self.assertEqual(safest_route(1, 33, True, max_length=32), None)
+        self.assertEqual(len(safest_route(1, 33, True, max_length=33)), 32)
+
+class Bitsets(unittest.TestCase):
+    def testRoundTrip(self):
+        '''bits_to_sectors(sectors_to_bits(sectors)) should give back the sorted sectors'''
+        for sectors in [[], [1], [1089, 1, 500], all_sectors]:
+            self.assertEqual(bits_to_sectors(sectors_to_bits(sectors)), sorted(sectors))
+
+    def testExpandMatchesAdjacent(self):
+        '''expand_bits should add exactly the adjacent sectors'''
+        for diagonal in [True, False]:
+            masks = movement_masks(diagonal)
+            for sector in [1, 2, 33, 34, 102, 1057, 1089]:
+                result = bits_to_sectors(expand_bits(1 << sector, masks))
+                expected = sorted(adjacent_sectors(sector, diagonal) + [sector])
+                self.assertEqual(result, expected)
+
+    def testMissingLinks(self):
+        '''movement_masks should honour missing links'''
+        masks = movement_masks(True, {1: [2, 35]})
+        self.assertEqual(bits_to_sectors(expand_bits(1 << 1, masks)), [1, 34])
+
+class AccessibleSectors(unittest.TestCase):
+    def testOneMove(self):
+        '''accessible_sectors with max=1 should match adjacent_sectors'''
+        result = accessible_sectors(102, True, {}, [69], max=1)
+        self.assertEqual(result, set([68, 70, 101, 102, 103, 134, 135, 136]))
+
+    def testWalledIn(self):
+        '''accessible_sectors should stop at sectors to avoid'''
+        self.assertEqual(accessible_sectors(1, True, {}, [2, 34, 35]), set([1]))
+        self.assertEqual(accessible_sectors(1, True, {}, [1]), set())
+
+    def testConnected(self):
+        '''sectors_connected should find routes of any length'''
+        self.assert_(sectors_connected(1, 1089, True))
+        self.assert_(sectors_connected(1, 1089, False, {}, [35]))
+        self.assert_(not sectors_connected(1, 1089, True, {}, [2, 34, 35]))
+        self.assert_(not sectors_connected(1, 1089, True, {1: [2, 34, 35]}))
+        self.assert_(not sectors_connected(1, 1089, True, {}, [1089]))
+
+class DistancesByPolicy(unittest.TestCase):
+    def testMatchesSeparateSearches(self):
+        '''distances_by_policy should match a search for each set of blocked sectors'''
+        blocked = [[], [2, 35, 68], list(range(34, 67)), [1]]
+        distances = distances_by_policy([1, 500],
+                                        [sectors_to_bits(b) for b in blocked],
+                                        True,
+                                        max_length=20)
+        for b, d in zip(blocked, distances):
+            best = safest_routes_from([1, 500], True, {}, b, max_length=20)
+            for s in all_sectors:
+                if s in best:
+                    self.assertEqual(d[s], best[s][0])
+                else:
+                    self.assertEqual(d[s], 0xFFFF)
+
+    def testBlockedSource(self):
+        '''distances_by_policy should ignore blocked sources'''
+        distances = distances_by_policy([1], [sectors_to_bits([1])], True)
+        self.assertEqual(max(distances[0]), 0xFFFF)
+        self.assertEqual(min(distances[0]), 0xFFFF)
+
+class ConnectedComponents(unittest.TestCase):
+    def testCutOff(self):
+        '''connected_components should give a cut-off sector its own label'''
+        labels = connected_components(passable_neighbours(True), sectors_to_bits([2, 34, 35]))
+        self.assertEqual(labels[2], 0)
+        self.assertEqual(labels[1], 1)
+        self.assertNotEqual(labels[36], 1)
+        self.assertEqual(len(set(labels[s] for s in all_sectors)), 3)
+
+    def testOneWay(self):
+        '''connected_components should join sectors linked in just one direction'''
+        # You can move from 2 to 1, but not back
+        neighbours = passable_neighbours(False, {1: [2]})
+        labels = connected_components(neighbours, sectors_to_bits([34]))
+        self.assertEqual(labels[1], labels[2])
+        self.assertEqual(len(set(labels[s] for s in all_sectors)), 2)
+
+class UpdateDistances(unittest.TestCase):
+    def testMatchesNewSearch(self):
+        '''update_distances should give the same answer as searching again'''
+        neighbours = passable_neighbours(True)
+        predecessors = reverse_neighbours(neighbours)
+        sources = [1, 500, 1089]
+        old = sectors_to_bits([2, 35, 68, 501, 533, 534, 700])
+        for new in [sectors_to_bits([2, 35, 68, 501, 533, 534, 700, 34, 36]),
+                    sectors_to_bits([35, 68, 533, 534, 101, 102, 103]),
+                    sectors_to_bits([2, 1, 499, 466]),
+                    0]:
+            distances = distances_by_policy(sources, [old], True, max_length=16)[0]
+            update_distances(distances, sources, old, new, neighbours, predecessors, 16)
+            expected = distances_by_policy(sources, [new], True, max_length=16)[0]
+            self.assertEqual(distances, expected)
+
+    def testRouteRowsUpdate(self):
+        '''RouteRows.update should only forget rows that change'''
+        # Sector 1 is cut off
+        rows = RouteRows(True, {}, [2, 34, 35], [3], max_rows=5)
+        for s in [1, 1089]:
+            rows.row(s)
+        rows.update([2, 34, 35, 1088], [3])
+        self.assertEqual(list(rows.rows), [1])
+        rows.update([34, 35], [3])
+        self.assertEqual(list(rows.rows), [])
+        expected = RouteRows(True, {}, [34, 35], [3])
+        for s in [1, 1089]:
+            for t in all_sectors:
+                self.assertEqual(t in rows.row(s), t in expected.row(s))
+                if t in expected.row(s):
+                    self.assertEqual(rows.row(s)[t], expected.row(s)[t])
+
+class SafestRoutesFrom(unittest.TestCase):
+    def testNearestSource(self):
+        '''safest_routes_from should label each sector with the nearest source'''
+        best = safest_routes_from([1, 1089], True, max_length=40)
+        self.assertEqual(best[2][:4], (1, 0, 0, 0))
+        self.assertEqual(best[1088][:4], (1, 0, 0, 1))
+        self.assertEqual(len(best), len(all_sectors))
+
+    def testTieBreaks(self):
+        '''safest_routes_from should prefer safer routes, then earlier sources'''
+        best = safest_routes_from([1, 5], False, {}, [], [2])
+        # Both are two moves from 3, but the route from 1 passes a drone
+        self.assertEqual(best[3][:4], (2, 0, 0, 1))
+        best = safest_routes_from([1, 5], False)
+        self.assertEqual(best[3][:4], (2, 0, 0, 0))
+
+    def testRouteTo(self):
+        '''route_to should extract the route from the nearest source'''
+        best = safest_routes_from([1, 1089], True, max_length=40)
+        self.assertEqual(route_to(best, 1), [])
+        self.assertEqual(route_to(best, 4), [2, 3, 4])
+        self.assertEqual(len(route_to(best, 1057)), 32)
+
+    def testMaxLength(self):
+        '''safest_routes_from should only label sectors nearer than max_length'''
+        best = safest_routes_from([1], True, max_length=3)
+        self.assertEqual(sorted(best), [1, 2, 3, 34, 35, 36, 67, 68, 69])
+        self.assertEqual(route_to(best, 4), None)
+
+class RouteRowsKnownValues(unittest.TestCase):
+    def testRowMatchesDict(self):
+        '''A RouteRow should give the same answers as the dict it was made from'''
+        best = safest_routes_from([1, 1089], True, {}, [500], [2, 3])
+        row = RouteRow(best)
+        for s in all_sectors:
+            self.assertEqual(s in row, s in best)
+            if s in best:
+                self.assertEqual(row[s], best[s])
+        self.assertEqual(route_to(row, 4), route_to(best, 4))
+
+    def testLru(self):
+        '''RouteRows should only remember max_rows rows'''
+        rows = RouteRows(True, max_rows=2)
+        for s in [1, 2, 1, 3, 1, 2]:
+            rows.row(s)
+        self.assertEqual(rows.searches, 4)
+        self.assertEqual(list(rows.rows), [1, 2])
+
+    def testFull(self):
+        '''RouteRows should compute every row once full_threshold is reached'''
+        rows = RouteRows(False, max_rows=2, full_threshold=3)
+        rows.row(1)
+        rows.row(2)
+        self.assertEqual(rows.full, None)
+        self.assertEqual(route_to(rows.row(3), 69), route_to(safest_routes_from([3], False, max_length=40), 69))
+        # Rows already computed should be re-used
+        self.assertEqual(rows.searches, len(all_sectors))
+        self.assertEqual(rows.row(1)[1089][0], 64)
+        self.assertEqual(rows.searches, len(all_sectors))
+
+    def testMultipleSources(self):
+        '''RouteRows should accept tuples of sectors'''
+        rows = RouteRows(True)
+        self.assertEqual(rows.row((1, 1089))[1088][:4], (1, 0, 0, 1))
+
+class KShortestRoutes(unittest.TestCase):
+    def testMatchesRoutes(self):
+        '''k_shortest_routes should start with all the shortest routes'''
+        found = list(itertools.islice(k_shortest_routes(1, 69, False), 6))
+        self.assertEqual(sorted(found), sorted(routes(1, 69, False)))
+
+    def testLonger(self):
+        '''k_shortest_routes should go on to find longer routes'''
+        found = list(itertools.islice(k_shortest_routes(1, 3, False), 4))
+        self.assertEqual(found[0], [2, 3])
+        self.assertEqual([len(r) for r in found[1:]], [4, 4, 4])
+        for r in found:
+            self.assertEqual(len(set(r)), len(r))
+            self.assertTrue(1 not in r)
+
+    def testDronesFirst(self):
+        '''k_shortest_routes should prefer routes that avoid drones'''
+        found = list(itertools.islice(k_shortest_routes(1, 3, True, {}, [], [2]), 2))
+        self.assertEqual(found[0], [35, 3])
+        self.assertEqual(found[1], [2, 3])
+
+    def testExhausted(self):
+        '''k_shortest_routes should stop when there are no more routes'''
+        found = list(k_shortest_routes(1, 1, True))
+        self.assertEqual(found, [[]])
+        found = list(k_shortest_routes(1, 35, True, max_length=2))
+        self.assertEqual(found, [[35]])
+
+class ParetoRoutes(unittest.TestCase):
+    def testNoWarps(self):
+        '''pareto_routes should find just the shortest route without warps'''
+        self.assertEqual(pareto_routes(1, 4, True), [(3, 0, [2, 3, 4])])
+        self.assertEqual(pareto_routes(1, 1, True), [(0, 0, [])])
+
+    def testWarp(self):
+        '''pareto_routes should offer a warp as a quicker, dearer option'''
+        warps = warp_graph({1: {1089: 50}})
+        self.assertEqual(pareto_routes(1, 1089, True, warps, max_length=40),
+                         [(1, 50, [1089]), (32, 0, route_to(safest_routes_from([1], True, max_length=40), 1089))])
+        # Not worth it if it's no quicker
+        self.assertEqual(pareto_routes(1, 1089, True, warps, max_length=30), [(1, 50, [1089])])
+
+    def testDominated(self):
+        '''pareto_routes should drop routes that are slower and dearer'''
+        warps = warp_graph({1: {100: 60, 1089: 50}, 100: {1089: 10}})
+        # Warping twice is slower and dearer than warping straight there
+        self.assertEqual(pareto_routes(1, 1089, True, warps),
+                         [(1, 50, [1089]), (4, 10, [34, 67, 100, 1089])])
+
 class DirectDistance(unittest.TestCase):
     def testSelf(self):
         '''distance to the same sector is always zero'''
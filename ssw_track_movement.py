@@ -8,6 +8,8 @@ from __future__ import absolute_import
 from __future__ import print_function
 import ssw_sector_map2 as ssw_sector_map
 import ssw_utils
+import ssw_map_utils
+import ssw_price_history
 import operator, sys, getopt, datetime, copy, glob
 
 version = 0.01
@@ -22,6 +24,9 @@ track_trading_port_movement = False
 track_trading_port_prices = False
 track_ipt_beacons = False
 track_luvsats = True
+track_warp_costs = False
+# Directory to keep the trading port price history in, if any
+price_history_dir = None
 fout = sys.stdout
 
 def bool_to_str(the_bool):
@@ -33,49 +38,6 @@ def bool_to_str(the_bool):
     else:
         return "not "
 
-def cmp_map_datetimes(x,y):
-    '''
-    Comparison function for two datetimes
-    '''
-    if x.datetime > y.datetime:
-        return 1
-    elif x.datetime == y.datetime:
-        return 0
-    else:
-        return -1
-
-def mean(seq):
-    '''
-    Return the mean of the numbers in a list
-    '''
-    return sum(seq)/float(len(seq))
-
-def median1(seq):
-    '''
-    Alternative function to calculate the median of the numbers in a list
-    '''
-    "Return the median of the list of numbers."
-    # Sort the list and take the middle element.
-    n = len(seq)
-    copy = seq[:] # So that "numbers" keeps its original order
-    copy.sort()
-    if n & 1:         # There is an odd number of elements
-        return copy[n // 2]
-    else:
-        return (copy[n // 2 - 1] + copy[n // 2]) / 2
-
-def median(seq):
-    '''
-    Find the median of the numbers in a list
-    '''
-    return sorted(seq)[len(seq)/2]
-
-def mode(seq):
-    '''
-    Return the mode of the numbers in a list
-    '''
-    return max([seq.count(y),y] for y in seq)[1]
-
 def sum_of_squares(sector_pairings):
     '''
     Takes a list of tuples where each tuple is a pair of secotr numbers
@@ -95,10 +57,11 @@ def closest_mapping(from_sectors,to_sectors):
     and returns it as a list of tuples where each tuple is a pair of sector numbers,
     one from each list
     Returns an empty list if the two lists of sectors have different lengths
+    or are empty
     '''
 #    print "closest_mapping(%s,%s)" % (from_sectors,to_sectors)
 #    print "len(from_sectors) = %d, len(to_sectors) = %d" % (len(from_sectors),len(to_sectors))
-    if len(from_sectors) != len(to_sectors):
+    if (len(from_sectors) != len(to_sectors)) or (len(from_sectors) == 0):
         return []
     if len(from_sectors) == 1:
         # There's only one way to pair them up
@@ -136,40 +99,108 @@ def usage():
     '''
     Print how to use this script
     '''
-    print("Usage: %s [map_filenames]" % sys.argv[0])
+    print("Usage: %s [-w] [-p dirname] [map_filenames]" % sys.argv[0])
+    print()
+    print(" Map files can be compressed, tar archives of maps, directories or glob patterns")
     print()
     print(" Find how things move in SSW")
     print()
-    print("  default is to %strack asteroids, to %strack black holes, to %strack NPC stores, to %strack jellyfish, to %strack trading port movement, to %strack trading port prices, to %strack IPT beacons and to %strack luvsats" % (bool_to_str(track_asteroids),bool_to_str(track_black_holes),bool_to_str(track_npc_stores),bool_to_str(track_jellyfish),bool_to_str(track_trading_port_movements),bool_to_str(track_trading_port_prices),bool_to_str(track_ipt_beacons),bool_to_str(track_luvsats)))
+    print("  -h|--help - print this usage message")
+    print("  -w|--warp_costs - check whether warp costs are the same in both directions")
+    print("  -p|--price_history dirname - track trading port prices, adding the maps to")
+    print("                               the price history kept in dirname")
+    print("  default is to %strack asteroids, to %strack black holes, to %strack NPC stores, to %strack jellyfish, to %strack trading port movement, to %strack trading port prices, to %strack IPT beacons, to %strack luvsats and to %scheck warp cost symmetry" % (bool_to_str(track_asteroids),bool_to_str(track_black_holes),bool_to_str(track_npc_stores),bool_to_str(track_jellyfish),bool_to_str(track_trading_port_movement),bool_to_str(track_trading_port_prices),bool_to_str(track_ipt_beacons),bool_to_str(track_luvsats),bool_to_str(track_warp_costs)))
     print()
     print(" Version %.2f. Brought to you by Squiffle" % version)
 
 # Parse command-line options
-if len(sys.argv) > 1:
-    map_files = sys.argv[1:]
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "hwp:", ["help", "warp_costs", "price_history="])
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for opt,arg in opts:
+    if (opt == '-h') or (opt == '--help'):
+        usage()
+        sys.exit(0)
+    elif (opt == '-w') or (opt == '--warp_costs'):
+        track_warp_costs = True
+    elif (opt == '-p') or (opt == '--price_history'):
+        track_trading_port_prices = True
+        price_history_dir = arg
+
+if len(args) > 0:
+    map_files = args
 else:
     # TODO Need to find some default map files
     pass
 
-# Read and parse each sector map
+# Only parse what we're going to track (and the IPTs, which are always printed)
+fields = set(ssw_sector_map.script_fields['ssw_track_movement'])
+if track_asteroids:
+    fields.add('asteroids')
+if track_black_holes:
+    fields.add('black holes')
+if track_npc_stores:
+    fields.add('npc stores')
+if track_jellyfish:
+    fields.add('jellyfish')
+if track_trading_port_movement:
+    fields.add('trading ports')
+if track_trading_port_prices:
+    fields.add('ores')
+if track_ipt_beacons:
+    fields.add('ipts')
+if track_luvsats:
+    fields.add('luvsats')
+if track_warp_costs:
+    fields.add('warps')
+
+# Read and parse each sector map, weeding out files that aren't maps,
+# or duplicate another map, without parsing them
+# The maps are all compacted, sharing one table of values.
+# Prices go straight into the price history, rather than being kept with the maps
 maps = []
-for filename in map_files:
-    page = open(filename)
-    p = ssw_sector_map.SectorMapParser(page)
+if track_trading_port_prices:
+    price_history = ssw_price_history.PriceHistory(price_history_dir)
+map_values = ssw_sector_map.MapValues()
+map_count = 0
+duplicate_count = 0
+for filename, page, reason, duplicate_of in ssw_sector_map.quick_scan_files(map_files):
+    map_count += 1
+    if duplicate_of:
+        duplicate_count += 1
+        print('"%s" is the same map as "%s"' % (filename, duplicate_of), file=fout)
+        continue
+    if reason:
+        print('"%s" doesn\'t seem to be an SSW map file - %s' % (filename, reason), file=fout)
+        continue
+    p = ssw_sector_map.SectorMapParser(page, fields, low_memory=True, values=map_values)
 
     (map_valid, reason) = p.valid()
     if map_valid:
+        if track_trading_port_prices:
+            price_history.add_map(p)
+            p.ores_bought = {}
+            p.ores_sold = {}
         maps.append((filename,p))
     else:
         print('"%s" doesn\'t seem to be an SSW map file - %s' % (filename, reason), file=fout)
 
+if price_history_dir:
+    price_history.save()
+
 # Sort maps by date
-maps.sort(key=operator.itemgetter(1),cmp=cmp_map_datetimes)
+maps.sort(key=lambda item: item[1].datetime)
 
 # Print summary
-temp = (len(map_files) - len(maps))
+temp = (map_count - duplicate_count - len(maps))
 if temp > 0 :
     print("%d file(s) weren't SSW map files" % temp, file=fout)
+if duplicate_count > 0:
+    print("%d file(s) were the same map as another" % duplicate_count, file=fout)
+if (temp > 0) or (duplicate_count > 0):
     print(file=fout)
 print("%d map file(s) parsed" % len(maps), file=fout)
 for f,m in maps:
@@ -264,24 +295,24 @@ if track_trading_port_movement or track_trading_port_prices:
             else:
                 print("Can't map - %d trading ports became %d" % (len(m.trading_ports), len(m2.trading_ports)), file=fout)
         if track_trading_port_prices:
-            for ore in m.ores_sold.keys():
-                print(" %s sold in %d ports on %s vs %d on %s" % (ore, len(m.ores_sold[ore]), str(m.datetime), len(m2.ores_sold[ore]), str(m2.datetime)), file=fout)
-                count = 0
-                prices = [price for price,s in m.ores_sold[ore]]
-                for price,port in m.ores_sold[ore]:
-                    if port not in [s for p,s in m2.ores_sold[ore]]:
-                        count += 1
-    #                    print >>fout, " Port in %d stopped selling %s at %d" % (port,ore,price)
-                print(" %d ports stopped selling %s" % (count, ore), file=fout)
-                print(" Prices for %s ranged from %d to %d. Mean = %f, median = %d, mode = %d" % (ore, min(prices), max(prices), mean(prices), median(prices), mode(prices)), file=fout)
-                count = 0
-                prices = [price for price,s in m2.ores_sold[ore]]
-                for price,port in m2.ores_sold[ore]:
-                    if port not in [s for p,s in m.ores_sold[ore]]:
-                        count += 1
-    #                    print >>fout, " Port in %d started selling %s at %d" % (port,ore,price)
-                print(" %d ports started selling %s" % (count, ore), file=fout)
-                print(" Prices for %s now range from %d to %d. Mean = %f, median = %d, mode = %d" % (ore, min(prices), max(prices), mean(prices), median(prices), mode(prices)), file=fout)
+            for ore in price_history.ores:
+                prices = price_history.map_prices(ore, False, m.datetime)
+                if len(prices) == 0:
+                    continue
+                prices2 = price_history.map_prices(ore, False, m2.datetime)
+                print(" %s sold in %d ports on %s vs %d on %s" % (ore, len(prices), str(m.datetime), len(prices2), str(m2.datetime)), file=fout)
+                (started, stopped) = price_history.port_changes(ore, False, m.datetime, m2.datetime)
+    #            for port in stopped:
+    #                print >>fout, " Port in %d stopped selling %s" % (port,ore)
+                print(" %d ports stopped selling %s" % (len(stopped), ore), file=fout)
+                stats = ssw_price_history.price_stats(prices)
+                print(" Prices for %s ranged from %d to %d. Mean = %f, median = %d, mode = %d" % ((ore,) + stats), file=fout)
+    #            for port in started:
+    #                print >>fout, " Port in %d started selling %s" % (port,ore)
+                print(" %d ports started selling %s" % (len(started), ore), file=fout)
+                if len(prices2) > 0:
+                    stats = ssw_price_history.price_stats(prices2)
+                    print(" Prices for %s now range from %d to %d. Mean = %f, median = %d, mode = %d" % ((ore,) + stats), file=fout)
             # TODO Look at price changes
 
 for f,m in maps:
@@ -328,3 +359,11 @@ if track_luvsats:
         else:
             print("Can't map - %d luvsats became %d" % (len(m.luvsats), len(m2.luvsats)), file=fout)
 
+if track_warp_costs:
+    print(file=fout)
+    asymmetric = ssw_map_utils.asymmetric_warp_costs([m for f,m in maps])
+    if len(asymmetric) > 0:
+        for start, end, fuels, reverse_fuels in asymmetric:
+            print("Warp from %d to %d costs %s fuel, but %s fuel the other way" % (start, end, fuels, reverse_fuels), file=fout)
+    else:
+        print("All warp costs seen in both directions are symmetric", file=fout)
@@ -24,7 +24,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 import ssw_sector_map2 as ssw_sector_map
 import ssw_map_utils, ssw_societies, ssw_utils
-import operator, sys, getopt, datetime
+import operator, sys, getopt, datetime, itertools
 import six
 from six.moves import map
 
@@ -88,8 +88,8 @@ def print_best_ore_prices(p, ore_best_sectors, indent, society, buy, sell, unexp
     assert (buy or sell)
     routes_printed = 0
     # TODO print the alignment info that's in ore_best_sectors
-    best_sectors = [sector for sector, alignment in ore_best_sectors]
-    routes = ssw_map_utils.best_routes(p, best_sectors, None, society, unexplored_sector_society)
+    pairs = [(None, sector) for sector, alignment in ore_best_sectors]
+    routes = ssw_map_utils.ranked_routes(p, pairs, society, unexplored_sector_society)
     for dis, route, drones, src, dest, poss in routes:
         print("%s%s" % (indent, route), end=' ', file=fout)
         # Only count routes that can be taken
@@ -113,18 +113,31 @@ def print_best_ore_prices(p, ore_best_sectors, indent, society, buy, sell, unexp
             print(file=fout)
     return routes_printed
 
-def print_routes(p, sources, destinations, society, trade_at_start, unexplored_sector_society=None, max=200):
+def print_alternatives(p, src, dest, alternatives, society, unexplored_sector_society=None):
+    '''
+    Prints up to alternatives different routes flying from src to dest
+    '''
+    for dis, route, drones, poss in p.alternative_routes(src,
+                                                         dest,
+                                                         alternatives,
+                                                         society,
+                                                         unexplored_sector_society):
+        print("      or fly %d moves - %s" % (dis, ssw_utils.sector_str(route)), end=' ', file=fout)
+        if len(p.drones):
+            print(ssw_utils.drones_str(drones, poss), file=fout)
+        else:
+            print(file=fout)
+
+def print_routes(p, sources, destinations, society, trade_at_start, unexplored_sector_society=None, max=200, alternatives=0):
     '''
     Prints the best routes from each source sector to each destination sector
+    and up to alternatives other ways to fly between them
     Returns the number of routes printed
     '''
-    routes = []
     routes_printed = 0
-    for src in sources:
-        for x in ssw_map_utils.best_routes(p, destinations, src, society, unexplored_sector_society):
-            routes.append(x)
-    routes = sorted(routes,key=operator.itemgetter(0))
-    for route in routes[:max]:
+    pairs = [(src, dest) for src in sources for dest in destinations]
+    routes = ssw_map_utils.ranked_routes(p, pairs, society, unexplored_sector_society)
+    for route in itertools.islice(routes, max):
         print("    %s " % (route[1]), end=' ', file=fout)
         # Is there actually a route between those sectors ?
         if route[0] < ssw_sector_map.sectors_per_row:
@@ -147,6 +160,8 @@ def print_routes(p, sources, destinations, society, trade_at_start, unexplored_s
                 print(ssw_utils.drones_str(route[2], route[5]), file=fout)
             else:
                 print(file=fout)
+            if alternatives > 0:
+                print_alternatives(p, route[3], route[4], alternatives, society, unexplored_sector_society)
         else:
             print(file=fout)
     print(file=fout)
@@ -268,7 +283,7 @@ def usage(progname, map_file):
     '''
     Prints usage information
     '''
-    print("Usage: %s [-s] [-m] [-t] [-h] [-j] [-p] [-c] [-b] [-l] [-a] [-w] [-y] [-n] [-e] [-x] [-d {a|e|i|o|t}] [-r ore] [-g ore_list] [-i asteroids_filename] [-o output_filename] [map_filename]" % progname)
+    print("Usage: %s [-s] [-m] [-t] [-h] [-j] [-p] [-c] [-b] [-l] [-a] [-w] [-y] [-n] [-e] [-x] [-v] [-d {a|e|i|o|t}] [-k count] [-r ore] [-g ore_list] [-i asteroids_filename] [-o output_filename] [map_filename]" % progname)
     print()
     print(" Find trade or mining routes")
     print()
@@ -288,7 +303,9 @@ def usage(progname, map_file):
     print("  -n|--control - list number of sectors controlled by each society")
     print("  -e|--empire - assume that unexplored sectors contain Amaranth drones")
     print("  -x|--links - print the missing links")
+    print("  -v|--verbose - also print how well the route cache did")
     print("  -d|--drones {a|e|i|o|t} - avoid drones not belonging to the specified society")
+    print("  -k|--alternatives count - also list up to count other routes for each trade or mining route")
     print("  -r|--ore - list all the places to get the specified ore")
     print("  -i|--input - read extra asteroid info from the specified file (pointless unless they've moved since the map was saved)")
     print("  -o|--output - write output to the specified file")
@@ -342,17 +359,19 @@ def main(*arguments):
     max_mining_routes = 5
     min_buy_routes = 3
     routes_to_print = 15
+    alternatives = 0
     society = None
     unexplored_sector_society = None
     ore_of_interest = None
     output_filename = None
     ores_to_buy = []
+    verbose = False
 
     global fout
 
     # Parse command-line options
     try:
-        opts, args = getopt.getopt(arguments,"smthjpcblawynexd:r:g:i:o:",["no-summary","no-trade","no-mining","help","dont-enhance","prices","cheapest-ore","shield-ore","luvsats","asteroids","ports","probe","your-drones","control","empire","links","drones=","ore=","groceries=","input=","output="])
+        opts, args = getopt.getopt(arguments,"smthjpcblawynexvd:k:r:g:i:o:",["no-summary","no-trade","no-mining","help","dont-enhance","prices","cheapest-ore","shield-ore","luvsats","asteroids","ports","probe","your-drones","control","empire","links","verbose","drones=","alternatives=","ore=","groceries=","input=","output="])
     except getopt.GetoptError:
         usage(sys.argv[0], map_file)
         sys.exit(2)
@@ -382,6 +401,12 @@ def main(*arguments):
                 print('Unrecognised society "%s" - should be one of %s' % (arg, ssw_societies.initials))
                 usage(sys.argv[0], map_file)
                 sys.exit(2)
+        elif (opt == '-k') or (opt == '--alternatives'):
+            try:
+                alternatives = int(arg)
+            except ValueError:
+                usage(sys.argv[0], map_file)
+                sys.exit(2)
         elif (opt == '-p') or (opt == '--prices'):
             print_buy_prices = True
             print_sell_prices = True
@@ -403,6 +428,8 @@ def main(*arguments):
             print_sectors_controlled = True
         elif (opt == '-e') or (opt == '--empire'):
             unexplored_sector_society = ssw_societies.adjective('a')
+        elif (opt == '-v') or (opt == '--verbose'):
+            verbose = True
         elif (opt == '-x') or (opt == '--links'):
             print_missing_links = True
         elif (opt == '-r') or (opt == '--ore'):
@@ -427,8 +454,9 @@ def main(*arguments):
             asteroids_file = arg
     
     # Read and parse the sector map
-    page = open(map_file)
-    p = ssw_sector_map.SectorMapParser(page)
+    # We report on pretty much everything, so parse all of it
+    page = ssw_sector_map.open_map_file(map_file)
+    p = ssw_sector_map.SectorMapParser(page, ssw_sector_map.script_fields['ssw_trade_routes'])
     
     map_valid,reason = p.valid()
     if not map_valid:
@@ -559,7 +587,7 @@ def main(*arguments):
                 # Don't count it if there are no routes
                 buy_sects = [sector for sector, alignment in buy_sectors]
                 sell_sects = [sector for sector, alignment in sell_sectors]
-                if 0 < print_routes(p, buy_sects, sell_sects, society, True, unexplored_sector_society, routes_to_print):
+                if 0 < print_routes(p, buy_sects, sell_sects, society, True, unexplored_sector_society, routes_to_print, alternatives):
                     trade_routes += 1
         if trade_routes < max_trade_routes:
             if trade_routes == 0:
@@ -592,7 +620,8 @@ def main(*arguments):
                                     society,
                                     False,
                                     unexplored_sector_society,
-                                    routes_to_print):
+                                    routes_to_print,
+                                    alternatives):
                     mining_routes += 1
         if mining_routes < max_mining_routes:
             if mining_routes == 0:
@@ -700,16 +729,17 @@ def main(*arguments):
         for ore in ores_to_buy:
             # Cheapest price is the first in the list
             (price, sector_list) = ore_buy[ore][0]
-            ports[ore] = sector_list
+            ports[ore] = [sector for sector, alignment in sector_list]
             ores_str[ore] = '%s for %d' % (ore, price)
-            for sector in sector_list:
-                (distance, route, drones, src, dest, poss) = ssw_map_utils.best_route_to_sector(p,
-                                                                                                sector,
-                                                                                                None,
-                                                                                                society,
-                                                                                                unexplored_sector_society)
-                distances[sector] = distance
-                route_by_port[sector] = route
+        all_ports = sorted(set([sector for ore in ores_to_buy for sector in ports[ore]]))
+        for (distance, route, drones, src, dest, poss) in ssw_map_utils.best_routes(p,
+                                                                                    all_ports,
+                                                                                    None,
+                                                                                    society,
+                                                                                    unexplored_sector_society,
+                                                                                    False):
+            distances[dest] = distance
+            route_by_port[dest] = route
         # Now check whether we can save time by buying two ores at once
         # Find all the combos of ports we could use
         port_sets = []
@@ -818,6 +848,11 @@ def main(*arguments):
         print("**** Don't forget to feed the empaths at New Ceylon")
         print("**** That will explore %d sector(s) : %s" % (len(unknown_sectors_with_jellyfish), str(sorted(list(unknown_sectors_with_jellyfish)))))
     
+    if verbose:
+        (hits, misses, max_size, size) = p.route_cache_info()
+        print(file=fout)
+        print("Route cache: %d hits, %d misses (%.1f%% hit rate), %d of %d routes kept" % (hits, misses, 100.0 * hits / max(hits + misses, 1), size, max_size), file=fout)
+
     if output_filename != None:
         fout.close()
 
@@ -10,10 +10,12 @@ from __future__ import absolute_import
 import unittest
 import ssw_societies
 
-class TradingPort:
+class TradingPort(object):
     '''
     Class to store everything about one trading port
     '''
+    __slots__ = ('name', 'sector', 'good', 'order', 'buy_prices', 'sell_prices')
+
     def __init__(self, name, sector, good, order, buy_prices, sell_prices):
         self.name = name
         self.sector = sector